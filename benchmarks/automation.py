@@ -0,0 +1,55 @@
+# Messages sent for dense automation lanes, as Quadratic events against
+# curves sampled into server buffers, and the error of the sampled curves.
+#
+#     python3 -m benchmarks.automation
+from sequencer import SequenceBuilder, Quadratic
+import music
+import numpy as np
+import time
+
+RATE = 200.0
+
+def make_builder(bars=128, lanes=8, envelope_rate=None):
+    sb = SequenceBuilder({}, envelope_rate=envelope_rate)
+    for i in range(bars // 4):
+        sb.quadratic(i * 4.0, "tempo", i % 2 == 1, 90.0 + 30.0 * (i % 3))
+    # Every lane ramps between values sixteen times a bar.
+    for lane in range(lanes):
+        for i in range(bars * 16):
+            sb.quadratic(i / 16, f"lane{lane}", i % 4 != 0, float((i * 7 + lane) % 11))
+    return sb
+
+def build(sb, bars=128):
+    start = time.perf_counter()
+    sequence = sb.build(bars)
+    return time.perf_counter() - start, sequence
+
+def max_error(sb, sequence):
+    tempo = sequence.tempo
+    ts = np.arange(len(next(iter(sequence.automation.values())))) / RATE
+    inside = ts <= sequence.end
+    bars = tempo.times_to_bars(ts[inside])
+    worst = 0.0
+    for tag, curve in sequence.automation.items():
+        env = music.envelope(sorted(sb.quadratics[tag], key=lambda x: x[0]))
+        expect = np.array([env.evaluate(b) for b in bars.tolist()])
+        worst = max(worst, float(np.max(np.abs(curve[inside] - expect))))
+    return worst
+
+if __name__ == "__main__":
+    seeks = 32
+    sb = make_builder()
+    seconds, sequence = build(sb)
+    messages = sum(1 for e in sequence.com if isinstance(e, Quadratic) and e.tag != "tempo")
+    print(f"quadratic build={1000*seconds:8.2f}ms playback={messages:6} messages "
+          f"seek={seeks*8:4} messages")
+
+    sb = make_builder(envelope_rate=RATE)
+    seconds, sequence = build(sb)
+    frames = sum(len(c) for c in sequence.automation.values())
+    # b_alloc, b_setn per 1024 frames, s_new and n_run per lane, then one
+    # n_set per lane on play and on every seek.
+    upload = sum(2 + (len(c) + 1023) // 1024 + 1 for c in sequence.automation.values())
+    print(f"buffer    build={1000*seconds:8.2f}ms playback={upload:6} messages "
+          f"seek={seeks*8:4} messages, {frames} frames, "
+          f"max error {max_error(sb, sequence):.2e}")
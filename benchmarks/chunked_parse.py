@@ -0,0 +1,70 @@
+# Whole document parses against reading declaration by declaration.
+#
+#     python3 -m benchmarks.chunked_parse [file.seq]
+#
+# The document is widened into a library of clips by copying its
+# declarations under new names. The process pool is measured once while
+# it starts and once more after its workers are up. After the first read,
+# one clip is edited the way an external editor would and the file is
+# read again.
+from model2.parse import from_string, DocumentReader, chunks
+import os
+import re
+import sys
+import time
+
+def library(source, copies):
+    pieces = chunks(source)
+    declarations = [text for kind, text in pieces if kind == "declaration"]
+    rest = [text for kind, text in pieces if kind != "declaration"]
+    out = ["oscillseq aqua"] + declarations
+    for i in range(copies):
+        for text in declarations:
+            out.append(re.sub(r"^(\w+)", lambda m: f"{m.group(1)}_{i}", text))
+    return "\n\n".join(out + rest) + "\n"
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+if __name__ == "__main__":
+    filename = sys.argv[1] if len(sys.argv) > 1 else "examples/melody.seq"
+    with open(filename, encoding="utf-8") as fd:
+        source = library(fd.read(), 300)
+    t_full, full = measure(from_string, source)
+    reader = DocumentReader(processes=1)
+    t_cold, doc = measure(reader.read, source)
+    assert repr(doc) == repr(full)
+    print(f"{len(doc.declarations)} declarations, {len(source)/1024:.0f}KiB: "
+          f"whole={1000*t_full:.1f}ms chunked cold={1000*t_cold:.1f}ms")
+    pool = DocumentReader(processes=max(2, os.cpu_count() or 1), parallel=1)
+    t_pool, doc = measure(pool.read, source)
+    assert repr(doc) == repr(full)
+    pool.chunks.clear()
+    t_again, doc = measure(pool.read, source)
+    assert repr(doc) == repr(full)
+    pool.close()
+    print(f"chunked cold across {pool.processes} processes: starting them={1000*t_pool:.1f}ms "
+          f"started={1000*t_again:.1f}ms")
+
+    first = reader.read(source)
+    i = source.index("_17 {")
+    edited = source[:i] + source[i:].replace("synth=", "synth= ", 1)
+    t_warm, again = measure(reader.read, edited)
+    t_full, full = measure(from_string, edited)
+    assert repr(again) == repr(full)
+    same = sum(a is b for a, b in zip(first.declarations, again.declarations))
+    print(f"one clip edited: whole={1000*t_full:.1f}ms chunked={1000*t_warm:.2f}ms, "
+          f"{same} of {len(again.declarations)} declarations kept their identity")
+
+    broken = edited.replace("synth= ", "synth= {", 1)
+    try:
+        reader.read(broken)
+    except Exception as e:
+        chunked_error = str(e)
+    try:
+        from_string(broken)
+    except Exception as e:
+        assert str(e) == chunked_error
+    print("errors are reported against the whole document")
@@ -0,0 +1,63 @@
+# UI commands posted to the player thread.
+#
+#     python3 -m benchmarks.command_queue
+#
+# Compares restarting the player thread, as set_playing used to do,
+# with posting to a running player, and hammers the queue with
+# parameter tweaks while a sequence plays.
+from benchmarks.lookahead import FakeServer, FakeFabric, make_sequence
+from sequencer import Sequencer, Player
+import statistics
+import threading
+import time
+
+def restart(fabric, sequence, n=50):
+    costs = []
+    player = Player({}, fabric, Sequencer(sequence, 0.0, -1, -1, sequence.end))
+    for _ in range(n):
+        now = time.perf_counter()
+        player.close()
+        player = Player({}, fabric, Sequencer(sequence, 0.0, -1, -1, sequence.end))
+        costs.append(time.perf_counter() - now)
+    player.close()
+    return costs
+
+def post(fabric, sequence, n=50):
+    costs = []
+    delays = []
+    player = Player({}, fabric)
+    for _ in range(n):
+        done = threading.Event()
+        now = time.perf_counter()
+        player.play(Sequencer(sequence, 0.0, -1, -1, sequence.end))
+        player.post(done.set)
+        costs.append(time.perf_counter() - now)
+        done.wait()
+        delays.append(time.perf_counter() - now)
+    player.close()
+    return costs, delays
+
+def hammer(fabric, sequence, n=20000):
+    player = Player({}, fabric, Sequencer(sequence, 0.0, 0.0, 0.5, sequence.end))
+    now = time.perf_counter()
+    for i in range(n):
+        player.control("hat", volume=i)
+    done = threading.Event()
+    player.post(done.set)
+    done.wait()
+    elapsed = time.perf_counter() - now
+    player.close()
+    return elapsed
+
+if __name__ == "__main__":
+    sequence = make_sequence(4.0, 32)
+    fabric = FakeFabric(FakeServer(), ["hat"])
+    costs = restart(fabric, sequence)
+    print(f"join and restart  ui cost mean={1000*statistics.mean(costs):.3f}ms max={1000*max(costs):.3f}ms")
+    costs, delays = post(fabric, sequence)
+    print(f"post to player    ui cost mean={1000*statistics.mean(costs):.3f}ms max={1000*max(costs):.3f}ms "
+          f"applied after mean={1000*statistics.mean(delays):.3f}ms")
+    server = FakeServer()
+    elapsed = hammer(FakeFabric(server, ["hat"]), sequence)
+    tweaks = sum(1 for _, _, bundle in server.bundles for m in bundle if "volume" in m[2])
+    print(f"20000 tweaks while looping: {tweaks} applied in {1000*elapsed:.1f}ms")
@@ -0,0 +1,67 @@
+# Messages removed by the compaction pass, per song.
+#
+#     python3 -m benchmarks.compaction [file.seq ...]
+#
+# Synthdefs are built into a scratch directory with build_synthdefs.
+from fabric2 import Definitions
+from main4 import DocumentProcessing, default_rhythm_config
+from model2.parse import from_file
+from sequencer import SequenceBuilder2, Control, Gate, compact
+import glob
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+
+def build(doc, definitions):
+    proc = DocumentProcessing(doc)
+    sb = SequenceBuilder2({}, definitions.descriptors(doc.synths))
+    duration = proc.construct(sb, proc.declarations["main"], 0, ("main",), default_rhythm_config)
+    sequence = sb.build(duration)
+    return sb.timeline()[1], sequence
+
+def automation(bars=256):
+    # A filter sweep written as a control brush per beat, where most
+    # steps repeat the previous value, plus chords sharing an instant.
+    events = []
+    for i in range(bars * 4):
+        events.append(Control(i * 0.5, "filter", {"freq": 200.0 * (1 + i // 16)}))
+        events.append(Control(i * 0.5, "filter", {"rcq": 0.5}))
+        for j in range(3):
+            events.append(Gate(i * 0.5, "pad", i * 3 + j, {"note": 60 + j * 4}, False))
+    return events
+
+def final_controls(events):
+    controls = {}
+    for e in events:
+        if isinstance(e, Control):
+            controls.setdefault(e.tag, {}).update(e.kwargs)
+    return controls
+
+if __name__ == "__main__":
+    events = automation()
+    com, removed = compact(events)
+    assert final_controls(com) == final_controls(events)
+    print(f"{'synthetic automation':24} messages {len(events):6} -> {len(com):6} "
+          f"(removed {removed}), {len(set(e.time for e in com))} bundles")
+
+    filenames = sys.argv[1:] or sorted(glob.glob("examples/*.seq"))
+    filenames = [os.path.abspath(f) for f in filenames]
+    scratch = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        importlib.import_module("build_synthdefs")
+        os.chdir(cwd)
+        definitions = Definitions(os.path.join(scratch, "synthdefs"))
+        for filename in filenames:
+            raw, sequence = build(from_file(filename), definitions)
+            before = len(raw)
+            after = len(sequence.com)
+            bundles = len(set(sequence.com.times.tolist()))
+            print(f"{os.path.basename(filename):24} messages {before:6} -> {after:6} "
+                  f"(removed {sequence.removed}), {bundles} bundles")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch)
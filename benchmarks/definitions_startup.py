@@ -0,0 +1,55 @@
+# Cold and warm startup of Definitions, with and without the cache.
+#
+#     python3 -m benchmarks.definitions_startup [synthdef_directory]
+#
+# Without an argument, a scratch directory is filled by running
+# build_synthdefs and writing a handful of .synth sources.
+from fabric2 import Definitions
+from model2 import synthlang
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+def populate(directory):
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        importlib.import_module("build_synthdefs")
+    finally:
+        os.chdir(cwd)
+    directory = os.path.join(directory, "synthdefs")
+    for i in range(16):
+        source = synthlang.example.replace("69", str(60 + i))
+        with open(os.path.join(directory, f"generated_{i}.synth"), "w") as fd:
+            fd.write(source)
+    return directory
+
+def load_all(directory, cache_directory):
+    now = time.perf_counter()
+    definitions = Definitions(directory, cache_directory)
+    for name in definitions.list_available():
+        definitions.definition(name)
+    return time.perf_counter() - now, definitions
+
+if __name__ == "__main__":
+    scratch = tempfile.mkdtemp()
+    try:
+        if len(sys.argv) > 1:
+            directory = sys.argv[1]
+        else:
+            directory = populate(scratch)
+        cache_directory = os.path.join(scratch, "cache")
+        uncached, _ = load_all(directory, os.devnull)
+        cold, _ = load_all(directory, cache_directory)
+        warm, definitions = load_all(directory, cache_directory)
+        print(f"no cache   {uncached*1000:8.2f}ms")
+        print(f"cold cache {cold*1000:8.2f}ms")
+        print(f"warm cache {warm*1000:8.2f}ms  "
+              f"hits={definitions.cache.hits} misses={definitions.cache.misses}")
+        for name, (seconds, hit) in sorted(definitions.timings.items()):
+            print(f"  {name:24} {seconds*1000:6.2f}ms {'hit' if hit else 'miss'}")
+    finally:
+        shutil.rmtree(scratch)
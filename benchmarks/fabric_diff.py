@@ -0,0 +1,181 @@
+# Fabric.apply_diff against a full rebuild, on a recording fake server.
+#
+#     python3 -m benchmarks.fabric_diff
+#
+# Every scenario edits the graph with apply_diff, then checks that the
+# resulting node order and bus wiring match a Fabric built from scratch,
+# and reports how many server operations each approach needed.
+from collections import Counter
+from descriptors import bus, Descriptor
+from fabric2 import Fabric
+from model2.schema import Synth
+import supriya
+
+class FakeServer:
+    def __init__(self):
+        self.log = []
+        self.next_id = 1000
+        self.next_bus = 16
+        self.root = FakeNode(self, "group", None)
+
+    def record(self, *op):
+        self.log.append(op)
+
+    def sync(self):
+        pass
+
+    def add_synthdefs(self, *synthdefs):
+        self.record("d_recv", len(synthdefs))
+
+    def free_synthdefs(self, *synthdefs):
+        self.record("d_free", len(synthdefs))
+
+    def add_bus_group(self, rate, count):
+        self.record("b_alloc", rate, count)
+        return FakeBus(self, rate, count)
+
+    def add_group(self):
+        return self.root.add_group()
+
+class FakeBus:
+    def __init__(self, server, rate, count):
+        self.server = server
+        self.calculation_rate = (supriya.CalculationRate.AUDIO if rate == "ar"
+                                 else supriya.CalculationRate.CONTROL)
+        self.count = count
+        self.index = server.next_bus
+        server.next_bus += count
+
+    def __float__(self):
+        return float(self.index)
+
+    def free(self):
+        self.server.record("b_free")
+
+class FakeNode:
+    def __init__(self, server, kind, synthdef, params=None):
+        self.server = server
+        self.kind = kind
+        self.synthdef = synthdef
+        self.params = dict(params or {})
+        self.parent = None
+        self.children = []
+        server.next_id += 1
+        self.node_id = server.next_id
+
+    def _insert(self, node, index):
+        node.parent = self
+        self.children.insert(index, node)
+        return node
+
+    def add_group(self):
+        self.server.record("g_new")
+        return self._insert(FakeNode(self.server, "group", None), 0)
+
+    def add_synth(self, synthdef, **params):
+        self.server.record("s_new", getattr(synthdef, "name", None))
+        return self._insert(FakeNode(self.server, "synth", synthdef, params), 0)
+
+    def set(self, **params):
+        self.server.record("n_set", len(params))
+        self.params.update(params)
+
+    def free(self):
+        self.server.record("n_free")
+        self.parent.children.remove(self)
+
+    def move(self, target, add_action):
+        self.server.record("n_move")
+        self.parent.children.remove(self)
+        if add_action == supriya.AddAction.ADD_TO_HEAD:
+            target._insert(self, 0)
+        else:
+            target.parent._insert(self, target.parent.children.index(target) + 1)
+
+class FakeSynthDef:
+    def __init__(self, name, gate):
+        self.name = name
+        self.gate = gate
+
+    def has_gate(self):
+        return self.gate
+
+    @property
+    def parameters(self):
+        return {}
+
+audio_out = bus("ar", "out", 2)
+audio_in = bus("ar", "in", 2)
+library = {
+    "fm":     (FakeSynthDef("fm", True),     {"out": audio_out, "note": "pitch", "volume": "db"}),
+    "bd":     (FakeSynthDef("bd", True),     {"out": audio_out, "tone": "hz"}),
+    "comb_l": (FakeSynthDef("comb_l", False), {"out": audio_out, "source": audio_in, "delay": "number"}),
+    "lpf":    (FakeSynthDef("lpf", False),   {"out": audio_out, "source": audio_in, "freq": "hz"}),
+}
+
+class FakeDefinitions:
+    def descriptors(self, cells):
+        descriptors = {cell.name: self.descriptor(cell) for cell in cells}
+        descriptors.setdefault('tempo', Descriptor(None, {}, "number"))
+        return descriptors
+
+    def descriptor(self, cell):
+        synthdef, mdesc = library[cell.synth]
+        return Descriptor(synthdef, mdesc, cell.type_param)
+
+def shape(fabric):
+    def label(node):
+        for name, (c, n) in fabric.synths.items():
+            if n is node:
+                return name
+        return node.kind + ":" + str(getattr(node.synthdef, "name", None))
+    nodes = [label(n) for n in fabric.root.children]
+    wiring = {name: {p: id(b) for p, b in ports.items()} for name, ports in fabric.busmap.items()}
+    groups = {}
+    for name, ports in wiring.items():
+        for p, b in ports.items():
+            groups.setdefault(b, set()).add((name, p))
+    return nodes, sorted(sorted(g) for g in groups.values())
+
+def build(cells, connections):
+    server = FakeServer()
+    fabric = Fabric(server, cells, connections, FakeDefinitions())
+    return server, fabric
+
+base_cells = [
+    Synth((0, 0), "tone", "fm", True, None, {"volume": -6}),
+    Synth((0, 0), "kick", "bd", True, None, {}),
+    Synth((0, 0), "echo", "comb_l", False, None, {"delay": 0.2}),
+]
+base_connections = {
+    (("tone", "out"), ("echo", "source")),
+    (("echo", "out"), ("system", "out")),
+    (("kick", "out"), ("system", "out")),
+}
+
+def scenarios():
+    cells, connections = base_cells, base_connections
+    yield "change parameter", [c.reset(params={"delay": 0.3}) if c.name == "echo" else c for c in cells], connections
+    filt = Synth((0, 0), "filt", "lpf", False, None, {"freq": 800})
+    yield "insert effect", cells + [filt], (connections - {(("echo", "out"), ("system", "out"))}) | {
+        (("echo", "out"), ("filt", "source")), (("filt", "out"), ("system", "out"))}
+    yield "add connection", cells, connections | {(("kick", "out"), ("echo", "source"))}
+    yield "remove connection", cells, connections - {(("tone", "out"), ("echo", "source"))}
+    yield "remove synth", [c for c in cells if c.name != "kick"], {c for c in connections if c[0][0] != "kick"}
+    yield "change synthdef", [c.reset(synth="lpf", params={}) if c.name == "echo" else c for c in cells], connections
+
+if __name__ == "__main__":
+    for name, cells, connections in scenarios():
+        server, fabric = build(base_cells, base_connections)
+        kept = {n for _, n in fabric.synths.values()}
+        server.log.clear()
+        fabric.apply_diff(cells, connections)
+        diff_ops = Counter(op[0] for op in server.log)
+        survivors = len(kept & {n for _, n in fabric.synths.values()})
+
+        fresh_server, fresh = build(cells, connections)
+        rebuild_ops = Counter(op[0] for op in fresh_server.log)
+        rebuild_ops["n_free"] += 1 + len(base_cells)
+        assert shape(fabric) == shape(fresh), (name, shape(fabric), shape(fresh))
+        print(f"{name:18} diff={sum(diff_ops.values()):3} ops {dict(diff_ops)} "
+              f"kept={survivors}  rebuild={sum(rebuild_ops.values()):3} ops")
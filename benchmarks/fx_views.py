@@ -0,0 +1,83 @@
+# Lazy repeat/rotate/retrograde/ostinato views against materialised trees.
+#
+#     python3 -m benchmarks.fx_views
+#
+# The materialised variant copies every node of the evaluated views into
+# trees, the way Fx.evaluate used to. Both must give the same pattern.
+from main4 import DocumentProcessing, default_rhythm_config
+from model2.parse import from_string
+from model2.schema import Note, Tuplet, BrushEntity, evaluate_all
+from model2.sequences import SequenceView, empty, from_list
+import time
+import tracemalloc
+
+SOURCE = """oscillseq aqua
+
+main {
+  (0, 0) %% s, s, e, s, s, e, q, q[e, e, e] / repeat 512 {
+    synth=kick;
+  }
+  (0, 1) %note:pitch@a% s, e, s, e[s, s, s] / retrograde 0 / rotate 3 / repeat 512
+    / ostinato %note:pitch% * c4, * d4, * e4 {
+    synth=fm;
+  }
+}
+"""
+
+def materialise(xs):
+    out = []
+    for x in xs:
+        if isinstance(x, Tuplet):
+            x = Tuplet.mk(x.duration, materialise(x.mhs))
+        out.append(x.retain(empty, empty))
+    return from_list(out)
+
+def brushes(doc):
+    proc = DocumentProcessing(doc)
+    for e in proc.declarations["main"].entities:
+        if isinstance(e, BrushEntity):
+            yield proc, e, default_rhythm_config | proc.declarations["main"].properties | e.properties
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+def key(x):
+    if isinstance(x, Tuplet):
+        return ("tuplet", x.duration, [key(y) for y in x.mhs])
+    return ("note", x.duration, x.style, x.group)
+
+def check_view(view):
+    items = [key(x) for x in view]
+    assert len(items) == view.length
+    assert [key(x) for x in reversed(view)] == items[::-1]
+    for pos in sorted({0, 1, view.length // 3, view.length - 1}):
+        assert key(view.pick(pos)) == items[pos]
+    for start, stop in [(0, view.length), (1, view.length // 2), (view.length // 3, view.length - 1)]:
+        assert [key(x) for x in view.sequence(start, stop)] == items[start:stop]
+
+if __name__ == "__main__":
+    doc = from_string(SOURCE)
+    for proc, e, config in brushes(doc):
+        lazy, t_lazy, m_lazy = measure(lambda: proc.compute_pattern(evaluate_all(config, e.expr), config))
+        eager, t_eager, m_eager = measure(lambda: proc.compute_pattern(materialise(evaluate_all(config, e.expr)), config))
+        assert lazy == eager
+        print(f"{len(lazy[0]):6} events  materialised={1000*t_eager:7.1f}ms {m_eager/2**20:6.2f}MiB "
+              f"lazy={1000*t_lazy:7.1f}ms {m_lazy/2**20:6.2f}MiB")
+        view = evaluate_all(config, e.expr)
+        assert isinstance(view, SequenceView)
+        check_view(view)
+    for text in ["s, e, q[s, e], q / rotate -2", "s, e, q[s, e], q / rotate 9",
+                 "s, e, q[s, e[e, s]], q / retrograde 0 / repeat 3",
+                 "s, e, q[s, e], q / ostinato %note:pitch% * c4, * d4 / retrograde 0",
+                 "(s, e / repeat 0), s, (q, e / rotate 1 / repeat 2)"]:
+        doc = from_string(f"oscillseq aqua\n\nmain {{\n  (0, 0) %note:pitch% {text} {{\n    synth=fm;\n  }}\n}}\n")
+        for proc, e, config in brushes(doc):
+            view = evaluate_all(config, e.expr)
+            check_view(view)
+    print("views agree with lists")
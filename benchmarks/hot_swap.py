@@ -0,0 +1,74 @@
+# Swapping a rebuilt sequence into a running player.
+#
+#     python3 -m benchmarks.hot_swap
+#
+# A held note must keep its synth across the swap, no instant may be sent
+# twice or skipped, and handing the build to the compiler must not block.
+from benchmarks.lookahead import FakeServer, FakeFabric, wait_until_done
+from collections import Counter
+from sequencer import Sequence, Sequencer, Player, Once, Gate
+import music
+import time
+
+def make_sequence(label, duration=1.0, rate=64):
+    tempo = music.tempo_envelope([(0.0, False, 120.0)])
+    com = [Gate(0.0, "pad", 0, {"note": 60}, False)]
+    com += [Once(i / rate, "hat", {"i": i, "label": label}) for i in range(int(duration * rate))]
+    com.append(Gate(duration, "pad", 0, {}, True))
+    com.sort(key=lambda e: e.time)
+    return Sequence(tempo, com, duration)
+
+def run(lookahead, swap_after=0.4):
+    a, b = make_sequence("a"), make_sequence("b")
+    server = FakeServer()
+    fabric = FakeFabric(server, ["hat", "pad"])
+    sequencer = Sequencer(a, 0.0, -1, -1, a.end, lookahead=lookahead)
+    player = Player({}, fabric, sequencer)
+    time.sleep(swap_after)
+    swapped = time.time()
+    player.swap(b, {"loop_start": -1, "loop_point": -1, "end_point": b.end})
+    wait_until_done(player)
+
+    messages = [(arrival, m) for _, arrival, bundle in server.bundles for m in bundle]
+    hats = Counter(m[2]["i"] for _, m in messages if m[1] == "hat" and m[0] == "/s_new")
+    first_b = min(arrival for arrival, m in messages if m[2].get("label") == "b")
+    return {
+        "lookahead": lookahead,
+        "pad_starts": sum(1 for _, m in messages if m[1] == "pad" and m[0] == "/s_new"),
+        "duplicates": sum(1 for n in hats.values() if n > 1),
+        "missing": len(a.com) - 2 - len(hats),
+        "swap_ms": 1000 * (first_b - swapped),
+    }
+
+def compiler_latency():
+    from fabric2 import Definitions
+    from main4 import Compiler, DocumentProcessing
+    from model2.parse import from_file
+    import importlib, os, shutil, tempfile
+    scratch = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        importlib.import_module("build_synthdefs")
+        os.chdir(cwd)
+        definitions = Definitions(os.path.join(scratch, "synthdefs"))
+        doc = from_file("examples/melody.seq")
+        descriptors = definitions.descriptors(doc.synths)
+        compiler = Compiler()
+        now = time.perf_counter()
+        compiler.submit(DocumentProcessing(doc), descriptors, False, None)
+        submit = time.perf_counter() - now
+        compiler.wait()
+        build = time.perf_counter() - now
+        assert compiler.poll() is not None
+        return submit, build
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch)
+
+if __name__ == "__main__":
+    for lookahead in [0.0, 0.1]:
+        print("lookahead={lookahead:.1f}s pad_starts={pad_starts} duplicates={duplicates} "
+              "missing={missing} first message after swap={swap_ms:.2f}ms".format(**run(lookahead)))
+    submit, build = compiler_latency()
+    print(f"ui thread blocked {submit*1000:.3f}ms, build took {build*1000:.1f}ms on the worker")
@@ -0,0 +1,51 @@
+# Laying out large generated documents with pformat_doc.
+#
+#     python3 -m benchmarks.layout
+#
+# Documents grow in the number of notes in one brush, in the number of
+# clips, and in the depth of nested tuplets. The text must parse back to
+# a document that lays out the same way.
+from model2.parse import from_string
+from model2.schema import pformat_doc
+import random
+import sys
+import time
+
+def brush(rng, count):
+    notes = ", ".join(f"{rng.choice('qes')} {rng.choice('cdefgab')}{rng.randint(2, 5)}" for _ in range(count))
+    return f"  (0, 0) %note:pitch% {notes} {{\n    synth=fm;\n  }}\n"
+
+def long_brush(count):
+    rng = random.Random(count)
+    return "oscillseq aqua\n\nmain {\n" + brush(rng, count) + "}\n"
+
+def many_clips(count):
+    rng = random.Random(count)
+    clips = [f"clip_{i} {{\n{brush(rng, 32)}}}\n" for i in range(count)]
+    main = "".join(f"  ({i}, 0) &clip_{i};\n" for i in range(count))
+    return "oscillseq aqua\n\n" + "\n".join(clips) + f"\nmain {{\n{main}}}\n"
+
+def deep_tuplets(depth):
+    notes = "q c4"
+    for _ in range(depth):
+        notes = f"q c4, q[{notes}, e d4]"
+    return f"oscillseq aqua\n\nmain {{\n  (0, 0) %note:pitch% {notes} {{\n    synth=fm;\n  }}\n}}\n"
+
+def measure(doc, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = pformat_doc(doc.__pretty__(), 80)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(10000)
+    cases = [(f"{n} notes in one brush", long_brush(n)) for n in (1000, 4000, 16000)]
+    cases += [(f"{n} clips", many_clips(n)) for n in (100, 400)]
+    cases += [(f"tuplets nested {n} deep", deep_tuplets(n)) for n in (50, 200)]
+    for name, source in cases:
+        doc = from_string(source)
+        elapsed, out = measure(doc)
+        assert pformat_doc(from_string(out).__pretty__(), 80) == out
+        print(f"{name:28} {len(out)/1024:8.1f}KiB {1000*elapsed:9.1f}ms")
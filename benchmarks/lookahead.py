@@ -0,0 +1,96 @@
+# Latency/jitter benchmark for the sequencer lookahead mode.
+#
+#     python3 -m benchmarks.lookahead
+#
+# A fake server records the arrival time of every bundle (or loose message).
+# In immediate mode an event is heard when it arrives, with lookahead it is
+# heard at the bundle timestamp, so we measure both against the ideal time.
+from contextlib import contextmanager
+from sequencer import Sequence, Sequencer, Player, Once
+import music
+import statistics
+import time
+
+class FakeServer:
+    def __init__(self):
+        self.bundles = []
+        self.pending = None
+
+    @contextmanager
+    def at(self, timestamp):
+        self.pending = []
+        try:
+            yield
+        finally:
+            messages, self.pending = self.pending, None
+            if messages:
+                self.bundles.append((timestamp, time.time(), messages))
+
+    def send(self, message):
+        if self.pending is None:
+            self.bundles.append((None, time.time(), [message]))
+        else:
+            self.pending.append(message)
+
+class FakeSynth:
+    def __init__(self, server, tag):
+        self.server = server
+        self.tag = tag
+
+    def set(self, **params):
+        self.server.send(("/n_set", self.tag, params))
+
+class FakeFabric:
+    def __init__(self, server, tags):
+        self.server = server
+        self.synths = {tag: (None, None) for tag in tags}
+
+    def control(self, name, **args):
+        self.server.send(("/n_set", name, args))
+
+    def synth(self, name, **args):
+        self.server.send(("/s_new", name, args))
+        return FakeSynth(self.server, name)
+
+def wait_until_done(player):
+    while player.sequencer is not None:
+        time.sleep(0.005)
+    player.close()
+
+def make_sequence(duration, rate):
+    tempo = music.tempo_envelope([(0.0, False, 120.0)])
+    com = [Once(i / rate, "hat", {"i": i}) for i in range(int(duration * rate))]
+    return Sequence(tempo, com, duration)
+
+def run(lookahead, duration=4.0, rate=32):
+    sequence = make_sequence(duration, rate)
+    server = FakeServer()
+    fabric = FakeFabric(server, ["hat"])
+    sequencer = Sequencer(sequence, 0.0, -1, -1, sequence.end, lookahead=lookahead)
+    start = time.time()
+    player = Player({}, fabric, sequencer)
+    wait_until_done(player)
+
+    errors = []
+    for timestamp, arrival, messages in server.bundles:
+        heard = arrival if timestamp is None else max(timestamp, arrival)
+        for _, _, args in messages:
+            errors.append(heard - (start + sequence.com[args["i"]].time))
+    late = sum(1 for timestamp, arrival, _ in server.bundles
+               if timestamp is not None and arrival > timestamp)
+    return {
+        "lookahead": lookahead,
+        "events": len(errors),
+        "bundles": len(server.bundles),
+        "mean_ms": 1000 * statistics.mean(errors),
+        "jitter_ms": 1000 * statistics.pstdev(errors),
+        "max_ms": 1000 * max(errors),
+        "late_bundles": late,
+    }
+
+if __name__ == "__main__":
+    for lookahead in [0.0, 0.05, 0.1, 0.2]:
+        r = run(lookahead)
+        print("lookahead={lookahead:.2f}s events={events} bundles={bundles} "
+              "mean={mean_ms:.3f}ms jitter={jitter_ms:.3f}ms max={max_ms:.3f}ms "
+              "late={late_bundles}".format(**r))
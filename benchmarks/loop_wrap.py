@@ -0,0 +1,43 @@
+# Loop wrap latency against loop position, with and without checkpoints.
+#
+#     python3 -m benchmarks.loop_wrap
+#
+# Each wrap calls Sequencer.resume at loop_start, which rebuilds the
+# simulated state there before sending it to the (fake) server.
+from benchmarks.lookahead import FakeServer, FakeFabric
+from sequencer import SequenceBuilder, Sequencer
+import time
+
+def make_sequence(bars):
+    sb = SequenceBuilder({})
+    sb.begin_brush(("main", 0), None, {}, 0)
+    for i in range(bars * 16):
+        bar = i / 16
+        sb.gate(bar, "tone", ("note", i), {"note": 60 + i % 12})
+        sb.gate(bar + 1/32, "tone", ("note", i), {})
+        sb.control(bar, "filter", {"freq": 200 + i % 7})
+    sb.end_brush(bars)
+    return sb.build(bars)
+
+def wrap_latency(sequence, point, repeat=5):
+    fabric = FakeFabric(FakeServer(), ["tone", "filter"])
+    best = float("inf")
+    for _ in range(repeat):
+        sequencer = Sequencer(sequence, point, point, sequence.end, sequence.end)
+        clavier = {}
+        start = time.perf_counter()
+        sequencer.resume(clavier, fabric)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    sequence = make_sequence(2000)
+    print(f"events={len(sequence.com)} checkpoints={len(sequence.checkpoints)}")
+    checkpoints = sequence.checkpoints
+    for fraction in [0.0, 0.25, 0.5, 0.75, 0.99]:
+        point = sequence.end * fraction
+        sequence.checkpoints = checkpoints
+        fast = wrap_latency(sequence, point)
+        sequence.checkpoints = []
+        slow = wrap_latency(sequence, point, repeat=1)
+        print(f"position={fraction:4.0%} checkpoints={1000*fast:8.3f}ms replay={1000*slow:8.3f}ms")
@@ -0,0 +1,57 @@
+# Parser construction at import, one parser per start symbol against the
+# shared and cached LALR tables.
+#
+#     python3 -m benchmarks.parser_startup
+#
+# Import times are measured in fresh interpreters, first with the cache
+# files removed and then with them in place. Those include importing
+# supriya, which synthlang needs and which takes most of the time.
+from lark import Lark
+from model2 import lark_cache, parse, synthlang
+from model2.lark_cache import cache_path
+import glob
+import os
+import subprocess
+import sys
+import time
+
+IMPORT = "import time; t = time.perf_counter(); import model2.parse, model2.synthlang; print(time.perf_counter() - t)"
+
+def separate():
+    Lark(parse.grammar, parser="lalr", start="file", transformer=parse.ModelTransformer())
+    Lark(parse.grammar, parser="lalr", start="bigcmd", transformer=parse.ModelTransformer())
+    Lark(synthlang.synth_grammar, parser="lalr", transformer=synthlang.SynthLangTransformer())
+
+def shared():
+    Lark(parse.grammar, parser="lalr", start=["file", "bigcmd", "declaration", "synths", "connections"],
+         cache=cache_path("model"), transformer=parse.ModelTransformer())
+    Lark(synthlang.synth_grammar, parser="lalr", cache=cache_path("synthlang"), transformer=synthlang.SynthLangTransformer())
+
+def measure(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def import_time():
+    out = subprocess.run([sys.executable, "-c", IMPORT], capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[-1])
+
+if __name__ == "__main__":
+    print(f"in process: separate={1000*measure(separate):.1f}ms shared+cached={1000*measure(shared):.1f}ms")
+    for filename in glob.glob(os.path.join(lark_cache.directory, "*.lark")):
+        os.remove(filename)
+    cold = import_time()
+    warm = min(import_time() for _ in range(5))
+    print(f"import model2.parse, model2.synthlang: cold={1000*cold:.1f}ms warm={1000*warm:.1f}ms")
+    for filename in glob.glob("examples/*.seq"):
+        with open(filename, encoding="utf-8") as fd:
+            source = fd.read()
+        a = Lark(parse.grammar, parser="lalr", start="file", transformer=parse.ModelTransformer()).parse(source)
+        assert repr(a) == repr(parse.from_string(source)), filename
+    command = Lark(parse.grammar, parser="lalr", start="bigcmd", transformer=parse.ModelTransformer())
+    for source in ["cont", "mk foo", "cont [1:3]", "cont := q c4, e d4"]:
+        assert type(parse.command_from_string(source)) is type(command.parse(source)), source
+    print("shared parser gives the same documents")
@@ -0,0 +1,63 @@
+# Rebuilding brush patterns after an edit, with and without the pattern
+# cache shared between DocumentProcessing instances.
+#
+#     python3 -m benchmarks.patterns [file.seq]
+#
+# Each edit copies the first note of one brush, the way a command rewrites
+# the document, then lays out and constructs the whole song again.
+from main4 import DocumentProcessing, PatternCache, default_rhythm_config
+from model2.parse import from_file
+from model2.schema import BrushEntity, empty
+from dataclasses import replace
+from sequencer import SequenceBuilder2, VoicePolicy
+import os
+import sys
+import time
+
+def rebuild(doc, patterns):
+    proc = DocumentProcessing(doc, patterns)
+    main = proc.declarations["main"]
+    proc.get_dimensions(main, default_rhythm_config, ("main",))
+    sb = SequenceBuilder2({}, {}, voices=VoicePolicy())
+    shift = proc.construct(sb, main, 0, ("main",), default_rhythm_config)
+    return proc, sb.build(shift)
+
+def brushes(doc):
+    for i, decl in enumerate(doc.declarations):
+        for j, e in enumerate(getattr(decl, "entities", [])):
+            if isinstance(e, BrushEntity) and e.expr.length > 0:
+                yield i, j
+
+def edit(doc, i, j):
+    decl = doc.declarations[i]
+    e = decl.entities[j]
+    expr = e.expr.insert(0, e.expr.pick(0).retain(empty, empty))
+    entities = list(decl.entities)
+    entities[j] = e.reset(expr=expr)
+    declarations = list(doc.declarations)
+    declarations[i] = replace(decl, entities=entities)
+    return doc.reset(declarations=declarations)
+
+def session(doc, patterns, edits):
+    start = time.perf_counter()
+    for i, j in edits:
+        doc = edit(doc, i, j)
+        rebuild(doc, patterns)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    filename = sys.argv[1] if len(sys.argv) > 1 else "examples/melody.seq"
+    doc = from_file(filename)
+    edits = list(brushes(doc)) * 10
+    _, a = rebuild(doc, None)
+    patterns = PatternCache()
+    _, b = rebuild(doc, patterns)
+    assert [(e.time, e.tag) for e in a.com] == [(e.time, e.tag) for e in b.com]
+    print(f"{os.path.basename(filename)}: first build {patterns.summary()}")
+    _, b = rebuild(doc, patterns)
+    assert [(e.time, e.tag) for e in a.com] == [(e.time, e.tag) for e in b.com]
+    print(f"unchanged rebuild {patterns.summary()}")
+    off = session(doc, None, edits)
+    patterns = PatternCache()
+    on = session(doc, patterns, edits)
+    print(f"{len(edits)} edits: uncached={1000*off:.1f}ms cached={1000*on:.1f}ms {patterns.summary()}")
@@ -0,0 +1,39 @@
+# Laying out a whole document for saving against the per-declaration
+# layouts remembered on the declarations and synths.
+#
+#     python3 -m benchmarks.save_layout [file.seq]
+#
+# The document is widened into a library of clips as in chunked_parse,
+# then one clip is edited the way a command would before saving again.
+from benchmarks.chunked_parse import library, measure
+from model2.parse import from_string
+from model2.schema import pformat_doc, empty
+from dataclasses import replace
+import sys
+
+def edit(doc, i):
+    decl = doc.declarations[i]
+    entities = list(decl.entities)
+    e = entities[0]
+    entities[0] = e.reset(expr=e.expr.insert(0, e.expr.pick(0).retain(empty, empty)))
+    declarations = list(doc.declarations)
+    declarations[i] = replace(decl, entities=entities)
+    return doc.reset(declarations=declarations)
+
+if __name__ == "__main__":
+    filename = sys.argv[1] if len(sys.argv) > 1 else "examples/melody.seq"
+    with open(filename, encoding="utf-8") as fd:
+        doc = from_string(library(fd.read(), 300))
+    t_whole, whole = measure(lambda: pformat_doc(doc.__pretty__(), 80))
+    t_cold, cold = measure(str, doc)
+    t_warm, warm = measure(str, doc)
+    assert whole == cold == warm
+    print(f"{len(doc.declarations)} declarations: whole={1000*t_whole:.1f}ms "
+          f"first={1000*t_cold:.1f}ms unchanged={1000*t_warm:.2f}ms")
+    doc = edit(doc, 17)
+    t_whole, whole = measure(lambda: pformat_doc(doc.__pretty__(), 80))
+    fabric = doc.format_fabric()
+    t_edit, edited = measure(doc.format_text, fabric)
+    assert whole == edited == str(doc)
+    assert from_string(edited).declarations[17].entities[0].expr.length == doc.declarations[17].entities[0].expr.length
+    print(f"one clip edited: whole={1000*t_whole:.1f}ms incremental={1000*t_edit:.2f}ms")
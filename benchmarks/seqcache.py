@@ -0,0 +1,93 @@
+# Building a sequence against loading it from the compiled sequence cache.
+#
+#     python3 -m benchmarks.seqcache [file.seq ...]
+#
+# Synthdefs are built into a scratch directory with build_synthdefs. The
+# song is repeated to get a large event table.
+from descriptors import converters, to_hz, to_plain
+from fabric2 import Definitions
+from main4 import DocumentProcessing, default_rhythm_config
+from model2.parse import from_file
+from sequencer import Sequence, Once, Gate, SequenceBuilder2, VoicePolicy
+import glob
+import importlib
+import music
+import os
+import seqcache
+import shutil
+import sys
+import tempfile
+import time
+
+def build(doc, definitions, repeat=1):
+    proc = DocumentProcessing(doc)
+    sb = SequenceBuilder2({}, definitions.descriptors(doc.synths), voices=VoicePolicy())
+    shift = 0
+    for _ in range(repeat):
+        shift += proc.construct(sb, proc.declarations["main"], shift, ("main",), default_rhythm_config)
+    return sb.build(shift)
+
+def sent(sequence, descriptors):
+    # Keyword values the way the fabric maps them for the server.
+    conv = {tag: converters(d) for tag, d in descriptors.items()}
+    out = []
+    for e in sequence.com:
+        c = conv.get(e.tag, {})
+        out.append({n: c.get(n, to_plain)(v) for n, v in getattr(e, "kwargs", {}).items()})
+    return out
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+if __name__ == "__main__":
+    filenames = sys.argv[1:] or sorted(glob.glob("examples/*.seq"))
+    filenames = [os.path.abspath(f) for f in filenames]
+    scratch = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        importlib.import_module("build_synthdefs")
+        os.chdir(cwd)
+        definitions = Definitions(os.path.join(scratch, "synthdefs"))
+        for filename in filenames:
+            doc = from_file(filename)
+            for repeat in (1, 100):
+                built, sequence = measure(build, doc, definitions, repeat)
+                sources = {cell.synth: definitions.source_digest(cell.synth) for cell in doc.synths}
+                digest = seqcache.document_digest(str(doc), sources, VoicePolicy(), None)
+                cache = os.path.join(scratch, "song.seqc")
+                saved, reason = measure(seqcache.save, cache, sequence, digest)
+                assert reason is None, reason
+                loaded, cached = measure(seqcache.load, cache, digest)
+                assert seqcache.same(sequence, cached)
+                descriptors = definitions.descriptors(doc.synths)
+                assert sent(sequence, descriptors) == sent(cached, descriptors)
+                assert [(e.time, e.tag) for e in sequence.com] == [(e.time, e.tag) for e in cached.com]
+                assert cached.state_at(len(cached.com)) == sequence.state_at(len(sequence.com))
+                assert seqcache.load(cache, "stale") is None
+                print(f"{os.path.basename(filename):16} x{repeat:<4} events {len(sequence.com):7} "
+                      f"build={1000*built:9.2f}ms save={1000*saved:8.2f}ms "
+                      f"load={1000*loaded:6.2f}ms size={os.path.getsize(cache)/1024:8.1f}KiB")
+        # Unresolved values come back as None.
+        sequence = Sequence(music.tempo_envelope([(0.0, False, 120.0)]),
+            [Once(0.0, "hat", {"a": 1.0, "b": None}), Once(0.5, "hat", {"a": None, "b": 2.0})], 1.0)
+        assert seqcache.save(cache, sequence, "none") is None
+        cached = seqcache.load(cache, "none")
+        assert seqcache.same(sequence, cached)
+        assert [e.kwargs for e in cached.com] == [e.kwargs for e in sequence.com]
+        print("None values survive the cache")
+        # A pitch number sent to an hz field is converted, a float is not.
+        sequence = Sequence(music.tempo_envelope([(0.0, False, 120.0)]),
+            [Gate(0.0, "lp", 0, {"note": 60, "cutoff": 60.0, "on": True}, False)], 1.0)
+        assert seqcache.save(cache, sequence, "ints") is None
+        cached = seqcache.load(cache, "ints")
+        assert seqcache.same(sequence, cached)
+        for a, b in zip(sequence.com, cached.com):
+            assert [type(v) for v in a.kwargs.values()] == [type(v) for v in b.kwargs.values()]
+            assert {n: to_hz(v) for n, v in a.kwargs.items()} == {n: to_hz(v) for n, v in b.kwargs.items()}
+        print("ints and bools survive the cache")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch)
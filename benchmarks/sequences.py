@@ -0,0 +1,62 @@
+# Building and splicing model2 sequence trees one note at a time against
+# the bulk and join based operations.
+#
+#     python3 -m benchmarks.sequences
+#
+# Every tree is checked for order and AVL balance.
+from model2.schema import Note, Duration
+from model2.sequences import empty, from_list, split, concat, splice
+import random
+import time
+
+def notes(count):
+    return [Note.mk(Duration(1, 0), None, {"": [[i]]}) for i in range(count)]
+
+def insert_all(nodes):
+    out = empty
+    for node in nodes:
+        out = out.insert(out.length, node.retain(empty, empty))
+    return out
+
+def check(tree, expected):
+    def walk(node):
+        if node.length == 0:
+            assert node.height == 0
+            return 0
+        lh, rh = walk(node.left), walk(node.right)
+        assert abs(lh - rh) <= 1 and node.height == 1 + max(lh, rh)
+        assert node.length == node.left.length + node.right.length + 1
+        return node.height
+    walk(tree)
+    assert [n.group for n in tree] == [n.group for n in expected]
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+if __name__ == "__main__":
+    for count in (10**4, 10**5):
+        nodes = notes(count)
+        t_insert, a = measure(insert_all, nodes)
+        t_bulk, b = measure(from_list, nodes)
+        check(a, nodes)
+        check(b, nodes)
+        print(f"{count:6} notes  insert={1000*t_insert:8.1f}ms from_list={1000*t_bulk:7.1f}ms")
+
+    rng = random.Random(1)
+    nodes = notes(2000)
+    tree = from_list(nodes)
+    for _ in range(500):
+        pos = rng.randint(0, len(nodes))
+        left, right = split(tree, pos)
+        check(left, nodes[:pos])
+        check(right, nodes[pos:])
+        check(concat(left, right), nodes)
+        start = rng.randint(0, len(nodes))
+        stop = rng.randint(start, len(nodes))
+        middle = notes(rng.randint(0, 50))
+        tree = splice(tree, start, stop, from_list(middle))
+        nodes = nodes[:start] + middle + nodes[stop:]
+        check(tree, nodes)
+    print("split/concat/splice round trips ok")
@@ -0,0 +1,108 @@
+# Whole builds against streamed sequences on a song repeated many times.
+#
+#     python3 -m benchmarks.streaming [file.seq]
+#
+# The stream must give the events of a whole build in the same order,
+# and the same simulated state after a seek. Memory is the peak traced
+# while building and then walking every event, the way the player does.
+from fabric2 import Definitions
+from main4 import DocumentProcessing, default_rhythm_config
+from model2.parse import from_file
+from sequencer import SequenceBuilder2, StreamingSequenceBuilder, VoicePolicy
+from dataclasses import astuple, replace
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+def build(sb, doc, repeat):
+    proc = sb.proc if hasattr(sb, "proc") else DocumentProcessing(doc)
+    shift = 0
+    for i in range(repeat):
+        shift += proc.construct(sb, proc.declarations["main"], shift, ("main", i), default_rhythm_config)
+    return sb.build(shift)
+
+def walk(com):
+    index = 0
+    while com.time_at(index) is not None:
+        com[index]
+        index += 1
+    return index
+
+def measure(make, doc, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    sequence = build(make(), doc, repeat)
+    built = time.perf_counter() - start
+    count = walk(sequence.com)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sequence, count, built, total, peak
+
+def expand_ahead(descriptors, doc):
+    # The loop the compiler runs between builds.
+    condition = threading.Condition()
+    sb = StreamingSequenceBuilder(DocumentProcessing(doc), descriptors, voices=VoicePolicy(), condition=condition)
+    def work():
+        while True:
+            with condition:
+                while sb.expansions is None or sb.expansions.pending() is None:
+                    condition.wait()
+            sb.expansions.work()
+    threading.Thread(target=work, daemon=True).start()
+    return sb
+
+def key(e):
+    return type(e).__name__, astuple(replace(e, origin=None))
+
+if __name__ == "__main__":
+    filename = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else "examples/melody.seq")
+    scratch = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        importlib.import_module("build_synthdefs")
+        os.chdir(cwd)
+        definitions = Definitions(os.path.join(scratch, "synthdefs"))
+        doc = from_file(filename)
+        descriptors = definitions.descriptors(doc.synths)
+        whole = lambda: SequenceBuilder2({}, descriptors, voices=VoicePolicy())
+        streamed = lambda: StreamingSequenceBuilder(DocumentProcessing(doc), descriptors, voices=VoicePolicy())
+        for repeat in (10, 100, 400):
+            a, count, built, total, peak = measure(whole, doc, repeat)
+            print(f"x{repeat:<4} whole    events {count:7} build={1000*built:8.1f}ms "
+                  f"walk={1000*(total-built):7.1f}ms peak={peak/2**20:7.2f}MiB")
+            b, count, built, total, peak = measure(streamed, doc, repeat)
+            print(f"x{repeat:<4} streamed events {count:7} build={1000*built:8.1f}ms "
+                  f"walk={1000*(total-built):7.1f}ms peak={peak/2**20:7.2f}MiB")
+            assert [key(e) for e in a.com] == [key(e) for e in b.com]
+            c, count, built, total, peak = measure(lambda: expand_ahead(descriptors, doc), doc, repeat)
+            print(f"x{repeat:<4} ahead    events {count:7} build={1000*built:8.1f}ms "
+                  f"walk={1000*(total-built):7.1f}ms peak={peak/2**20:7.2f}MiB")
+            assert [key(e) for e in a.com] == [key(e) for e in c.com]
+            for point in (a.end * 0.75, a.end * 0.25, a.end * 0.5):
+                assert a.com.search(point) == b.com.search(point)
+                assert a.state_at(a.com.search(point)) == b.state_at(b.com.search(point))
+
+        # Looping over a retained range must not restart the generator.
+        rewinds = []
+        b = build(streamed(), doc, 100)
+        source = b.com.source
+        b.com.source = lambda: rewinds.append(1) or source()
+        loop_start, loop_point = b.end * 0.5, b.end * 0.5 + 4.0
+        b.com.retain(loop_start, loop_point)
+        for _ in range(50):
+            index = b.com.search(loop_start)
+            b.state_at(index)
+            while (t := b.com.time_at(index)) is not None and t < loop_point:
+                index += 1
+        print(f"50 loops over {loop_point - loop_start:.0f}s: {len(rewinds)} restarts, "
+              f"window {len(b.com.window)} events")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch)
@@ -0,0 +1,38 @@
+# Full, parallel and incremental rebuilds of a synthdef library.
+#
+#     python3 -m benchmarks.synthbuild [count]
+from model2 import synthlang
+import os
+import shutil
+import sys
+import synthbuild
+import tempfile
+import time
+
+def timed(*args, **kwargs):
+    now = time.perf_counter()
+    results = synthbuild.build(*args, **kwargs)
+    return time.perf_counter() - now, results
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(count):
+            source = synthlang.example.replace("69", str(i))
+            with open(os.path.join(directory, f"generated_{i}.synth"), "w") as fd:
+                fd.write(source)
+        serial, _ = timed(directory, max_workers=1, force=True)
+        parallel, _ = timed(directory, force=True)
+        unchanged, _ = timed(directory)
+        with open(os.path.join(directory, "generated_0.synth"), "a") as fd:
+            fd.write("\n")
+        one, results = timed(directory)
+        print(f"{count} .synth sources on {os.cpu_count()} cpus")
+        print(f"serial      {serial*1000:9.1f}ms")
+        print(f"parallel    {parallel*1000:9.1f}ms")
+        print(f"unchanged   {unchanged*1000:9.1f}ms")
+        print(f"one changed {one*1000:9.1f}ms")
+        synthbuild.report([r for r in results if r.status != "skipped"])
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,55 @@
+# Playback telemetry on a fake server, and what recording it costs.
+#
+#     python3 -m benchmarks.telemetry
+#
+# Prints the transport bar summary for a short playback in immediate and
+# lookahead mode, then times dispatching a dense sequence with and without
+# telemetry.
+from benchmarks.lookahead import FakeServer, FakeFabric, wait_until_done, make_sequence
+from sequencer import Sequencer, Player
+from telemetry import Telemetry
+import json
+import os
+import tempfile
+import time
+
+class CountingFabric(FakeFabric):
+    telemetry = None
+
+    def synth(self, name, **args):
+        if self.telemetry is not None:
+            self.telemetry.message(name, "/s_new", args, name, 0, 0, 0)
+        return super().synth(name, **args)
+
+def play(lookahead):
+    sequence = make_sequence(2.0, 64)
+    fabric = CountingFabric(FakeServer(), ["hat"])
+    telemetry = Telemetry()
+    sequencer = Sequencer(sequence, 0.0, -1, -1, sequence.end, lookahead=lookahead)
+    wait_until_done(Player({}, fabric, sequencer, telemetry=telemetry))
+    return telemetry
+
+def dispatch(telemetry, count=100000):
+    sequence = make_sequence(count / 1000, 1000)
+    fabric = CountingFabric(FakeServer(), ["hat"])
+    fabric.telemetry = telemetry
+    sequencer = Sequencer(sequence, 0.0, -1, -1, sequence.end)
+    sequencer.telemetry = telemetry
+    start = time.perf_counter()
+    sequencer._schedule(sequence.end, {}, fabric, True)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    for lookahead in [0.0, 0.1]:
+        telemetry = play(lookahead)
+        print(f"lookahead={lookahead:.1f}s {telemetry.summary()}")
+    filename = os.path.join(tempfile.mkdtemp(), "telemetry.json")
+    telemetry.dump(filename)
+    with open(filename) as fd:
+        tags = json.load(fd)["tags"]
+    print(f"dump: {os.path.getsize(filename)} bytes, hat sent "
+          f"{tags['hat']['messages']} messages, {tags['hat']['bytes']} bytes")
+    off = dispatch(None)
+    on = dispatch(Telemetry())
+    print(f"dispatch 100000 events: off={1000*off:.1f}ms on={1000*on:.1f}ms "
+          f"overhead={1e6*(on-off)/100000:.2f}us/event")
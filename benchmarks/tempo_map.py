@@ -0,0 +1,32 @@
+# Scalar against batched tempo map conversion on 10^5 events.
+#
+#     python3 -m benchmarks.tempo_map
+import music
+import numpy as np
+import time
+
+def make_tempo():
+    events = [(0.0, False, 120.0)]
+    for i in range(1, 64):
+        events.append((i * 4.0, i % 3 == 0, 80.0 + 60.0 * (i % 5)))
+    return music.tempo_envelope(events)
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+if __name__ == "__main__":
+    tempo = make_tempo()
+    bars = np.sort(np.random.default_rng(1).uniform(0.0, 256.0, 100000))
+    bar_list = bars.tolist()
+
+    scalar, times = measure(lambda: [tempo.bar_to_time(b) for b in bar_list])
+    batch, times2 = measure(tempo.bars_to_times, bars)
+    print(f"bar_to_time   scalar={1000*scalar:8.2f}ms batch={1000*batch:8.2f}ms "
+          f"speedup={scalar/batch:6.1f}x maxdiff={np.max(np.abs(np.array(times) - times2)):.2e}")
+
+    scalar, bars1 = measure(lambda: [tempo.time_to_bar(t) for t in times])
+    batch, bars2 = measure(tempo.times_to_bars, times2)
+    print(f"time_to_bar   scalar={1000*scalar:8.2f}ms batch={1000*batch:8.2f}ms "
+          f"speedup={scalar/batch:6.1f}x maxdiff={np.max(np.abs(np.array(bars1) - bars2)):.2e}")
@@ -0,0 +1,68 @@
+# Voice allocation on a dense, long-release pad part, and on short notes
+# whose releases overlap.
+#
+#     python3 -m benchmarks.voices
+from collections import Counter
+from sequencer import Gate, VoicePolicy, allocate_voices
+
+def pad_part(notes=600, spacing=0.05, length=2.0):
+    events = []
+    for i in range(notes):
+        args = {"note": 48 + (i * 7) % 24, "volume": -6.0 - (i * 5) % 18}
+        events.append(Gate(i * spacing, "pad", i, args, False))
+        events.append(Gate(i * spacing + length, "pad", i, {}, True))
+    events.sort(key=lambda e: e.time)
+    return events
+
+def short_notes(notes=40, spacing=0.05, length=0.01):
+    events = []
+    for i in range(notes):
+        events.append(Gate(i * spacing, "pluck", i, {"note": 60 + i % 12}, False))
+        events.append(Gate(i * spacing + length, "pluck", i, {}, True))
+    events.sort(key=lambda e: e.time)
+    return events
+
+def sounding(events, release=1.0):
+    # Released synths keep sounding for release seconds, or until a forced
+    # release cuts them. Voices fading out of a forced release are counted
+    # apart, they last policy.fade seconds.
+    clavier = {}
+    tails = {}
+    fading = {}
+    peak = peak_fading = 0
+    for e in events:
+        tails = {gid: t for gid, t in tails.items() if t > e.time}
+        fading = {gid: t for gid, t in fading.items() if t > e.time}
+        if isinstance(e, Gate) and e.release:
+            gate = e.kwargs.get("gate", 0)
+            if gate < -1:
+                if e.group_id in clavier or e.group_id in tails:
+                    tails.pop(e.group_id, None)
+                    fading[e.group_id] = e.time - 1 - gate
+            elif e.group_id in clavier:
+                tails[e.group_id] = e.time + release
+        e.sim(clavier, {}, {})
+        peak = max(peak, len(clavier) + len(tails))
+        peak_fading = max(peak_fading, len(fading))
+    return peak, peak_fading
+
+def report(name, events, policy):
+    out, stolen, peak = allocate_voices(events, policy)
+    ids = len(set(e.group_id for e in out))
+    synths, fading = sounding(out, policy.release)
+    starts = Counter(e.release for e in out)
+    assert ids <= policy.max_voices and synths <= policy.max_voices
+    assert all(n <= policy.max_voices for n in peak.values())
+    print(f"{name:10} max={policy.max_voices}: {ids} voice ids, peak {synths} synths "
+          f"(+{fading} fading, builder peak {max(peak.values())}), stolen {stolen}, "
+          f"{starts[False]} gates / {starts[True]} releases")
+
+if __name__ == "__main__":
+    events = pad_part()
+    print(f"pad unlimited: {len(set(e.group_id for e in events))} group ids, "
+          f"peak {sounding(events)[0]} synths")
+    for steal in ["oldest", "quietest", "same-pitch"]:
+        report(steal, events, VoicePolicy(max_voices=16, steal=steal))
+    events = short_notes()
+    print(f"short notes unlimited: peak {sounding(events)[0]} synths")
+    report("oldest", events, VoicePolicy(max_voices=4))
@@ -1,6 +1,8 @@
 from descriptors import *
 from supriya import Envelope, synthdef
 from supriya.ugens import *
+import synthbuild
+import time
 
 save = Saver("synthdefs")
 
@@ -230,6 +232,11 @@ save(demo_kick,
     out = bus("ar", "out", 2),
     volume = db)
 
+started = time.perf_counter()
+results = synthbuild.build(save.directory, save.registered)
+if __name__ == "__main__":
+    synthbuild.report(results, time.perf_counter() - started)
+
 if False:
     import supriya, time, os
     if "SC_JACK_DEFAULT_INPUTS" not in os.environ:
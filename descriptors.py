@@ -1,4 +1,5 @@
 import json
+import music
 import os
 
 def read_desc(filename):
@@ -48,13 +49,11 @@ class Saver:
         if not os.path.exists(directory):
             os.mkdir(directory)
         self.directory = directory
+        self.registered = []
 
+    # Files are written by synthbuild.build, which skips unchanged ones.
     def __call__(self, synthdef, **params):
-        desc = "\n".join(f"{n}: {v}" for n,v in params.items())
-        with open(os.path.join(self.directory, f'{synthdef.effective_name}.scsynthdef'), 'wb') as fd:
-            fd.write(synthdef.compile())
-        with open(os.path.join(self.directory, f'{synthdef.effective_name}.desc'), 'w') as fd:
-            fd.write(desc)
+        self.registered.append((synthdef, params))
 
 class Descriptor:
     def __init__(self, synthdef, mdesc, type_param):
@@ -120,4 +119,24 @@ class Descriptor:
             if isinstance(spec, bus) and spec.mode == 'out':
                 yield name
 
-
+hz_table = [440.0 * 2**((n-69)/12) for n in range(128)]
+
+def to_hz(param):
+    if isinstance(param, music.Pitch):
+        param = int(param)
+    if isinstance(param, int):
+        if 0 <= param < 128:
+            return hz_table[param]
+        return 440.0 * 2**((param-69)/12)
+    return param
+
+def to_plain(param):
+    if isinstance(param, music.Pitch):
+        return int(param)
+    return param
+
+def converters(descriptor):
+    # Only hz fields need more than pitch resolution. Both conversions
+    # leave already converted values alone, so mapping twice is harmless.
+    names = list(descriptor.mdesc) + ["*", "~"]
+    return {n: to_hz for n in names if descriptor.field_type(n) == "hz"}
@@ -56,6 +56,7 @@ class Fabric:
     def __init__(self, server, cells, connections, definitions):
         self.server = server
         self.trail = defaultdict(dict)
+        self.released = {}
         descriptors = definitions.descriptors(cells)
         synthdefs = set(desc.synthdef for desc in descriptors.values() if desc.synthdef is not None)
 
@@ -205,6 +206,12 @@ class Fabric:
             self.trail[label].update(params)
             return LabeledSynth(label, self, synth)
 
+    def keep_released(self, group_id, synth):
+        self.released.pop(group_id, None)
+        self.released[group_id] = synth
+        if len(self.released) > 1024:
+            del self.released[next(iter(self.released))]
+
 class LabeledSynth:
     def __init__(self, label, fabric, synth):
         self.label = label
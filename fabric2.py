@@ -1,12 +1,16 @@
 from collections import defaultdict, deque
 from dataclasses import dataclass, field
 from typing import List, Dict, Set, Optional, Callable, Tuple, Any, Union, DefaultDict
-from descriptors import bus, read_desc, Descriptor
+from descriptors import bus, read_desc, Descriptor, converters, to_plain
 from supriya import synthdef
-from supriya.ugens import In, Out, LeakDC, Limiter
+from supriya.ugens import In, Out, LeakDC, Limiter, BufRd, ReplaceOut, Sweep
 from model2 import synthlang
 import supriya
+import hashlib
 import os
+import numpy as np
+import pickle
+import time
 import music
 
 if "SC_JACK_DEFAULT_INPUTS" not in os.environ:
@@ -15,18 +19,32 @@ if "SC_JACK_DEFAULT_OUTPUTS" not in os.environ:
     os.environ["SC_JACK_DEFAULT_OUTPUTS"] = "system"
 
 class Definitions:
-    def __init__(self, synthdef_directory):
+    def __init__(self, synthdef_directory, cache_directory=None):
         self.synthdef_directory = synthdef_directory
+        if cache_directory is None:
+            cache_directory = os.path.join(synthdef_directory, ".cache")
+        self.cache = DefinitionCache(cache_directory)
         self.table = {}
+        self.timings = {}
+        self.digests = {}
         self.temp_data = None
         self.temp_name = None
         self.temp_head = 0
         self.temp_tail = 0
         self.temp = None
+        self.temp_digest = None
 
     def temp_refresh(self):
+        data = "".join(self.temp_data)
+        digest = source_hash(self.temp_name, data.encode("utf-8"))
+        if digest == self.temp_digest:
+            return False
         try:
-            self.temp = synthlang.from_string("".join(self.temp_data), self.temp_name)
+            dfn = self.cache.get(self.temp_name, digest)
+            if dfn is None:
+                dfn = synthlang.from_string(data, self.temp_name)
+            self.temp = dfn
+            self.temp_digest = digest
             return True
         except Exception as e:
             import traceback
@@ -45,15 +63,35 @@ class Definitions:
             return self.temp
         if name in self.table:
             return self.table[name]
+        now = time.perf_counter()
         filename = os.path.join(self.synthdef_directory, name)
         if os.path.exists(filename + ".synth"):
-            with open(filename + ".synth", "r", encoding="utf-8") as fd:
+            with open(filename + ".synth", "rb") as fd:
                 data = fd.read()
-            self.table[name] = dfn = synthlang.from_string(data, name)
+            digest = source_hash(name, data)
+            if (dfn := self.cache.get(name, digest)) is None:
+                dfn = synthlang.from_string(data.decode("utf-8"), name)
+                self.cache.put(name, digest, dfn)
         else:
-            self.table[name] = dfn = load_definition(filename)
+            with open(filename + ".scsynthdef", "rb") as fd:
+                data = fd.read()
+            with open(filename + ".desc", "rb") as fd:
+                desc = fd.read()
+            digest = source_hash(name, data, desc)
+            if (dfn := self.cache.get(name, digest)) is None:
+                dfn = load_definition(filename)
+                self.cache.put(name, digest, dfn)
+        self.timings[name] = time.perf_counter() - now, self.cache.last_hit
+        self.digests[name] = digest
+        self.table[name] = dfn
         return dfn
 
+    def source_digest(self, name):
+        if name == self.temp_name and self.temp_name is not None:
+            return self.temp_digest
+        self.definition(name)
+        return self.digests[name]
+
     def descriptors(self, cells):
         descriptors = {cell.name: self.descriptor(cell) for cell in cells}
         if 'tempo' not in descriptors:
@@ -77,6 +115,61 @@ def load_definition(filename):
     synthdef = supriya.ugens.decompile_synthdef(data)
     return (synthdef, dict(read_desc(f"{filename}.desc")))
 
+def source_hash(name, *parts):
+    h = hashlib.sha1()
+    h.update(repr((CACHE_VERSION, supriya.__version__, name)).encode("utf-8"))
+    for part in parts:
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+CACHE_VERSION = 1
+
+# Parsed definitions are stored next to their sources, one file per name,
+# keyed by a hash of the source text. An entry holds the compiled synthdef
+# bytes, the pickled synthdef and its descriptor. Unpickling is an order of
+# magnitude faster than decompiling the bytes or running the parser.
+class DefinitionCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.last_hit = False
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".pickle")
+
+    def get(self, name, digest):
+        self.last_hit = False
+        try:
+            with open(self.path(name), "rb") as fd:
+                entry = pickle.load(fd)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            entry = None
+        if entry is None or entry["digest"] != digest:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.last_hit = True
+        return entry["synthdef"], entry["mdesc"]
+
+    def put(self, name, digest, dfn):
+        synthdef, mdesc = dfn
+        entry = {
+            "digest": digest,
+            "compiled": synthdef.compile(),
+            "synthdef": synthdef,
+            "mdesc": mdesc,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            partial = self.path(name) + f".{os.getpid()}.partial"
+            with open(partial, "wb") as fd:
+                pickle.dump(entry, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(partial, self.path(name))
+        except OSError:
+            pass
+
 @dataclass
 class Relay:
     i : int
@@ -85,9 +178,8 @@ class Relay:
 class Fabric:
     def __init__(self, server, cells, connections, definitions):
         self.server = server
+        self.definitions = definitions
         self.trail = defaultdict(dict)
-        descriptors = definitions.descriptors(cells)
-        synthdefs = set(desc.synthdef for desc in descriptors.values() if desc.synthdef is not None)
 
         self.safe_output = server.add_bus_group("ar", 2)
         @synthdef()
@@ -96,14 +188,51 @@ class Fabric:
             sig = LeakDC.ar(source=sig)
             sig = Limiter.ar(source=sig)
             Out.ar(bus=0, source=sig)
-        synthdefs.add(safety_wrapper)
-
-        if synthdefs:
-            server.add_synthdefs(*synthdefs)
-        self.synthdefs = synthdefs
-
+        server.add_synthdefs(safety_wrapper)
         if not isinstance(server, supriya.Score):
             server.sync()
+        self.safety_wrapper = safety_wrapper
+        self.synthdefs = {safety_wrapper}
+        self.relaydefs = {}
+        self.bus_groups = []
+        self.buses = {}
+        self.dummies = {}
+        self.cells = []
+        self.descriptors = {}
+        self.converters = {}
+        self.busmap = defaultdict(dict)
+        self.synths = {}
+        self.params = {}
+        self.multi = {}
+        self.automation = {}
+        # Buffers replaced by a newer upload, freed once the reader
+        # has been pointed at the new one.
+        self.retired = []
+        self.readerdef = None
+        # Set by the player to count the messages sent per tag.
+        self.telemetry = None
+        # Synths whose gate closed, by group id, so that a voice stolen
+        # while it is releasing can be cut short. Only the latest ones
+        # are kept, the release of the others is long over.
+        self.released = {}
+        self.relays = {}
+        self.order = []
+        self.root = server.add_group()
+        self.safety = self.root.add_synth(safety_wrapper)
+        self.apply_diff(cells, connections)
+
+    def apply_diff(self, cells, connections):
+        # Brings the node graph in line with the given cells and connections.
+        # Synths whose synthdef did not change stay alive, they only receive
+        # the parameters and buses that changed, and are moved if needed.
+        server = self.server
+        definitions = self.definitions
+        descriptors = definitions.descriptors(cells)
+        synthdefs = set(desc.synthdef for desc in descriptors.values() if desc.synthdef is not None)
+        if synthdefs - self.synthdefs:
+            server.add_synthdefs(*(synthdefs - self.synthdefs))
+            if not isinstance(server, supriya.Score):
+                server.sync()
 
         W = []
         R = [('system', 'out')]
@@ -114,9 +243,7 @@ class Fabric:
         E = connections
         assignment, relays = bus_assignment(W,R,E)
         cells = cells + [Relay(*ii) for ii in relays]
-        self.cells = topological_sort(cells, definitions, assignment)
-
-        self.bus_groups = []
+        cells = topological_sort(cells, definitions, assignment)
 
         def retrieve_type(name):
             if name == ("system", "out"):
@@ -129,75 +256,239 @@ class Fabric:
             self.bus_groups.append(bgroup)
             return bgroup
 
-        dummies = {}
         def dummy_bus_by_type(name, mode):
             sm = retrieve_type(name), mode
-            if sm not in dummies:
-                dummies[sm] = allocate_by_type(name)
-            return dummies[sm]
+            if sm not in self.dummies:
+                self.dummies[sm] = allocate_by_type(name)
+            return self.dummies[sm]
 
+        # Buses are identified by the ports they join,
+        # as bus_assignment numbers them differently on every run.
+        ports = defaultdict(set)
+        for name, busi in assignment.items():
+            if busi >= 0:
+                ports[busi].add(name)
         output_busi = assignment[('system', 'out')]
         buses = {output_busi: self.safe_output}
-        for name, busi in assignment.items():
-            if name[0] == "system":
-                continue
-            if busi not in buses and busi >= 0:
-                buses[busi] = allocate_by_type(name)
+        unused_buses = self.buses
+        self.buses = {}
+        for busi, names in ports.items():
+            if busi not in buses:
+                key = frozenset(names), retrieve_type(min(names))
+                if key in unused_buses:
+                    self.buses[key] = unused_buses.pop(key)
+                else:
+                    self.buses[key] = allocate_by_type(min(names))
+                buses[busi] = self.buses[key]
 
-        self.busmap = defaultdict(dict)
+        busmap = defaultdict(dict)
         for name, busi in assignment.items():
             if name[0] == "system":
                 continue
             cell_label, param_name = name
             if busi >= 0:
-                self.busmap[cell_label][param_name] = buses[busi]
+                busmap[cell_label][param_name] = buses[busi]
             else:
                 mode = descriptors[cell_label].mdesc[param_name].mode
-                self.busmap[cell_label][param_name] = dummy_bus_by_type(name, mode)
-
-        relaydefs = {}
-        def relay_synthdef(calculation_rate, count):
-            if (calculation_rate, count) not in relaydefs:
-                if calculation_rate == supriya.CalculationRate.AUDIO:
-                    in_fn = In.ar
-                    out_fn = Out.ar
-                elif calculation_rate == supriya.CalculationRate.CONTROL:
-                    in_fn = In.kr
-                    out_fn = Out.kr
-                @synthdef()
-                def relay_synth(input_bus, output_bus):
-                    out_fn(bus=output_bus, source=in_fn(bus=input_bus, channel_count=count))
-                server.add_synthdefs(relay_synth)
-                if not isinstance(server, supriya.Score):
-                    server.sync()
-                relaydefs[(calculation_rate, count)] = relay_synth
-            return relaydefs[(calculation_rate, count)]
-
-        self.descriptors = descriptors
-        self.synths = {}
-        self.root = server.add_group()
-        self.safety = self.root.add_synth(safety_wrapper)
-        for c in reversed(self.cells):
+                busmap[cell_label][param_name] = dummy_bus_by_type(name, mode)
+
+        # The player may still address removed cells until the swap below.
+        old_descriptors = self.descriptors
+        new_converters = {tag: converters(d) for tag, d in descriptors.items()}
+        self.converters = {**self.converters, **new_converters}
+
+        # Decide for every cell whether its node is kept or created.
+        unused_synths = dict(self.synths)
+        unused_relays = dict(self.relays)
+        plan = []
+        for c in cells:
             if isinstance(c, Relay):
-                b = buses[c.i]
-                if b == 0:
-                    sd = relay_synthdef(supriya.CalculationRate.AUDIO, 2)
+                key = buses[c.i], buses[c.o]
+                node = unused_relays.pop(key, None)
+                plan.append(("relay", key, node))
+                continue
+            old = unused_synths.pop(c.name, None)
+            # Cells are edited in place, so the flag is compared to a copy.
+            if old is not None and (self.multi.get(c.name) != c.multi
+                    or old_descriptors[c.name].synthdef is not descriptors[c.name].synthdef):
+                unused_synths[c.name] = old
+                old = None
+            # Notes in a group read their buses from the busmap when they
+            # start, the ones already playing are rewired through the group.
+            if c.multi:
+                params = dict(busmap[c.name])
+            else:
+                params = self.map_params(c.name, c.params)
+                params.update(busmap[c.name])
+            if old is not None:
+                previous = self.params.get(c.name, {})
+                changes = {n: v for n, v in params.items() if previous.get(n) != v}
+                if changes:
+                    old[1].set(**changes)
+            self.params[c.name] = params
+            self.multi[c.name] = c.multi
+            plan.append(("group" if c.multi else "synth", c, None if old is None else old[1]))
+
+        for name, (c, node) in unused_synths.items():
+            node.free()
+            self.order.remove(node)
+        planned = {c.name for c in cells if not isinstance(c, Relay)}
+        self.params = {name: p for name, p in self.params.items() if name in planned}
+        self.multi = {name: m for name, m in self.multi.items() if name in planned}
+        for node in unused_relays.values():
+            node.free()
+            self.order.remove(node)
+
+        # New nodes are added to the head in reverse order,
+        # so a graph built from scratch needs no moves.
+        synths = {}
+        relays = {}
+        nodes = []
+        for kind, item, node in reversed(plan):
+            if node is None:
+                if kind == "relay":
+                    b, o = item
+                    if b == 0:
+                        sd = self.relay_synthdef(supriya.CalculationRate.AUDIO, 2)
+                    else:
+                        sd = self.relay_synthdef(b.calculation_rate, b.count)
+                    node = self.root.add_synth(sd, input_bus=b, output_bus=o)
+                elif kind == "group":
+                    node = self.root.add_group()
                 else:
-                    sd = relay_synthdef(b.calculation_rate, b.count)
-                self.root.add_synth(sd, input_bus=b, output_bus=buses[c.o])
+                    node = self.root.add_synth(descriptors[item.name].synthdef, **self.params[item.name])
+                self.order.insert(0, node)
+            if kind == "relay":
+                relays[item] = node
             else:
-                d = self.descriptors[c.name]
-                if c.multi:
-                    subgroup = self.root.add_group()
-                    self.synths[c.name] = c, subgroup
+                synths[item.name] = item, node
+            nodes.append(node)
+        nodes.reverse()
+        self.descriptors = descriptors
+        self.converters = new_converters
+        self.busmap = busmap
+        self.synths = synths
+        self.relays = relays
+
+        previous = None
+        for node in nodes:
+            i = self.order.index(node)
+            j = 0 if previous is None else self.order.index(previous) + 1
+            if i != j:
+                self.order.pop(i)
+                if previous is None:
+                    node.move(self.root, supriya.AddAction.ADD_TO_HEAD)
+                    self.order.insert(0, node)
                 else:
-                    params = self.map_params(c.name, c.params)
-                    params.update(self.busmap[c.name])
-                    synth = self.root.add_synth(d.synthdef, **params)
-                    self.synths[c.name] = c, synth
+                    node.move(previous, supriya.AddAction.ADD_AFTER)
+                    self.order.insert(self.order.index(previous) + 1, node)
+            previous = node
+
+        for bgroup in unused_buses.values():
+            self.bus_groups.remove(bgroup)
+            bgroup.free()
+        unused_synthdefs = self.synthdefs - synthdefs - {self.safety_wrapper}
+        if unused_synthdefs:
+            server.free_synthdefs(*unused_synthdefs)
+        self.synthdefs = synthdefs | {self.safety_wrapper}
+        self.cells = cells
+        self.rewire_automation()
+
+    def relay_synthdef(self, calculation_rate, count):
+        if (calculation_rate, count) not in self.relaydefs:
+            if calculation_rate == supriya.CalculationRate.AUDIO:
+                in_fn = In.ar
+                out_fn = Out.ar
+            elif calculation_rate == supriya.CalculationRate.CONTROL:
+                in_fn = In.kr
+                out_fn = Out.kr
+            @synthdef()
+            def relay_synth(input_bus, output_bus):
+                out_fn(bus=output_bus, source=in_fn(bus=input_bus, channel_count=count))
+            self.server.add_synthdefs(relay_synth)
+            if not isinstance(self.server, supriya.Score):
+                self.server.sync()
+            self.relaydefs[(calculation_rate, count)] = relay_synth
+        return self.relaydefs[(calculation_rate, count)]
+
+    def load_automation(self, tag, curve, rate):
+        # The curve is uploaded once into a buffer, and a reader synth
+        # replaces the output of the cell's own synth, which is paused.
+        # This waits on the server, so it must not run inside a bundle.
+        if not self.automatable(tag):
+            return None
+        entry = self.automation.get(tag)
+        if entry is None or entry[1] != rate or not np.array_equal(entry[0], curve):
+            buffer = self.server.add_buffer(channel_count=1, frame_count=len(curve))
+            if not isinstance(self.server, supriya.Score):
+                self.server.sync()
+            for i in range(0, len(curve), 1024):
+                buffer.set_range(i, curve[i:i+1024].tolist())
+            if entry is None:
+                reader = self.synths[tag][1].add_synth(self.reader_synthdef(),
+                    add_action=supriya.AddAction.ADD_AFTER,
+                    out=self.automation_bus(tag), buffer=buffer, rate=rate)
+                self.synths[tag][1].pause()
+            else:
+                reader = entry[3]
+                self.retired.append(entry[2])
+            self.automation[tag] = entry = curve, rate, buffer, reader
+        return entry
+
+    def automate(self, tag, curve, rate, position):
+        # Once the curve is loaded, seeking is a single /n_set.
+        entry = self.load_automation(tag, curve, rate)
+        if entry is None:
+            return
+        curve, rate, buffer, reader = entry
+        reader.set(buffer=buffer, rate=rate, position=position, run=1, trigger=1)
+        while self.retired:
+            self.retired.pop().free()
+
+    def halt_automation(self):
+        for curve, rate, buffer, reader in self.automation.values():
+            reader.set(run=0)
+
+    def automatable(self, tag):
+        # Curves replace the first output of a single synth.
+        if tag not in self.synths or self.synths[tag][0].multi:
+            return False
+        return any(True for _ in self.descriptors[tag].outputs)
+
+    def automation_bus(self, tag):
+        outputs = list(self.descriptors[tag].outputs)
+        return self.busmap[tag][outputs[0]]
+
+    def rewire_automation(self):
+        for tag, (curve, rate, buffer, reader) in list(self.automation.items()):
+            if not self.automatable(tag):
+                reader.free()
+                buffer.free()
+                del self.automation[tag]
+                continue
+            node = self.synths[tag][1]
+            node.pause()
+            reader.move(node, supriya.AddAction.ADD_AFTER)
+            reader.set(out=self.automation_bus(tag))
+
+    def reader_synthdef(self):
+        if self.readerdef is None:
+            @synthdef('kr', 'kr', 'kr', 'kr', 'kr', 'tr')
+            def envelope_reader(out=0, buffer=0, rate=100, position=0, run=0, trigger=0):
+                phase = (Sweep.kr(trigger=trigger, rate=run) + position) * rate
+                ReplaceOut.kr(bus=out, source=BufRd.kr(buffer_id=buffer, phase=phase, loop=0))
+            self.server.add_synthdefs(envelope_reader)
+            if not isinstance(self.server, supriya.Score):
+                self.server.sync()
+            self.readerdef = envelope_reader
+        return self.readerdef
 
     def close(self):
         self.root.free()
+        for curve, rate, buffer, reader in self.automation.values():
+            buffer.free()
+        for buffer in self.retired:
+            buffer.free()
         for group in self.bus_groups:
             group.free()
         self.safe_output.free()
@@ -205,20 +496,16 @@ class Fabric:
             self.server.free_synthdefs(*self.synthdefs)
 
     def map_params(self, tag, params):
-        d = self.descriptors[tag]
-        return {n: self.map_param(d.field_type(n), v) for n, v in params.items()}
-
-    def map_param(self, ty, param):
-        if isinstance(param, music.Pitch):
-            param = int(param)
-        if ty == "hz" and isinstance(param, int):
-            return 440.0 * 2**((param-69)/12)
-        return param
+        conv = self.converters[tag]
+        return {n: conv.get(n, to_plain)(v) for n, v in params.items()}
 
     def control(self, name, **args):
         c, synth = self.synths[name]
-        synth.set(**self.map_params(name, args))
+        params = self.map_params(name, args)
+        synth.set(**params)
         self.trail[name].update(args)
+        if self.telemetry is not None:
+            self.telemetry.message(name, "/n_set", params, 0)
 
     def synth(self, name, **args):
         c, g = self.synths[name]
@@ -227,10 +514,19 @@ class Fabric:
             params = c.params.copy()
             params.update(self.busmap[name])
             params.update(args)
-            synth = g.add_synth(d.synthdef, **self.map_params(name, params))
+            mapped = self.map_params(name, params)
+            synth = g.add_synth(d.synthdef, **mapped)
             self.trail[name].update(params)
+            if self.telemetry is not None:
+                self.telemetry.message(name, "/s_new", mapped, d.synthdef.effective_name, 0, 0, 0)
             return LabeledSynth(name, self, synth)
 
+    def keep_released(self, group_id, synth):
+        self.released.pop(group_id, None)
+        self.released[group_id] = synth
+        if len(self.released) > 1024:
+            del self.released[next(iter(self.released))]
+
 class LabeledSynth:
     def __init__(self, name, fabric, synth):
         self.name = name
@@ -240,6 +536,8 @@ class LabeledSynth:
     def set(self, **params):
         self.fabric.trail[self.name].update(params)
         params = self.fabric.map_params(self.name, params)
+        if self.fabric.telemetry is not None:
+            self.fabric.telemetry.message(self.name, "/n_set", params, 0)
         return self.synth.set(**params)
 
 def topological_sort(cells, definitions, assignment):
@@ -1,24 +1,29 @@
-from dataclasses import dataclass, field
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
 from typing import List, Dict, Optional, Callable, Tuple, Any, Set, Union
 from controllers import quick_connect
 from descriptors import bus, kinds
 from fabric2 import Definitions, Fabric
 #from model import Document, Cell, from_file, stringify, reader, to_file
 from model2 import synthlang
-from sequencer import Player, Sequencer, SequenceBuilder2
+from sequencer import Player, Sequencer, SequenceBuilder2, StreamingSequenceBuilder, VoicePolicy
 from node_view3 import NodeView
+from render import Renderer
 import numpy as np
 import math
 import music
 import os
 import pygame
+import seqcache
 import spectroscope
+import telemetry
 import supriya
 import sys
+import threading
 from simgui import SIMGUI, Grid, Text, Slider
 
 from model2.schema import *
-from model2.parse import from_string, from_file, command_from_string
+from model2.parse import from_string, command_from_string, DocumentReader
 
 demo_seq = """oscillseq aqua
 
@@ -171,9 +176,45 @@ def compute_view_height(config):
         below = config.get('below', 0)
         return 3*(above + count + below)
 
+class PatternCache:
+    """Evaluated brushes and their patterns, kept across edits.
+
+    Sequence trees are persistent, so a brush an edit did not touch keeps
+    its expression nodes. Entries are keyed on those nodes and the
+    effective config, and the key holds on to both, so their identities
+    stay valid for as long as the entry lives."""
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, proc, exprs, config):
+        key = exprs, tuple(sorted((name, (type(value), value.name) if isinstance(value, (Ref, Dynamic, Unk)) else value)
+                                  for name, value in config.items()))
+        with self.lock:
+            if (entry := self.entries.get(key)) is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        expr = evaluate_all(config, exprs)
+        entry = (expr,) + proc.compute_pattern(expr, config)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return entry
+
+    def summary(self):
+        return f"patterns {len(self.entries)}/{self.capacity} hits={self.hits} misses={self.misses}"
+
 class DocumentProcessing:
-    def __init__(self, doc):
+    def __init__(self, doc, patterns=None):
         self.doc = doc
+        self.patterns = patterns
         self.declarations = {}
         self.dimensions   = {}
         for declaration in doc.declarations:
@@ -192,8 +233,7 @@ class DocumentProcessing:
                 duration = max(duration, d+s)
                 height   = max(height, l+h)
             elif isinstance(e, BrushEntity):
-                expr = evaluate_all(config, e.expr)
-                data, d = self.compute_pattern(expr, config)
+                expr, data, d = self.evaluate(e, config)
                 self.dimensions[key + (i,)] = d, 1, config, expr, data
                 duration = max(duration, d+s)
                 height   = max(height, l + 1)
@@ -222,28 +262,44 @@ class DocumentProcessing:
                 d = self.construct(sb, subdecl, s, k, config)
                 bound = max(bound, s+d)
             if isinstance(e, BrushEntity):
-                expr       = evaluate_all(config, e.expr)
-                pattern, d = self.compute_pattern(expr, config)
-                match config["brush"]:
-                    case Unk("hocket"):
-                        cons = self.construct_hocket
-                    case Unk("gate"):
-                        cons = self.construct_gate
-                    case Unk("once"):
-                        cons = self.construct_once
-                    case Unk("quadratic"):
-                        cons = self.construct_quadratic
-                    case Unk("slide"):
-                        cons = self.construct_slide
-                    case Unk("control"):
-                        cons = self.construct_control
-                    case _:
-                        cons=None
+                if (d := sb.begin_brush(k, e, config, s)) is not None:
+                    bound = max(bound, s+d)
+                    continue
+                cons, pattern, d = self.brush(e, config)
                 if cons:
                     cons(sb, config, pattern, s, k)
+                sb.end_brush(d)
                 bound = max(bound, s+d)
         return bound - shift
 
+    def evaluate(self, e, config):
+        if self.patterns is not None:
+            return self.patterns.get(self, e.expr, config)
+        expr = evaluate_all(config, e.expr)
+        return (expr,) + self.compute_pattern(expr, config)
+
+    def brush(self, e, config):
+        expr, pattern, d = self.evaluate(e, config)
+        return self.constructor(config), pattern, d
+
+    def constructor(self, config):
+        match config["brush"]:
+            case Unk("hocket"):
+                cons = self.construct_hocket
+            case Unk("gate"):
+                cons = self.construct_gate
+            case Unk("once"):
+                cons = self.construct_once
+            case Unk("quadratic"):
+                cons = self.construct_quadratic
+            case Unk("slide"):
+                cons = self.construct_slide
+            case Unk("control"):
+                cons = self.construct_control
+            case _:
+                cons=None
+        return cons
+
     def compute_pattern(self, exprs, config):
         events = []
         def is_grace(this):
@@ -389,15 +445,21 @@ class Editor:
         self.font = pygame.font.SysFont('Arial', 16)
 
         self.doc = from_string(demo_seq)
-        self.proc = DocumentProcessing(self.doc)
+        self.patterns = PatternCache()
+        self.proc = DocumentProcessing(self.doc, self.patterns)
 
         if len(sys.argv) > 1:
             self.filename = sys.argv[1]
         else:
             self.filename = "unnamed.seq.json"
+        self.reader = DocumentReader()
+        self.save_lock = threading.Lock()
+        self.save_thread = None
+        self.save_generation = 0
+        self.saved_generation = 0
         if os.path.exists(self.filename):
-            self.doc = from_file(self.filename)
-            self.proc = DocumentProcessing(self.doc)
+            self.doc = self.reader.read_file(self.filename)
+            self.proc = DocumentProcessing(self.doc, self.patterns)
             if self.filename.endswith(".json"):
                 self.filename = self.filename[:-5]
         #self.png_directory = os.path.abspath(
@@ -414,8 +476,9 @@ class Editor:
 
         self.transport = Transport(
             synthdef_directory = synthdef_directory)
+        self.renderer = Renderer(synthdef_directory)
         self.transport.set_online()
-        self.transport.refresh(self.proc)
+        self.transport.open(self.proc, os.path.splitext(self.filename)[0] + ".seqc")
         self.transport.set_fabric()
         self.transport.toggle_play()
 
@@ -469,7 +532,7 @@ class Editor:
             self.after_rewrite()
 
     def after_rewrite(self):
-        self.proc = DocumentProcessing(self.doc)
+        self.proc = DocumentProcessing(self.doc, self.patterns)
         self.transport.refresh(self.proc)
 
     def run(self):
@@ -482,16 +545,24 @@ class Editor:
                 if self.refresh_in <= 0.0:
                     self.refresh_in = None
                     if self.transport.definitions.temp_refresh():
-                        self.transport.refresh(self.proc)
+                        self.transport.refresh(self.proc, incremental=False)
                         self.transport.restart_fabric()
                     
 
+            self.transport.poll()
+            if (status := self.renderer.poll()) is not None:
+                self.response = status
+
             ui.process_events()
             self.screen.fill((30, 30, 30))
             ui.draw(self.screen)
             pygame.display.flip()
 
 
+        if self.save_thread is not None:
+            self.save_thread.join()
+        self.renderer.close()
+        self.reader.close()
         self.transport.set_offline()
         self.set_midi_off()
         pygame.quit()
@@ -807,6 +878,23 @@ class Editor:
                 self.render_score()
             if ui.button(f"save {os.path.basename(self.filename)!r}", main_grid(0, 2, 4, 3), "save-button"):
                 self.save_file()
+            if ui.button(f"reload {os.path.basename(self.filename)!r}", main_grid(5, 2, 9, 3), "reload-button"):
+                self.reload_file()
+            if ui.button(["telemetry=off", "telemetry=on"][self.transport.telemetry is not None],
+                main_grid(0, 4, 4, 5), "telemetry-button"):
+                self.transport.set_telemetry(self.transport.telemetry is None)
+            if self.transport.telemetry is not None:
+                filename = os.path.splitext(self.filename)[0] + ".telemetry.json"
+                if ui.button(f"dump {os.path.basename(filename)!r}", main_grid(0, 6, 4, 7), "telemetry-dump-button"):
+                    self.transport.telemetry.dump(filename)
+                    self.response = f"telemetry written to {filename}"
+            ui.label(self.patterns.summary(), main_grid(0, 8, 8, 9))
+            voices = self.transport.voices
+            if ui.button("voices=off" if voices is None else f"voices={voices.max_voices}",
+                main_grid(0, 10, 4, 11), "voices-button"):
+                self.transport.voices = VoicePolicy() if voices is None else None
+                self.transport.refresh(self.proc)
+            ui.label(self.transport.sequence_summary(), main_grid(0, 12, 8, 13))
 
         if ui.tab_button(self.mode, "file", bot_grid(0, 0, 5, 1),  "file-tab", allow_focus=False):
             self.mode = "file"
@@ -853,13 +941,12 @@ class Editor:
         if ui.button(["loop=off", "loop=on"][self.transport.playback_loop],
             grid(6, 0, 9, 1), "loop status", allow_focus=False):
             self.transport.playback_loop = not self.transport.playback_loop
-            if (status := self.transport.get_playing()) is not None:
-                self.transport.set_fabric()
-                sequence = self.transport.sequence
-                self.transport.set_playing(Sequencer(sequence, point=sequence.t(status), **self.transport.playback_params(sequence)))
+            self.transport.update_range()
         ui.widget(Trackline(self, self.timeline,
             pygame.Rect(self.MARGIN, 0, self.screen_width - self.MARGIN, 24),
             "trackline"))
+        if self.transport.telemetry is not None:
+            ui.label(self.transport.telemetry.summary(), grid(30, 0, 50, 1))
 
     def toggle_midi(self):
         if self.midi_status:
@@ -879,47 +966,182 @@ class Editor:
         self.midi_controllers.clear()
 
     def save_file(self):
-        with open(self.filename, "w", encoding='utf-8') as fd:
-            fd.write(repr(self.doc))
-        print("document saved!")
+        # Declarations are laid out and written on a thread of their own,
+        # synths and connections are taken here as the synth editor
+        # changes them in place. The sequence cache is written by the same
+        # thread, its digest is taken from the text written.
+        doc = self.doc
+        fabric = doc.format_fabric()
+        cache = self.transport.cache_entry(doc)
+        self.save_generation += 1
+        self.save_thread = threading.Thread(target=self.write_document, daemon=True,
+            args=(self.filename, doc, fabric, cache, self.save_generation))
+        self.save_thread.start()
+
+    def write_document(self, filename, doc, fabric, cache, generation):
+        partial = filename + f".{os.getpid()}.partial"
+        try:
+            source = doc.format_text(fabric)
+            with self.save_lock:
+                if generation < self.saved_generation:
+                    return
+                with open(partial, "w", encoding='utf-8') as fd:
+                    fd.write(source)
+                os.replace(partial, filename)
+                self.saved_generation = generation
+                if cache is not None:
+                    cache_filename, sequence, sources, voices, envelope_rate = cache
+                    reason = seqcache.save(cache_filename, sequence,
+                        seqcache.document_digest(source, sources, voices, envelope_rate))
+                    if reason is not None:
+                        self.response = f"sequence not cached: {reason}"
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.response = f"could not save {filename}: {e!r}"
+            if os.path.exists(partial):
+                os.remove(partial)
+        else:
+            print("document saved!")
 
-    def render_score(self):
-        self.transport.set_offline()
+    def reload_file(self):
+        try:
+            self.doc = self.reader.read_file(self.filename)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.response = repr(e)
+        else:
+            self.response = f"reloaded {self.filename}"
+            self.after_rewrite()
 
+    def render_score(self):
         proc = self.proc
-        sb = SequenceBuilder2(self.transport.group_ids, self.transport.definitions.descriptors(proc.doc.synths))
+        sb = SequenceBuilder2({}, self.transport.definitions.descriptors(proc.doc.synths),
+                              voices=self.transport.voice_policy(),
+                              envelope_rate=self.transport.envelope_rate)
         duration = proc.construct(sb,
             proc.declarations["main"], 0, ("main",),
             default_rhythm_config)
         sequence = sb.build(duration)
+        self.renderer.submit(proc.doc, sequence, self.wav_filename)
 
-        score = supriya.Score(output_bus_channel_count=2)
-        clavier = {}
-        with score.at(0):
-            fabric = Fabric(score, self.doc.synths, self.doc.connections, self.transport.definitions)
-        for command in sequence.com:
-            with score.at(command.time):
-                command.send(clavier, fabric)
-        with score.at(sequence.t(duration)):
-            score.do_nothing()
-        supriya.render(score, output_file_path=self.wav_filename)
-        print("saved", self.wav_filename)
+class Compiler:
+    """Builds sequences on a worker thread.
 
-        self.transport.set_online()
-        self.transport.refresh(self.proc)
+    Requests that arrive while a build is running replace each other,
+    only the newest one is built next. The builder of the last build is
+    kept, so unchanged brushes are reused."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.request = None
+        self.result = None
+        self.busy = False
+        self.builder = None
+        self.synths = None
+        # Kept across builds, so that a note or a voice keeps its id
+        # when a rebuilt sequence is swapped in while it sounds.
+        self.group_ids = {}
+        self.voice_ids = {}
+        # Brushes of the last streamed sequence are expanded here
+        # while no build is waiting.
+        self.expansions = None
+        self.thread = threading.Thread(daemon=True, target=self._run)
+        self.thread.start()
+
+    def submit(self, proc, descriptors, incremental, voices, envelope_rate=None, streaming=False):
+        with self.condition:
+            self.request = proc, descriptors, incremental, voices, envelope_rate, streaming
+            self.condition.notify_all()
+
+    def poll(self):
+        with self.condition:
+            result, self.result = self.result, None
+            return result
+
+    def wait(self):
+        with self.condition:
+            while self.request is not None or self.busy:
+                self.condition.wait()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.request is None and (self.expansions is None or self.expansions.pending() is None):
+                    self.condition.wait()
+                request, self.request = self.request, None
+                self.busy = request is not None
+            if request is None:
+                self.expansions.work()
+                continue
+            try:
+                sequence = self._build(*request)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                sequence = None
+            with self.condition:
+                if sequence is not None:
+                    self.result = sequence
+                self.busy = False
+                self.condition.notify_all()
+
+    def _build(self, proc, descriptors, incremental, voices, envelope_rate, streaming):
+        if streaming:
+            self.builder = None
+            sb = StreamingSequenceBuilder(proc, descriptors, voices, envelope_rate, self.condition)
+            duration = proc.construct(sb,
+                proc.declarations["main"], 0, ("main",),
+                default_rhythm_config)
+            sequence = sb.build(duration)
+            if self.expansions is not None:
+                self.expansions.detach()
+            self.expansions = sb.expansions
+            return sequence
+        # Unchanged brushes are reused from the previous build,
+        # unless the synths they were built against have changed.
+        previous = self.builder
+        if (previous is None or not incremental or proc.doc.synths is not self.synths
+                or voices != previous.voices or envelope_rate != previous.envelope_rate):
+            previous = None
+        self.synths = proc.doc.synths
+        sb = SequenceBuilder2(self.group_ids, descriptors, previous, voices, envelope_rate, self.voice_ids)
+        self.builder = None
+        duration = proc.construct(sb,
+            proc.declarations["main"], 0, ("main",),
+            default_rhythm_config)
+        sequence = sb.build(duration)
+        self.builder = sb
+        return sequence
 
 class Transport:
     def __init__(self, synthdef_directory):
         self.definitions = Definitions(synthdef_directory = synthdef_directory)
+        self.compiler = Compiler()
         self.status = 0
         self.server = None
         self.fabric = None
         self.clavier = None
         self.player = None
+        self.sequencer = None
         self.playback_range = None
         self.playback_loop  = True
-        self.group_ids = {}
+        self.lookahead = 0.1
+        # Voices are only capped when a VoicePolicy is set, which changes
+        # how dense parts sound.
+        self.voices = None
+        # Frames per second of automation curves played from server
+        # buffers, or None to send automation as Quadratic messages.
+        self.envelope_rate = None
+        # Expand brushes while playing instead of building the whole
+        # song, for sets too long to hold in memory.
+        self.streaming = False
+        self.swap_at_bar = False
+        self.telemetry = None
         self.sequence = None
+        self.cache_filename = None
+        self.cache_check = None
+        self.cache_error = None
         self.make_spectroscope = None
         self.spectroscope_gui = None
 
@@ -939,20 +1161,87 @@ class Transport:
             self.spectroscope_gui.close()
             self.spectroscope_gui = None
 
-    def refresh(self, proc):
-        if self.status != 3:
-            self.group_ids.clear()
+    def open(self, proc, cache_filename):
+        # A sequence cached next to the document is used right away.
+        # The compiler still builds it in the background, and the cache
+        # is rewritten if its result differs.
+        self.cache_filename = cache_filename
+        digest = self.cache_digest(proc)
+        self.sequence = seqcache.load(cache_filename, digest)
+        self.refresh(proc)
+        self.cache_check = digest, self.sequence
+        if self.sequence is None:
+            self.compiler.wait()
+            self.poll()
+
+    def write_cache(self, filename, sequence, digest):
+        # The reason a build is not cached is shown with the sequence summary.
+        try:
+            self.cache_error = seqcache.save(filename, sequence, digest)
+        except OSError as e:
+            self.cache_error = repr(e)
+
+    def voice_policy(self):
+        # A copy, the compiler compares it with the one of the last build.
+        return None if self.voices is None else replace(self.voices)
+
+    def sequence_summary(self):
+        if self.sequence is None:
+            return ""
+        out = [f"{self.sequence.removed} redundant messages removed"]
+        if self.voices is not None:
+            peak = max(self.sequence.peak_voices.values(), default=0)
+            out.append(f"peak {peak} voices, {self.sequence.stolen} stolen")
+        if self.player is not None:
+            out.append(f"{sum(self.player.voices().values())} sounding")
+        if self.cache_error is not None:
+            out.append(f"not cached: {self.cache_error}")
+        return ", ".join(out)
+
+    def synth_sources(self, doc):
+        return {cell.synth: self.definitions.source_digest(cell.synth) for cell in doc.synths}
+
+    def cache_digest(self, proc):
+        return seqcache.document_digest(str(proc.doc), self.synth_sources(proc.doc),
+            self.voices, self.envelope_rate)
+
+    def cache_entry(self, doc):
+        # What the save thread needs to cache the current sequence, or None
+        # if the compiler has not caught up with the document.
+        with self.compiler.condition:
+            idle = self.compiler.request is None and not self.compiler.busy
+        if idle and self.cache_filename is not None and self.sequence is not None:
+            return (self.cache_filename, self.sequence, self.synth_sources(doc),
+                    self.voice_policy(), self.envelope_rate)
+
+    def refresh(self, proc, incremental=True, wait=False):
+        # The sequence is built on the compiler thread, poll() picks it up.
+        self.cache_check = None
+        changed = (proc.doc.synths is not self.current_synths
+                or proc.doc.connections is not self.current_connections)
         self.current_synths = proc.doc.synths
         self.current_connections = proc.doc.connections
-
-        sb = SequenceBuilder2(self.group_ids, self.definitions.descriptors(proc.doc.synths))
-        duration = proc.construct(sb,
-            proc.declarations["main"], 0, ("main",),
-            default_rhythm_config)
-        self.sequence = sb.build(duration)
-
-        if (point := self.get_playing()) is not None:
-            self.set_playing(Sequencer(self.sequence, point=self.sequence.t(point), **self.playback_params(self.sequence)))
+        if changed:
+            self.restart_fabric()
+        descriptors = self.definitions.descriptors(proc.doc.synths)
+        self.compiler.submit(proc, descriptors, incremental, self.voice_policy(),
+            self.envelope_rate, self.streaming)
+        if wait:
+            self.compiler.wait()
+            self.poll()
+
+    def poll(self):
+        if (sequence := self.compiler.poll()) is None:
+            return
+        if self.cache_check is not None:
+            digest, cached = self.cache_check
+            self.cache_check = None
+            if cached is None or not seqcache.same(cached, sequence):
+                threading.Thread(target=self.write_cache, daemon=True,
+                    args=(self.cache_filename, sequence, digest)).start()
+        self.sequence = sequence
+        if self.get_playing() is not None:
+            self.player.swap(sequence, self.playback_params(sequence), self.swap_at_bar)
 
     def set_offline(self):
         if self.status > 0:
@@ -968,59 +1257,71 @@ class Transport:
             self.make_spectroscope = spectroscope.prepare(self.server)
         if self.status > 1:
             self.set_fabric()
-            self.fabric.close()
+            self.player.post(self.fabric.close)
+            self.player.close()
+            self.player = None
             self.fabric = None
             self.clavier = None
         self.status = 1
 
+    # The fabric and the clavier belong to the player thread,
+    # everything below only posts commands to it.
     def set_fabric(self):
         if self.status < 2:
             self.set_online()
             self.fabric = Fabric(self.server, self.current_synths, self.current_connections, self.definitions)
             self.clavier = {}
+            self.player = Player(self.clavier, self.fabric, telemetry=self.telemetry)
         if self.status > 2:
-            self.player.close()
-            self.player = None
+            self.player.stop(release=False)
+            self.sequencer = None
         self.status = 2
 
     def set_fabric_and_stop(self):
         if self.status > 2:
-            self.set_fabric()
-            for synth in self.clavier.values():
-                synth.set(gate=0)
-            self.clavier.clear()
+            self.player.stop(release=True)
+            self.sequencer = None
+            self.status = 2
         else:
             self.set_fabric()
 
     def set_playing(self, sequencer):
-        if self.status < 3:
+        if self.status < 2:
             self.set_fabric()
-        if self.player is not None:
-            self.player.close()
-        self.player = Player(self.clavier, self.fabric, sequencer)
+        self.player.play(sequencer)
+        self.sequencer = sequencer
         self.status = 3
 
     def get_playing(self):
         if self.status == 3:
-            return self.player.sequencer.status
+            return self.sequencer.status
+
+    def seek(self, bar):
+        if self.get_playing() is not None:
+            self.player.seek(self.sequence.t(bar))
+
+    def update_range(self):
+        if self.get_playing() is not None:
+            self.player.set_range(self.playback_params(self.sequence))
+
+    def control(self, tag, **args):
+        if self.status >= 2:
+            self.player.control(tag, **args)
+
+    def set_telemetry(self, enabled):
+        self.telemetry = telemetry.Telemetry() if enabled else None
+        if self.player is not None:
+            self.player.instrument(self.telemetry)
 
     def restart_fabric(self):
-        if self.status == 3:
-            sequencer = self.player.sequencer
-        else:
-            sequencer = None
         if self.status >= 2:
-            self.set_online()
-            self.set_fabric()
-        if sequencer:
-            self.set_playing(sequencer)
+            self.player.post(self.fabric.apply_diff,
+                list(self.current_synths), set(self.current_connections))
 
     def toggle_play(self):
         if self.status < 2:
             self.set_fabric()
         elif self.get_playing() is None:
-            if self.status == 3:
-                self.set_fabric()
             sequence = self.sequence
             self.set_playing(Sequencer(sequence, point=sequence.t(min(self.cursor_head, self.cursor_tail)), **self.playback_params(sequence)))
         else:
@@ -1045,7 +1346,8 @@ class Transport:
             loop_start = -1
             loop_point = -1
             end_point = sequence.end
-        return {'loop_start': loop_start, 'loop_point': loop_point, 'end_point': end_point}
+        return {'loop_start': loop_start, 'loop_point': loop_point, 'end_point': end_point,
+                'lookahead': self.lookahead}
 
 class Spectroscope:
     def __init__(self, transport):
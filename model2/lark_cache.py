@@ -0,0 +1,18 @@
+import os
+
+# Lark pickles its parse tables, and unpickling a file someone else could
+# write runs their code. The tables are cached next to the modules, where
+# only the owner of the checkout can write, rather than in the shared
+# temporary directory. Lark keeps a hash of the grammar in the file and
+# rebuilds the tables when it does not match.
+directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+def cache_path(name):
+    # Returns False, which turns the cache off, if there's nowhere to write.
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return False
+    if not os.access(directory, os.W_OK):
+        return False
+    return os.path.join(directory, name + ".lark")
@@ -1,8 +1,13 @@
 from lark import Lark, Transformer, v_args
 from .schema import *
+from .lark_cache import cache_path
 from dataclasses import dataclass
 from typing import List, Tuple, Dict, Optional, Any
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
 import music
+import os
 import re
 
 from .sequences import *
@@ -329,18 +334,131 @@ class ModelTransformer(Transformer):
     def as_none(self, *_):
         return None
 
-file_parser = Lark(grammar, parser="lalr", start="file", transformer=ModelTransformer())
-command_parser = Lark(grammar, parser="lalr", start="bigcmd", transformer=ModelTransformer())
+# Every start symbol shares one set of LALR tables. Lark caches them under
+# a hash of the grammar, so only the first run after a grammar change pays
+# for the analysis.
+parser = Lark(grammar, parser="lalr",
+    start=["file", "bigcmd", "declaration", "synths", "connections"],
+    cache=cache_path("model"), transformer=ModelTransformer())
  
 def from_string(source):
-    return file_parser.parse(source)
+    return parser.parse(source, start="file")
 
 def from_file(pathname):
     with open(pathname, "r", encoding="utf-8") as fd:
         return from_string(fd.read())
  
 def command_from_string(source):
-    return command_parser.parse(source)
+    return parser.parse(source, start="bigcmd")
+
+# Documents can also be read one top level chunk at a time: each
+# declaration, the @synths block and the @connections block. Nothing in
+# the grammar quotes braces, so chunks are found by counting them.
+
+_HEADER = re.compile(r"\s*oscillseq\s+aqua\b")
+_SPACE = re.compile(r"\s*")
+_NAME = re.compile(r"[A-Za-z_]\w*\s*\{")
+_MARKS = re.compile(r"[{}@]")
+_ORDER = {"declaration": 0, "synths": 1, "connections": 2}
+
+def chunks(source):
+    # (kind, text) for each top level chunk, or None if the source does
+    # not look like a document.
+    if not (m := _HEADER.match(source)):
+        return None
+    out = []
+    pos = m.end()
+    while (pos := _SPACE.match(source, pos).end()) < len(source):
+        if source.startswith("@synths", pos):
+            kind = "synths"
+        elif source.startswith("@connections", pos):
+            kind = "connections"
+        elif _NAME.match(source, pos):
+            kind = "declaration"
+        else:
+            return None
+        if out and (_ORDER[kind] < _ORDER[out[-1][0]] or kind != "declaration" and kind == out[-1][0]):
+            return None
+        end = len(source)
+        depth = 0
+        for m in _MARKS.finditer(source, pos + 1):
+            if m.group() == "{":
+                depth += 1
+            elif m.group() == "}":
+                depth -= 1
+                if depth == 0 and kind == "declaration":
+                    end = m.end()
+                    break
+            elif depth == 0 and kind != "declaration":
+                end = m.start()
+                break
+        out.append((kind, source[pos:end]))
+        pos = end
+    return out
+
+def parse_chunk(kind, text):
+    return parser.parse(text, start=kind)
+
+class DocumentReader:
+    """Reads documents chunk by chunk, reusing the chunks of the last read.
+
+    A declaration whose text did not change comes back as the same object
+    as before, so an external edit to one clip only parses that clip, and
+    the rest of the document keeps its identity for the caches built on
+    it. When many chunks are new, they are parsed across processes. The
+    workers are spawned, as the editor has threads running, and are kept
+    until close so that the next large read doesn't start them again."""
+    def __init__(self, processes=None, parallel=256):
+        self.processes = processes or os.cpu_count() or 1
+        self.parallel = parallel
+        self.executor = None
+        self.chunks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, source):
+        pieces = chunks(source)
+        if pieces is None:
+            return from_string(source)
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() for _, text in pieces]
+        missing = {key: piece for key, piece in zip(keys, pieces) if key not in self.chunks}
+        try:
+            if self.processes > 1 and len(missing) >= self.parallel:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(self.processes,
+                        mp_context=multiprocessing.get_context("spawn"))
+                kinds, texts = zip(*missing.values())
+                parsed = self.executor.map(parse_chunk, kinds, texts,
+                    chunksize=max(1, len(missing) // (4 * self.processes)))
+                parsed = dict(zip(missing, parsed))
+            else:
+                parsed = {key: parse_chunk(kind, text) for key, (kind, text) in missing.items()}
+        except Exception:
+            # Report errors against the whole document.
+            return from_string(source)
+        self.hits += len(pieces) - len(missing)
+        self.misses += len(missing)
+        self.chunks = {key: self.chunks[key] if key in self.chunks else parsed[key] for key in keys}
+        declarations, synths, connections = [], [], []
+        for (kind, _), key in zip(pieces, keys):
+            match kind:
+                case "declaration":
+                    declarations.append(self.chunks[key])
+                case "synths":
+                    # The synth editor changes these in place.
+                    synths = [synth.reset(params=dict(synth.params)) for synth in self.chunks[key]]
+                case "connections":
+                    connections = self.chunks[key]
+        return Document(declarations, synths, set(connections))
+
+    def read_file(self, pathname):
+        with open(pathname, "r", encoding="utf-8") as fd:
+            return self.read(fd.read())
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
 
 stuff = """
 oscillseq aqua
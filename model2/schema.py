@@ -1,5 +1,5 @@
 from .wadler_lindig import pformat_doc, text, sp, nl, pretty
-from .sequences import empty, SequenceNode
+from .sequences import empty, SequenceNode, SequenceView, ChainView, RepeatView, RotateView, from_list, from_sequences, splice
 from fractions import Fraction
 from dataclasses import dataclass
 from typing import Set, List, Tuple, Dict, Optional, Any
@@ -94,11 +94,12 @@ def formatted_range(header, seq, inside, start, stop):
     return text(", ").join(item.formatted(header, inside) for item in seq.sequence(start, stop))
 
 def evaluate_all(config, exprs):
-    out = empty
-    for expr in exprs:
-        expr = expr.evaluate(config)
-        out = out.insert(out.length, expr)
-    return out
+    parts = [expr.evaluate(config) for expr in exprs]
+    if not any(isinstance(part, SequenceView) for part in parts):
+        return from_sequences(parts)
+    if len(parts) == 1:
+        return parts[0]
+    return ChainView(parts)
 
 def combine_headers(a, b):
     a = list(a)
@@ -149,66 +150,28 @@ class Fx(SequenceNode):
         if self.args[0].name == "euclidean" and len(self.args) == 3:
             pulses = self.args[1]
             steps = self.args[2]
-            out = empty
+            out = []
             for x in bjorklund(pulses, steps):
                 if x > 0:
-                    note = Note.mk(Duration(1,0), None, {})
+                    out.append(Note.mk(Duration(1,0), None, {}))
                 else:
-                    note = Note.mk(Duration(1,0), None, {"":[]})
-                out = out.insert(out.length, note)
-            return out
+                    out.append(Note.mk(Duration(1,0), None, {"":[]}))
+            return from_list(out)
         if self.args[0].name == "repeat" and len(self.args) == 2:
-            count = self.args[1]
-            out = empty
-            for i in range(count):
-                for x in lhs:
-                    out = out.insert(out.length, x.retain(empty, empty))
-            return out
+            return RepeatView(lhs, self.args[1])
         if self.args[0].name == "rotate" and len(self.args) == 2:
-            amount = self.args[1]
-            out = empty
-            for x in rotate(list(lhs), amount):
-                out = out.insert(out.length, x.retain(empty, empty))
-            return out
+            return RotateView(lhs, self.args[1])
         if self.args[0].name == "retrograde" and len(self.args) == 2:
-            amount = self.args[1]
-            def reverse_all(xs):
-                out = empty
-                for x in reversed(list(lhs)):
-                    if isinstance(x, Tuplet):
-                        x = Tuplet.mk(x.duration, reverse_all(x.mhs))
-                    out = out.insert(out.length, x.retain(empty, empty))
-                return out
-            return reverse_all(lhs)
+            return RetrogradeView(lhs)
         if self.args[0].name == "ostinato":
-            ostinato = list(rhs)
-            k = 0
-            def apply_ostinato(xs):
-                nonlocal k
-                out = empty
-                for x in list(xs):
-                    if isinstance(x, Note) and not is_rest(x.group):
-                        o = ostinato[k % len(ostinato)]
-                        k += 1
-                        gg = x.group.copy()
-                        for name, values in o.group.items():
-                            gg[name] = gg.get(name,[]) + values
-                        x = Note.mk(o.duration or x.duration,
-                            x.style or o.style,
-                            gg)
-                    if isinstance(x, Tuplet):
-                        x = Tuplet.mk(x.duration, apply_ostinato(x.mhs))
-                    out = out.insert(out.length, x.retain(empty, empty))
-                return out
-            return apply_ostinato(lhs)
-        out = empty
+            return OstinatoView(lhs, list(rhs))
+        out = []
         for x in self.args[0].name:
             if x == "T":
-                note = Note.mk(Duration(1,0), None, {})
+                out.append(Note.mk(Duration(1,0), None, {}))
             else:
-                note = Note.mk(Duration(1,0), None, {"":[]})
-            out = out.insert(out.length, note)
-        return out
+                out.append(Note.mk(Duration(1,0), None, {"":[]}))
+        return from_list(out)
 
 @dataclass(eq=False, repr=False)
 class Note(SequenceNode):
@@ -262,6 +225,76 @@ class Tuplet(SequenceNode):
         mhs = evaluate_all(config, self.mhs)
         return Tuplet.mk(self.duration, mhs)
 
+class RetrogradeView(SequenceView):
+    def __init__(self, source):
+        self.source = source
+        self.length = source.length
+
+    def reverse(self, x):
+        if isinstance(x, Tuplet):
+            return Tuplet.mk(x.duration, RetrogradeView(x.mhs))
+        return x
+
+    def pick(self, pos):
+        if not 0 <= pos < self.length:
+            raise IndexError
+        return self.reverse(self.source.pick(self.length - 1 - pos))
+
+    def __iter__(self):
+        for x in reversed(self.source):
+            yield self.reverse(x)
+
+    def __reversed__(self):
+        for x in self.source:
+            yield self.reverse(x)
+
+def count_notes(xs):
+    count = 0
+    for x in xs:
+        if isinstance(x, Note) and not is_rest(x.group):
+            count += 1
+        if isinstance(x, Tuplet):
+            count += count_notes(x.mhs)
+    return count
+
+class OstinatoView(SequenceView):
+    # Notes take their turn of the ostinato from start onwards, in order,
+    # counting the notes inside tuplets.
+    def __init__(self, source, ostinato, start=0):
+        self.source = source
+        self.ostinato = ostinato
+        self.start = start
+        self.length = source.length
+
+    def apply(self, x, k):
+        if isinstance(x, Note) and not is_rest(x.group):
+            o = self.ostinato[k % len(self.ostinato)]
+            gg = x.group.copy()
+            for name, values in o.group.items():
+                gg[name] = gg.get(name,[]) + values
+            return Note.mk(o.duration or x.duration,
+                x.style or o.style,
+                gg), 1
+        if isinstance(x, Tuplet):
+            return Tuplet.mk(x.duration, OstinatoView(x.mhs, self.ostinato, k)), count_notes(x.mhs)
+        return x, 0
+
+    def __iter__(self):
+        k = self.start
+        for x in self.source:
+            x, n = self.apply(x, k)
+            k += n
+            yield x
+
+    def __reversed__(self):
+        k = self.start + count_notes(self.source)
+        for x in reversed(self.source):
+            if isinstance(x, Tuplet):
+                k -= count_notes(x.mhs)
+            elif isinstance(x, Note) and not is_rest(x.group):
+                k -= 1
+            yield self.apply(x, k)[0]
+
 ## FABRIC
 Connection = Tuple[Tuple[str, str], Tuple[str, str]]
 
@@ -299,7 +332,18 @@ class Synth(Object):
         body = text("{") + (nl + params).nest(2).group() + nl + text("}")
         return header.nest(2).group() + sp + body
 
+    def snapshot(self):
+        # The synth editor changes synths in place.
+        return self.pos, self.name, self.synth, self.multi, self.type_param, list(self.params.items())
+
 ## DOCUMENT MODEL
+def laid_out(obj, doc, key=None):
+    # pformat_doc(doc(), 80), remembered on obj until key changes.
+    entry = obj.__dict__.get("_layout")
+    if entry is None or entry[0] != key:
+        entry = obj._layout = key, pformat_doc(doc(), 80)
+    return entry[1]
+
 @dataclass(eq=False, repr=False)
 class Document(Object):
     declarations : List[Declaration]
@@ -324,13 +368,41 @@ class Document(Object):
             for synth in self.synths:
                 out += (nl + pretty(synth)).nest(2).group()
         if self.connections:
-            out += nl + nl + text("@connections")
-            xs = []
-            for (sname, sport), (dname, dport) in self.connections:
-                xs.append(f"{sname}:{sport} {dname}:{dport}")
-            out += (nl + (text(",") + nl).join(xs)).nest(2)
+            out += nl + nl + self.format_connections()
         return out
 
+    def format_connections(self):
+        xs = []
+        for (sname, sport), (dname, dport) in self.connections:
+            xs.append(f"{sname}:{sport} {dname}:{dport}")
+        return text("@connections") + (nl + (text(",") + nl).join(xs)).nest(2)
+
+    # The same text as laying out __pretty__ in one go. Declarations and
+    # synths are laid out on their own and remembered, so only the ones
+    # that changed cost anything. Synths and connections are changed in
+    # place by the editor, so they are formatted separately, on the thread
+    # that owns them.
+
+    def __str__(self):
+        return self.format_text(self.format_fabric())
+
+    def format_fabric(self):
+        out = []
+        if self.synths:
+            out.append("\n\n@synths")
+            for synth in self.synths:
+                out.append(laid_out(synth, lambda: (nl + pretty(synth)).nest(2).group(), synth.snapshot()))
+        if self.connections:
+            out.append("\n\n" + pformat_doc(self.format_connections(), 80))
+        return "".join(out)
+
+    def format_text(self, fabric):
+        out = ["oscillseq aqua"]
+        for decl in self.declarations:
+            out.append("\n\n" + laid_out(decl, lambda: pretty(decl)))
+        out.append(fabric)
+        return "".join(out)
+
 ## DECLARATIONS
 @dataclass(eq=False, repr=False)
 class ClipDef(Declaration):
@@ -748,7 +820,7 @@ class SequenceFinger(DeepFinger):
         return self.parent.store_expr(self.expr, self.flavor)
 
     def store_range(self, start, stop, expr):
-        new_expr = self.expr.erase(start, stop).insert(start, expr)
+        new_expr = splice(self.expr, start, stop, expr)
         return SequenceFinger(self.parent, self.flavor, new_expr)
 
     def index_of(self, index):
@@ -777,7 +849,7 @@ class SequenceFinger(DeepFinger):
         return SequenceFinger(self.parent, self.flavor, expr)
 
     def write_sequence_range(self, start, stop, expr):
-        new_expr = self.expr.erase(start, stop).insert(start, expr)
+        new_expr = splice(self.expr, start, stop, expr)
         return SequenceFinger(self.parent, self.flavor, new_expr)
 
     def get_header(self):
@@ -891,10 +963,7 @@ class RangeFinger(DeepFinger):
 
     def get_selection(self):
         start, stop = self.to_range()
-        selection = empty
-        for n in self.parent.expr.sequence(start, stop):
-            selection = selection.insert(selection.length, n.retain(empty, empty))
-        return selection
+        return from_list(self.parent.expr.sequence(start, stop))
 
     def get_track_selection(self):
         root, path = self.parent.get_track_selection()
@@ -1641,10 +1710,8 @@ def read_soup(header, soup, fxs, selection=None):
             else:
                 assert False, "TODO: a parse error?" + str((i, x))
         return out
-    out = empty
-    def add(item):
-        nonlocal out
-        out = out.insert(out.length, item)
+    items = []
+    add = items.append
     for expr in soup:
         if isinstance(expr, NoteProto):
             gs = process(expr.group)
@@ -1657,6 +1724,7 @@ def read_soup(header, soup, fxs, selection=None):
             add(selection)
         else:
             assert False, expr
+    out = from_sequences(items)
     for fx in fxs:
         rhs = read_soup(header if fx.header is None else fx.header, fx.soup, [], selection)
         out = Fx.mk(out, fx.args, fx.header, rhs)
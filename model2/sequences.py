@@ -1,5 +1,7 @@
 from balanced import BalancedTree, rebalance, pluck
 from dataclasses import dataclass, field
+from itertools import islice
+import bisect
 
 @dataclass(eq=False)
 class Sequence(BalancedTree):
@@ -9,6 +11,9 @@ class Sequence(BalancedTree):
     def __iter__(self):
         return iter(())
 
+    def __reversed__(self):
+        return iter(())
+
     def pick(self, pos):
         return IndexError
 
@@ -33,6 +38,12 @@ class Sequence(BalancedTree):
             raise IndexError
         return self
 
+    def concat(self, other):
+        return concat(self, other)
+
+    def split(self, pos):
+        return split(self, pos)
+
 @dataclass(eq=False)
 class SequenceNode(Sequence):
     is_empty = False
@@ -42,6 +53,9 @@ class SequenceNode(Sequence):
     def __iter__(self):
         yield from self.sequence(0, self.length)
 
+    def __reversed__(self):
+        yield from reversed(self.sequence(0, self.length))
+
     def pick(self, pos):
         if pos < self.left.length:
             return self.left.pick(pos)
@@ -98,3 +112,165 @@ class SequenceNode(Sequence):
         return rebalance(node)
 
 empty = Sequence()
+
+# Bulk operations. Nodes are persistent, so subtrees may be shared
+# between the sequences they build.
+
+def from_list(nodes):
+    # A balanced tree holding the given nodes in order, built in O(n).
+    def build(lo, hi):
+        if lo == hi:
+            return empty
+        mid = (lo + hi) // 2
+        return nodes[mid].retain(build(lo, mid), build(mid + 1, hi))
+    return build(0, len(nodes))
+
+def from_sequences(sequences):
+    return from_list([node for sequence in sequences for node in sequence])
+
+def join(left, node, right):
+    # left, node, right in order, in O(|left.height - right.height|).
+    if left.height > right.height + 1:
+        return rebalance(left.retain(left.left, join(left.right, node, right)))
+    if right.height > left.height + 1:
+        return rebalance(right.retain(join(left, node, right.left), right.right))
+    return node.retain(left, right)
+
+def split(tree, pos):
+    # The first pos nodes and the rest, in O(log n).
+    if tree.length == 0:
+        if pos != 0:
+            raise IndexError
+        return tree, tree
+    ledge = tree.left.length
+    if pos <= ledge:
+        left, right = split(tree.left, pos)
+        return left, join(right, tree, tree.right)
+    left, right = split(tree.right, pos - ledge - 1)
+    return join(tree.left, tree, left), right
+
+def concat(left, right):
+    if left.length == 0:
+        return right
+    if right.length == 0:
+        return left
+    left, last = split(left, left.length - 1)
+    return join(left, last, right)
+
+def splice(tree, start, stop, insertion):
+    # tree with nodes start:stop replaced by insertion.
+    left, rest = split(tree, start)
+    _, right = split(rest, stop - start)
+    return concat(concat(left, insertion), right)
+
+# Views are read only sequences computed from their source when asked.
+# They answer length, pick, sequence and iteration like the trees above,
+# but do not build nodes for the whole result, so a large repeat costs
+# nothing until something walks it.
+
+class SequenceView:
+    def pick(self, pos):
+        if not 0 <= pos < self.length:
+            raise IndexError
+        return next(islice(iter(self), pos, None))
+
+    def sequence(self, start, stop, sequence=None):
+        sequence = [] if sequence is None else sequence
+        sequence.extend(islice(iter(self), start, stop))
+        return sequence
+
+    def __reversed__(self):
+        for pos in reversed(range(self.length)):
+            yield self.pick(pos)
+
+class ChainView(SequenceView):
+    def __init__(self, parts):
+        self.parts = parts
+        self.offsets = [0]
+        for part in parts:
+            self.offsets.append(self.offsets[-1] + part.length)
+        self.length = self.offsets[-1]
+
+    def pick(self, pos):
+        if not 0 <= pos < self.length:
+            raise IndexError
+        i = bisect.bisect_right(self.offsets, pos) - 1
+        return self.parts[i].pick(pos - self.offsets[i])
+
+    def sequence(self, start, stop, sequence=None):
+        sequence = [] if sequence is None else sequence
+        for part, offset in zip(self.parts, self.offsets):
+            if start < offset + part.length and offset < stop:
+                sequence = part.sequence(max(start - offset, 0), min(stop - offset, part.length), sequence)
+        return sequence
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def __reversed__(self):
+        for part in reversed(self.parts):
+            yield from reversed(part)
+
+class RepeatView(SequenceView):
+    def __init__(self, source, count):
+        self.source = source
+        self.count = max(count, 0)
+        self.length = source.length * self.count
+
+    def pick(self, pos):
+        if not 0 <= pos < self.length:
+            raise IndexError
+        return self.source.pick(pos % self.source.length)
+
+    def sequence(self, start, stop, sequence=None):
+        sequence = [] if sequence is None else sequence
+        n = self.source.length
+        while start < stop:
+            i = start % n
+            j = min(n, i + stop - start)
+            sequence = self.source.sequence(i, j, sequence)
+            start += j - i
+        return sequence
+
+    def __iter__(self):
+        for _ in range(self.count):
+            yield from self.source
+
+    def __reversed__(self):
+        for _ in range(self.count):
+            yield from reversed(self.source)
+
+class RotateView(SequenceView):
+    # Same result as l[amount:] + l[:amount] on a list.
+    def __init__(self, source, amount):
+        n = source.length
+        if -n <= amount < 0:
+            amount += n
+        elif not 0 <= amount <= n:
+            amount = 0
+        self.source = source
+        self.amount = amount % n if n else 0
+        self.length = n
+
+    def pick(self, pos):
+        if not 0 <= pos < self.length:
+            raise IndexError
+        return self.source.pick((pos + self.amount) % self.length)
+
+    def sequence(self, start, stop, sequence=None):
+        sequence = [] if sequence is None else sequence
+        head = self.length - self.amount
+        if start < head:
+            sequence = self.source.sequence(start + self.amount, min(stop, head) + self.amount, sequence)
+        if head < stop:
+            sequence = self.source.sequence(max(start - head, 0), stop - head, sequence)
+        return sequence
+
+    def __iter__(self):
+        yield from islice(self.source, self.amount, None)
+        yield from islice(self.source, self.amount)
+
+    def __reversed__(self):
+        yield from islice(reversed(self.source), self.length - self.amount, None)
+        yield from islice(reversed(self.source), self.length - self.amount)
@@ -4,6 +4,7 @@ from typing import Set, List, Tuple, Dict, Optional, Any
 from supriya import ugens, CalculationRate
 from supriya.ugens import UGen, PseudoUGen, UGenOperable, SynthDefBuilder
 from supriya.enums import BinaryOperator, UnaryOperator
+from model2.lark_cache import cache_path
 import descriptors
 
 synth_grammar = """
@@ -545,7 +546,7 @@ class SynthLangTransformer(Transformer):
     def list(self, exprs):
         return List(exprs)
 
-parser = Lark(synth_grammar, parser="lalr", transformer=SynthLangTransformer())
+parser = Lark(synth_grammar, parser="lalr", cache=cache_path("synthlang"), transformer=SynthLangTransformer())
 
 def from_string(source, name):
     with SynthDefBuilder() as builder:
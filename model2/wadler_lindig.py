@@ -24,13 +24,12 @@ class AbstractDoc:
         return GroupDoc(self)
 
     def join(self, seq):
-        group = ()
+        group = []
         for s in seq:
-            if len(group) > 0:
-                group += (self,pretty(s).group())
-            else:
-                group += (pretty(s).group(),)
-        return ConcatDoc(group)
+            if group:
+                group.append(self)
+            group.append(pretty(s).group())
+        return ConcatDoc(tuple(group))
 
     def __pretty__(self):
         return self
@@ -59,13 +58,12 @@ class BreakDoc(AbstractDoc):
 sp = BreakDoc(" ")
 nl = LineDoc()
 
+# Concatenation is not flattened, so building a document with += stays
+# linear. The layout below walks nested concatenations with its own stack.
 @dataclass(frozen=True)
 class ConcatDoc(AbstractDoc):
     children: tuple[AbstractDoc, ...]
 
-    def __add__(self, other: AbstractDoc):
-        return ConcatDoc(self.children + (other,))
-
 @dataclass(frozen=True)
 class NestDoc(AbstractDoc):
     child: AbstractDoc
@@ -75,64 +73,63 @@ class NestDoc(AbstractDoc):
 class GroupDoc(AbstractDoc):
     child: AbstractDoc
 
-def fits(doc, width, indent):
+def fits(doc, width):
+    # Whether doc fits in width when laid out flat. Looks no further than
+    # width characters or the first forced line break.
     todo = [doc]
-    while len(todo) > 0 and width >= 0:
-        match todo.pop():
-            case int(indent_past):
-                indent = indent_past
-            case TextDoc(text):
-                width -= len(text)
-            case BreakDoc(text):
-                width -= len(text)
-            case LineDoc():
-                width = indent
-            case ConcatDoc(children):
-                todo.extend(reversed(children))
-            case NestDoc(child, extra_indent):
-                todo.append(indent)
-                todo.append(child)
-                indent += extra_indent
-            case GroupDoc(child):
-                todo.append(child)
+    while todo and width >= 0:
+        doc = todo.pop()
+        kind = type(doc)
+        if kind is TextDoc or kind is BreakDoc:
+            width -= len(doc.text)
+        elif kind is ConcatDoc:
+            todo.extend(reversed(doc.children))
+        elif kind is LineDoc:
+            return True
+        else:
+            todo.append(doc.child)
     return width >= 0
 
 def pformat_doc(doc, width) -> str:
+    # Strictly pretty, with an explicit stack. Groups are laid out flat
+    # unless the group around them was broken; the outermost level is
+    # flat, so only forced line breaks start new lines. Entries on the
+    # stack are documents, or the indent or mode to go back to once the
+    # documents above them are done.
     outs = []
-    width_so_far = 0
-    vertical = False # TODO: This didn't work out so well.. we need a better layouter.
+    column = 0
+    vertical = False
     indent = 0
-    todo = [GroupDoc(doc)]
-    while len(todo) > 0:
-        match todo.pop():
-            case bool(vertical2):
-                vertical = vertical2
-            case int(indent2):
-                indent = indent2
-            case TextDoc(text):
-                outs.append(text)
-                width_so_far += len(text)
-            case BreakDoc(text):
-                if vertical:
-                    outs.append("\n" + " " * indent)
-                    width_so_far = indent
-                else:
-                    outs.append(text)
-                    width_so_far += len(text)
-            case LineDoc():
-                 outs.append("\n" + " " * indent)
-                 width_so_far = indent
-            case ConcatDoc(children):
-                todo.extend(reversed(children))
-            case NestDoc(child, extra_indent):
-                todo.append(indent)
-                todo.append(child)
-                indent += extra_indent
-            case GroupDoc(child):
-                if vertical and fits(child, width - width_so_far, indent):
-                    todo.append(True)
-                    todo.append(child)
-                    vertical = False
-                else:
-                    todo.append(child)
+    todo = [doc]
+    while todo:
+        doc = todo.pop()
+        kind = type(doc)
+        if kind is TextDoc:
+            outs.append(doc.text)
+            column += len(doc.text)
+        elif kind is ConcatDoc:
+            todo.extend(reversed(doc.children))
+        elif kind is GroupDoc:
+            if vertical and fits(doc.child, width - column):
+                todo.append(True)
+                vertical = False
+            todo.append(doc.child)
+        elif kind is BreakDoc:
+            if vertical:
+                outs.append("\n" + " " * indent)
+                column = indent
+            else:
+                outs.append(doc.text)
+                column += len(doc.text)
+        elif kind is LineDoc:
+            outs.append("\n" + " " * indent)
+            column = indent
+        elif kind is NestDoc:
+            todo.append(indent)
+            todo.append(doc.child)
+            indent += doc.indent
+        elif kind is bool:
+            vertical = doc
+        else:
+            indent = doc
     return "".join(outs)
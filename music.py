@@ -1,5 +1,6 @@
 import bisect
 import math
+import numpy as np
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Callable, Tuple, Any
 from model2.wadler_lindig import pformat_doc, text, sp, nl, pretty
@@ -138,6 +139,11 @@ class Envelope:
         k_i = self.ks[i]
         return (p - x_i) * k_i + y_i
 
+    def evaluate_many(self, ps):
+        ps = np.asarray(ps, dtype=np.float64)
+        i = np.maximum(np.searchsorted(self.xs, ps, side="right") - 1, 0)
+        return (ps - np.asarray(self.xs)[i]) * np.asarray(self.ks)[i] + np.asarray(self.ys)[i]
+
     def equation(self, p):
         i = bisect.bisect_right(self.xs, p) - 1
         x_i = self.xs[i]
@@ -190,6 +196,30 @@ class TempoEnvelope(Envelope):
         else:
             return x_i + (-s + math.sqrt(s*s + 4*d*db)) / (2*d)
 
+    def times_to_bars(self, ts):
+        ts = np.asarray(ts, dtype=np.float64)
+        i = np.searchsorted(self.xs, ts, side="right") - 1
+        x_i = np.asarray(self.xs)[i]
+        y_i = np.asarray(self.ys)[i]
+        k_i = np.asarray(self.ks)[i]
+        b_i = np.asarray(self.bs)[i]
+        dt = ts - x_i
+        return b_i + y_i/60*dt + k_i/120*dt*dt
+
+    def bars_to_times(self, bs):
+        bs = np.asarray(bs, dtype=np.float64)
+        i = np.searchsorted(self.bs, bs, side="right") - 1
+        x_i = np.asarray(self.xs)[i]
+        y_i = np.asarray(self.ys)[i]
+        k_i = np.asarray(self.ks)[i]
+        b_i = np.asarray(self.bs)[i]
+        s = (y_i / 60)
+        d = (k_i / 120)
+        db = bs - b_i
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ramp = x_i + (-s + np.sqrt(s*s + 4*d*db)) / (2*d)
+        return np.where(k_i == 0, x_i + db / s, ramp)
+
 # These were in use when tempo was still counted as linear function of beat instead of time.
 def tempo_segments(env):
     time = env.xs[0] * 60 / env.ys[0]
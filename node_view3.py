@@ -690,8 +690,7 @@ class MXParamWidget:
             y = min(1, max(0, y))
             val = slider_to_any(1 - y, mx.desc.field_type(mx.param))
             mx.cell.params[mx.param] = val
-            if self.editor.transport.fabric:
-                self.editor.transport.fabric.control(mx.cell.name, **{mx.param: val})
+            self.editor.transport.control(mx.cell.name, **{mx.param: val})
             changed = True
         return changed
         
@@ -0,0 +1,192 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace, astuple
+from typing import List, Dict, Set, Optional, Tuple, Any
+from fabric2 import Definitions, Fabric
+import hashlib
+import multiprocessing
+import os
+import supriya
+
+# Offline rendering runs in worker processes, so live playback is not
+# interrupted. A job carries everything needed to rebuild a Fabric inside
+# a supriya.Score: the cells, their connections and the events to send.
+
+@dataclass
+class RenderJob:
+    name : str
+    output_file_path : str
+    synthdef_directory : str
+    synths : List[Any]
+    connections : Set[Any]
+    events : List[Any]
+    duration : float
+    digest : str
+    automation : Dict[str, Any] = field(default_factory=dict)
+    automation_rate : float = 0.0
+
+def run_job(job):
+    score = supriya.Score(output_bus_channel_count=2)
+    clavier = {}
+    with score.at(0):
+        fabric = Fabric(score, job.synths, job.connections, Definitions(job.synthdef_directory))
+        for tag, curve in job.automation.items():
+            fabric.automate(tag, curve, job.automation_rate, 0.0)
+    for command in job.events:
+        with score.at(command.time):
+            command.send(clavier, fabric)
+    with score.at(job.duration):
+        score.do_nothing()
+    partial = job.output_file_path + ".partial.wav"
+    _, exit_code = supriya.render(score, output_file_path=partial)
+    if exit_code != 0:
+        raise Exception(f"render of {job.name!r} failed with exit code {exit_code}")
+    os.replace(partial, job.output_file_path)
+    with open(job.output_file_path + ".sha1", "w") as fd:
+        fd.write(job.digest)
+    return job.name
+
+def downstream(name, connections):
+    chain = {name}
+    todo = [name]
+    while todo:
+        this = todo.pop()
+        for (src, _), (dst, _) in connections:
+            if src == this and dst != "system" and dst not in chain:
+                chain.add(dst)
+                todo.append(dst)
+    return chain
+
+def sources(synths, connections):
+    fed = {dst for (src, _), (dst, _) in connections if src != "system"}
+    return [synth.name for synth in synths if synth.name not in fed]
+
+def content_hash(synthdef_directory, synths, connections, events, duration, automation={}):
+    h = hashlib.sha1()
+    for synth in sorted(synths, key=lambda s: s.name):
+        h.update(repr((synth.name, synth.synth, synth.multi, synth.type_param,
+                       sorted(synth.params.items()))).encode("utf-8"))
+        for ext in (".synth", ".scsynthdef", ".desc"):
+            filename = os.path.join(synthdef_directory, synth.synth + ext)
+            if os.path.exists(filename):
+                st = os.stat(filename)
+                h.update(repr((ext, st.st_mtime_ns, st.st_size)).encode("utf-8"))
+    h.update(repr(sorted(connections)).encode("utf-8"))
+    h.update(repr(duration).encode("utf-8"))
+    for event in events:
+        h.update(repr(astuple(replace(event, origin=None))).encode("utf-8"))
+    for tag in sorted(automation):
+        h.update(tag.encode("utf-8"))
+        h.update(automation[tag].tobytes())
+    return h.hexdigest()
+
+def plan_jobs(synthdef_directory, doc, sequence, wav_filename, stems=True):
+    events = list(sequence.com)
+    outputs = [("mix", wav_filename, doc.synths, doc.connections, events)]
+    if stems:
+        directory = os.path.splitext(wav_filename)[0] + ".stems"
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        for name in sources(doc.synths, doc.connections):
+            chain = downstream(name, doc.connections)
+            synths = [synth for synth in doc.synths if synth.name in chain]
+            connections = {c for c in doc.connections if c[0][0] in chain}
+            stem_events = [e for e in events if e.tag in chain]
+            filename = os.path.join(directory, name + ".wav")
+            outputs.append((name, filename, synths, connections, stem_events))
+    jobs = []
+    for name, filename, synths, connections, events in outputs:
+        names = {synth.name for synth in synths}
+        automation = {tag: c for tag, c in sequence.automation.items() if tag in names}
+        digest = content_hash(synthdef_directory, synths, connections, events, sequence.end, automation)
+        jobs.append(RenderJob(name, filename, synthdef_directory,
+            synths, connections, events, sequence.end, digest,
+            automation, sequence.automation_rate))
+    return jobs
+
+def is_cached(job):
+    digest_file = job.output_file_path + ".sha1"
+    if os.path.exists(job.output_file_path) and os.path.exists(digest_file):
+        with open(digest_file, "r") as fd:
+            return fd.read() == job.digest
+    return False
+
+class Renderer:
+    def __init__(self, synthdef_directory, max_workers=None):
+        self.synthdef_directory = synthdef_directory
+        self.max_workers = max_workers
+        self.executor = None
+        self.futures = {}
+        # Jobs held back until the running job writing the same
+        # file has finished, as it can't be cancelled.
+        self.waiting = {}
+        self.total = 0
+        self.done = 0
+        self.cached = 0
+        self.failed = []
+        self.reported = None
+
+    def submit(self, doc, sequence, wav_filename, stems=True):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        for job in plan_jobs(self.synthdef_directory, doc, sequence, wav_filename, stems):
+            key = job.output_file_path
+            if self.waiting.pop(key, None) is not None:
+                self.total -= 1
+            elif key in self.futures and not self.futures[key][2]:
+                name, future, _ = self.futures[key]
+                if future.cancel():
+                    del self.futures[key]
+                else:
+                    self.futures[key] = name, future, True
+                self.total -= 1
+            self.total += 1
+            if key in self.futures:
+                self.waiting[key] = job
+            else:
+                self.start(job)
+
+    def start(self, job):
+        if is_cached(job):
+            self.done += 1
+            self.cached += 1
+        else:
+            future = self.executor.submit(run_job, job)
+            self.futures[job.output_file_path] = job.name, future, False
+
+    @property
+    def busy(self):
+        return len(self.futures) > 0
+
+    def poll(self):
+        for key, (name, future, superseded) in list(self.futures.items()):
+            if future.done():
+                self.futures.pop(key)
+                if not superseded:
+                    self.done += 1
+                    if not future.cancelled() and (e := future.exception()) is not None:
+                        self.failed.append((name, e))
+                if key in self.waiting:
+                    self.start(self.waiting.pop(key))
+        status = self.status()
+        if status != self.reported:
+            self.reported = status
+            return status
+
+    def status(self):
+        if self.total == 0:
+            return None
+        status = f"rendered {self.done}/{self.total} ({self.cached} cached)"
+        if self.failed:
+            status += ", failed: " + ", ".join(name for name, _ in self.failed)
+        if not self.busy:
+            self.total = self.done = self.cached = 0
+            self.failed.clear()
+        return status
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.futures.clear()
+        self.waiting.clear()
@@ -0,0 +1,143 @@
+from sequencer import Sequence, EventTable
+import hashlib
+import json
+import music
+import numbers
+import numpy as np
+import os
+import struct
+
+# Compiled sequences cached next to the document.
+#
+# The file starts with a JSON header, followed by the event table columns,
+# the keyword values, the tempo map and the automation curves, each stored
+# as a raw array. Values are stored as float64, values left unresolved
+# (None) as NaN. The positions of None, int and bool values are listed
+# apart, with the ints again as int64, so that they come back as Python
+# ints: descriptors.to_hz reads an int as a pitch and a float as Hz.
+# Loading maps the file and views the arrays in place.
+# Brush origins and checkpoints are not stored, the compiler rebuilds the
+# sequence in the background anyway and its result replaces the cached one.
+
+MAGIC = b"OSQC"
+VERSION = 3
+ALIGN = 64
+
+def document_digest(text, sources, voices, envelope_rate):
+    # The text is the document as saved, sources maps each synth used to
+    # the digest of its definition.
+    h = hashlib.sha1()
+    h.update(repr((VERSION, voices, envelope_rate)).encode("utf-8"))
+    h.update(text.encode("utf-8"))
+    for name in sorted(sources):
+        h.update(repr((name, sources[name])).encode("utf-8"))
+    return h.hexdigest()
+
+def arrays(sequence):
+    com = sequence.com
+    out = [(name, getattr(com, name)) for name in EventTable.COLUMNS if name != "origin"]
+    values = [np.nan if v is None else v for v in com.values]
+    out.append(("values", np.asarray(values, dtype=np.float64)))
+    missing, integers, booleans = [], [], []
+    for i, v in enumerate(com.values):
+        if v is None:
+            missing.append(i)
+        elif isinstance(v, bool):
+            booleans.append(i)
+        elif isinstance(v, numbers.Integral):
+            integers.append(i)
+    out.append(("missing", np.array(missing, dtype=np.int64)))
+    out.append(("booleans", np.array(booleans, dtype=np.int64)))
+    out.append(("integers", np.array(integers, dtype=np.int64)))
+    out.append(("integer_values", np.array([com.values[i] for i in integers], dtype=np.int64)))
+    for name in ("xs", "ys", "ks", "bs"):
+        out.append(("tempo." + name, np.asarray(getattr(sequence.tempo, name), dtype=np.float64)))
+    for tag, curve in sequence.automation.items():
+        out.append(("automation." + tag, np.asarray(curve)))
+    return out
+
+def save(filename, sequence, digest):
+    # Returns None once written, or why the sequence can't be cached.
+    if not isinstance(sequence.com, EventTable):
+        return "the sequence is streamed"
+    for v in sequence.com.values:
+        if v is not None and not isinstance(v, numbers.Real):
+            return f"{v!r} can't be stored as a number"
+        if isinstance(v, numbers.Integral) and not -2**63 <= v < 2**63:
+            return f"{v!r} doesn't fit in int64"
+    header = {
+        "digest": digest,
+        "end": sequence.end,
+        "removed": sequence.removed,
+        "stolen": sequence.stolen,
+        "peak_voices": sequence.peak_voices,
+        "automation_rate": sequence.automation_rate,
+        "tags": sequence.com.tags,
+        "layouts": sequence.com.layouts,
+        "arrays": {},
+    }
+    data = arrays(sequence)
+    offset = 0
+    for name, array in data:
+        header["arrays"][name] = array.dtype.str, offset, len(array)
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    text = json.dumps(header).encode("utf-8")
+    start = -(-(12 + len(text)) // ALIGN) * ALIGN
+    partial = filename + f".{os.getpid()}.partial"
+    with open(partial, "wb") as fd:
+        fd.write(MAGIC + struct.pack("<II", VERSION, len(text)) + text)
+        for name, array in data:
+            _, position, _ = header["arrays"][name]
+            fd.seek(start + position)
+            fd.write(np.ascontiguousarray(array).tobytes())
+        fd.truncate(start + offset)
+    os.replace(partial, filename)
+
+def objects(items):
+    # Assigned through an object array, as numpy would turn ints into int64.
+    out = np.empty(len(items), dtype=object)
+    out[:] = items
+    return out
+
+def load(filename, digest):
+    try:
+        with open(filename, "rb") as fd:
+            magic, version, length = struct.unpack("<4sII", fd.read(12))
+            if magic != MAGIC or version != VERSION:
+                return None
+            header = json.loads(fd.read(length).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header["digest"] != digest:
+        return None
+    start = -(-(12 + length) // ALIGN) * ALIGN
+    buf = np.memmap(filename, dtype=np.uint8, mode="r")
+    def view(name):
+        dtype, offset, count = header["arrays"][name]
+        dtype = np.dtype(dtype)
+        return buf[start + offset:start + offset + count * dtype.itemsize].view(dtype)
+    columns = {name: view(name) for name in EventTable.COLUMNS if name != "origin"}
+    columns["origin"] = np.full(len(columns["times"]), -1, dtype=np.int32)
+    values = view("values")
+    missing, booleans, integers = view("missing"), view("booleans"), view("integers")
+    if len(missing) or len(booleans) or len(integers):
+        values = values.astype(object)
+        values[missing] = None
+        values[booleans] = objects([bool(v) for v in values[booleans]])
+        values[integers] = objects(view("integer_values").tolist())
+    com = EventTable.from_columns(columns, values, header["layouts"], header["tags"])
+    tempo = music.TempoEnvelope(*(view("tempo." + name).tolist() for name in ("xs", "ys", "ks", "bs")))
+    automation = {name[len("automation."):]: view(name)
+                  for name in header["arrays"] if name.startswith("automation.")}
+    return Sequence(tempo, com, header["end"],
+        removed=header["removed"], stolen=header["stolen"],
+        peak_voices=header["peak_voices"],
+        automation=automation, automation_rate=header["automation_rate"])
+
+def same(a, b):
+    if not isinstance(a.com, EventTable) or not isinstance(b.com, EventTable):
+        return False
+    if a.end != b.end or a.com.tags != b.com.tags or a.com.layouts != b.com.layouts:
+        return False
+    x, y = dict(arrays(a)), dict(arrays(b))
+    return x.keys() == y.keys() and all(np.array_equal(x[k], y[k], equal_nan=True) for k in x)
@@ -1,30 +1,97 @@
+import bisect
+import heapq
+import math
 import threading
 import time
 import supriya
 import os
 import music
-from collections import defaultdict
-from dataclasses import dataclass, field
+import numpy as np
+from descriptors import to_plain
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass, field, replace
 from typing import List, Dict, Optional, Callable, Tuple, Any
 
+@dataclass
+class Checkpoint:
+    index : int
+    clavier : Dict[int, Any]
+    quadratics : Dict[str, Any]
+    controls : Dict[str, Dict[str, Any]]
+
+    @classmethod
+    def snapshot(cls, index, clavier, quadratics, controls):
+        controls = {tag: args.copy() for tag, args in controls.items()}
+        return cls(index, clavier.copy(), quadratics.copy(), controls)
+
+    def restore(self):
+        controls = {tag: args.copy() for tag, args in self.controls.items()}
+        return self.clavier.copy(), self.quadratics.copy(), controls
+
 @dataclass
 class Sequence:
     tempo : music.TempoEnvelope
     com : List[Any]
     end : float
+    checkpoints : List[Checkpoint] = field(default_factory=list)
+    removed : int = 0
+    stolen : int = 0
+    peak_voices : Dict[str, int] = field(default_factory=dict)
+    # Automation sampled at automation_rate frames per second, played
+    # from server buffers instead of Quadratic messages.
+    automation : Dict[str, Any] = field(default_factory=dict)
+    automation_rate : float = 0.0
+
+    def __post_init__(self):
+        if not isinstance(self.com, (EventTable, EventStream)):
+            self.com = EventTable(self.com)
 
     def t(self, bar):
         return self.tempo.bar_to_time(bar)
 
+    def take_checkpoints(self, interval=1024, previous=(), unchanged=0):
+        # Checkpoints of a previous sequence whose first unchanged
+        # events are the same as these are kept, the rest is simulated.
+        k = bisect.bisect_right(previous, unchanged, key=lambda c: c.index)
+        self.checkpoints = list(previous[:k]) or [Checkpoint(0, {}, {}, {})]
+        start = self.checkpoints[-1].index
+        state = self.checkpoints[-1].restore()
+        for i in range(start, len(self.com)):
+            self.com[i].sim(*state)
+            if (i + 1) % interval == 0:
+                self.checkpoints.append(Checkpoint.snapshot(i + 1, *state))
+
+    def state_at(self, index):
+        # Simulated state before com[index], replayed from the nearest checkpoint.
+        if isinstance(self.com, EventStream):
+            return self.com.state_at(index)
+        k = bisect.bisect_right(self.checkpoints, index, key=lambda c: c.index) - 1
+        if k < 0:
+            checkpoint = Checkpoint(0, {}, {}, {})
+        else:
+            checkpoint = self.checkpoints[k]
+        state = checkpoint.restore()
+        for i in range(checkpoint.index, index):
+            self.com[i].sim(*state)
+        return state
+
 class Sequencer:
-    def __init__(self, sequence, point, loop_start, loop_point, end_point):
+    def __init__(self, sequence, point, loop_start, loop_point, end_point, lookahead=0.0):
         self.sequence = sequence
         self.point = point
         self.loop_start = loop_start
         self.loop_point = loop_point
         self.end_point = end_point
-        self.time = 0
+        # When lookahead > 0, events within the window are dispatched early
+        # as timestamped bundles and scsynth plays them on time.
+        self.lookahead = lookahead
+        self.horizon = 0.0
+        self.time = time.monotonic()
         self.index = 0
+        # A sequence compiled while playing waits here until the player
+        # thread takes it at the next sweep, or at the next bar.
+        self.pending = None
+        self.telemetry = None
 
     @property
     def status(self):
@@ -35,27 +102,66 @@ class Sequencer:
 
     def resume(self, clavier, fabric):
         self.time = time.monotonic()
-        goal_clavier, quadratics, controls = {}, {}, {}
-        index = 0
-        for index, event in enumerate(self.sequence.com):
-            if event.time < self.point:
-                event.sim(goal_clavier, quadratics, controls)
-            else:
-                break
-        else:
-            index += 1
+        self.sequence.com.retain(self.loop_start, self.loop_point)
+        index = self.sequence.com.search(self.point)
+        self._restore(index, clavier, fabric)
+        self.index = index
+        return self._estimate_next_event()
+
+    def _restore(self, index, clavier, fabric):
+        goal_clavier, quadratics, controls = self.sequence.state_at(index)
         for tag, args in controls.items():
             if tag in fabric.synths:
                 fabric.control(tag, **args)
         for q in quadratics.values():
             q.forward(self.point).send(clavier, fabric)
+        for tag, curve in self.sequence.automation.items():
+            fabric.automate(tag, curve, self.sequence.automation_rate, self.point)
         for group_id in list(clavier):
             if group_id not in goal_clavier:
                 clavier.pop(group_id).set(gate=0)
         for command in goal_clavier.values():
             command.send(clavier, fabric)
-        self.index = index
-        return self._estimate_next_event()
+
+    def swap(self, sequence, params, at_bar=False):
+        self.pending = [sequence, params, at_bar, None]
+
+    def _swap_due(self):
+        sequence, params, at_bar, due = self.pending
+        if not at_bar:
+            return True
+        bar = self.sequence.tempo.time_to_bar(self.point)
+        if due is None:
+            self.pending[3] = due = (math.floor(bar) + 1, bar)
+        return bar >= due[0] or bar < due[1]
+
+    def _swap(self, clavier, fabric):
+        # Notes that sound in both sequences keep their synths, since
+        # group ids are stable across builds. Events already dispatched
+        # ahead of the current point are not sent again.
+        sequence, params, _, _ = self.pending
+        self.pending = None
+        old = self.sequence
+        cut = self.point
+        if self.index > 0:
+            cut = max(cut, old.com.time_at(self.index - 1))
+        self.point = sequence.t(old.tempo.time_to_bar(self.point))
+        cut = max(self.point, sequence.t(old.tempo.time_to_bar(cut)))
+        self.sequence = sequence
+        self.loop_start = params["loop_start"]
+        self.loop_point = params["loop_point"]
+        self.end_point = params["end_point"]
+        sequence.com.retain(self.loop_start, self.loop_point)
+        self.index = sequence.com.search(cut, side="right")
+        if self.lookahead > 0 and time.time() < self.horizon:
+            # Uploads wait on the server, so they go out before the
+            # bundle and only the readers' /n_set is stamped.
+            for tag, curve in sequence.automation.items():
+                fabric.load_automation(tag, curve, sequence.automation_rate)
+            with fabric.server.at(self.horizon):
+                self._restore(self.index, clavier, fabric)
+        else:
+            self._restore(self.index, clavier, fabric)
 
     def sweep(self, clavier, fabric):
         now = time.monotonic()
@@ -73,53 +179,197 @@ class Sequencer:
                 self.resume(clavier, fabric)
                 self.point += dt
             self._seek_end(self.point, clavier, fabric)
+            if self.pending is not None and self._swap_due():
+                self._swap(clavier, fabric)
+                self._seek_end(self.point, clavier, fabric)
             return self._estimate_next_event()
         else:
             self._seek_end(self.end_point, clavier, fabric)
+            self.release(clavier, fabric)
+
+    def release(self, clavier, fabric):
+        # Bundles already scheduled ahead may still create synths,
+        # so the release must not arrive before them.
+        if self.lookahead > 0 and time.time() < self.horizon:
+            with fabric.server.at(self.horizon):
+                for synth in clavier.values():
+                    synth.set(gate=0)
+        else:
             for synth in clavier.values():
                 synth.set(gate=0)
-            clavier.clear()
+        clavier.clear()
+        if self.sequence.automation:
+            fabric.halt_automation()
 
     def _seek(self, target, clavier, fabric):
-        while self.index < len(self.sequence.com) and self.sequence.com[self.index].time < target:
-            self.sequence.com[self.index].send(clavier, fabric)
-            self.index += 1
+        self._schedule(target, clavier, fabric, False)
 
     def _seek_end(self, target, clavier, fabric):
-        while self.index < len(self.sequence.com) and self.sequence.com[self.index].time <= target:
-            self.sequence.com[self.index].send(clavier, fabric)
-            self.index += 1
+        if self.lookahead > 0:
+            horizon = self.point + self.lookahead
+            if self.point <= self.loop_point < horizon:
+                return self._schedule(self.loop_point, clavier, fabric, False)
+            return self._schedule(min(horizon, self.end_point), clavier, fabric, True)
+        self._schedule(target, clavier, fabric, True)
+
+    # Messages sharing an instant go out as one bundle,
+    # timestamped only when playing ahead.
+    def _schedule(self, target, clavier, fabric, inclusive):
+        com = self.sequence.com
+        epoch = time.time() - self.point
+        while ((instant := com.time_at(self.index)) is not None
+                and (instant < target or inclusive and instant == target)):
+            timestamp = None
+            if self.lookahead > 0:
+                timestamp = self.horizon = epoch + instant
+            count = self.index
+            with fabric.server.at(timestamp):
+                while com.time_at(self.index) == instant:
+                    com[self.index].send(clavier, fabric)
+                    self.index += 1
+            if self.telemetry is not None:
+                self.telemetry.late(time.time() - epoch - instant, self.index - count)
 
     def _estimate_next_event(self):
-        if self.index < len(self.sequence.com):
-            if self.point <= self.loop_point <= self.sequence.com[self.index].time:
+        if (next_time := self.sequence.com.time_at(self.index)) is not None:
+            if self.point <= self.loop_point <= next_time:
                 return self.loop_point - self.point
-            return max(0.0, self.sequence.com[self.index].time - self.point)
+            if self.lookahead > 0:
+                return max(0.0, next_time - self.point - self.lookahead / 2)
+            return max(0.0, next_time - self.point)
         elif self.loop_point <= self.end_point:
             return max(0.0, self.loop_point - self.point)
         else:
             return max(0.0, self.end_point - self.point)
 
+class CommandQueue:
+    """Calls posted by one thread and run by another.
+
+    deque.append and deque.popleft are atomic, so with a single producer
+    and a single consumer neither side takes a lock."""
+    def __init__(self):
+        self.items = deque()
+
+    def post(self, fn, *args, **kwargs):
+        self.items.append((fn, args, kwargs))
+
+    def drain(self):
+        while self.items:
+            fn, args, kwargs = self.items.popleft()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
 class Player:
-    def __init__(self, clavier, fabric, sequencer):
+    # The player thread owns the clavier and every server-side change to
+    # the fabric. Other threads post commands, which run before each sweep.
+    def __init__(self, clavier, fabric, sequencer=None, telemetry=None):
         self.clavier = clavier
         self.fabric = fabric
         self.sequencer = sequencer
+        self.telemetry = None
+        self._instrument(telemetry)
+        self.dt = None
+        self.queue = CommandQueue()
         self.halt = threading.Event()
-        self.thread = threading.Thread(daemon=True, target=self._run, args=(clavier, fabric, sequencer))
+        self.closing = False
+        self.thread = threading.Thread(daemon=True, target=self._run)
         self.thread.start()
 
     def close(self):
+        self.closing = True
         self.halt.set()
         self.thread.join()
 
-    def _run(self, clavier, fabric, sequencer):
-        running = True
-        dt = sequencer.resume(clavier, fabric)
-        while dt is not None:
-            if self.halt.wait(timeout=dt):
-                break
-            dt = sequencer.sweep(clavier, fabric)
+    def post(self, fn, *args, **kwargs):
+        self.queue.post(fn, *args, **kwargs)
+        self.halt.set()
+
+    def play(self, sequencer):
+        self.post(self._play, sequencer)
+
+    def stop(self, release=True):
+        self.post(self._stop, release)
+
+    def seek(self, point):
+        self.post(self._seek, point)
+
+    def set_range(self, params):
+        self.post(self._set_range, params)
+
+    def swap(self, sequence, params, at_bar=False):
+        self.post(self._swap, sequence, params, at_bar)
+
+    def control(self, tag, **args):
+        self.post(self._control, tag, args)
+
+    def instrument(self, telemetry):
+        self.post(self._instrument, telemetry)
+
+    def _instrument(self, telemetry):
+        self.telemetry = telemetry
+        self.fabric.telemetry = telemetry
+        if self.sequencer is not None:
+            self.sequencer.telemetry = telemetry
+
+    def _play(self, sequencer):
+        self.sequencer = sequencer
+        sequencer.telemetry = self.telemetry
+        self.dt = sequencer.resume(self.clavier, self.fabric)
+
+    def _stop(self, release):
+        if self.sequencer is not None and release:
+            self.sequencer.release(self.clavier, self.fabric)
+        self.sequencer = None
+        self.dt = None
+
+    def _seek(self, point):
+        if self.sequencer is not None:
+            self.sequencer.point = point
+            self.dt = self.sequencer.resume(self.clavier, self.fabric)
+
+    def _set_range(self, params):
+        if self.sequencer is not None:
+            self.sequencer.loop_start = params["loop_start"]
+            self.sequencer.loop_point = params["loop_point"]
+            self.sequencer.end_point = params["end_point"]
+
+    def _swap(self, sequence, params, at_bar):
+        if self.sequencer is not None:
+            self.sequencer.swap(sequence, params, at_bar)
+
+    def voices(self):
+        # Voices in flight per tag, read from other threads.
+        counts = defaultdict(int)
+        for synth in list(self.clavier.values()):
+            counts[getattr(synth, "name", None)] += 1
+        return dict(counts)
+
+    def _control(self, tag, args):
+        if tag in self.fabric.synths:
+            self.fabric.control(tag, **args)
+
+    def _run(self):
+        if self.sequencer is not None:
+            self.dt = self.sequencer.resume(self.clavier, self.fabric)
+        while True:
+            start = time.monotonic()
+            if self.halt.wait(timeout=self.dt):
+                if self.closing:
+                    # Commands posted before close still run, the
+                    # fabric is usually closed by the last of them.
+                    self.queue.drain()
+                    break
+                self.halt.clear()
+            elif self.telemetry is not None and self.dt is not None:
+                self.telemetry.woke(time.monotonic() - start - self.dt)
+            self.queue.drain()
+            if self.sequencer is not None:
+                self.dt = self.sequencer.sweep(self.clavier, self.fabric)
+                if self.dt is None:
+                    self.sequencer = None
 
 @dataclass
 class Quadratic: 
@@ -129,6 +379,7 @@ class Quadratic:
     b : float
     c : float
     t : float
+    origin : Any = None
 
     def send(self, clavier, fabric):
         if self.tag not in fabric.synths:
@@ -150,6 +401,7 @@ class Control:
     time : float
     tag : str
     kwargs : Dict[str, Any]
+    origin : Any = None
 
     def send(self, clavier, fabric):
         #print('CONTROL', self.time, self.tag)
@@ -168,6 +420,7 @@ class Once:
     time : float
     tag : str
     kwargs : Dict[str, Any]
+    origin : Any = None
 
     def send(self, clavier, fabric):
         #print('ONCE', self.time, self.tag)
@@ -185,15 +438,22 @@ class Gate:
     group_id : int
     kwargs : Dict[str, Any]
     release : bool
+    origin : Any = None
 
     def send(self, clavier, fabric):
         #print('GATE', self.time, self.tag)
         if self.tag not in fabric.synths:
             return
         if self.release and self.group_id in clavier:
-            clavier.pop(self.group_id).set(gate=0, **self.kwargs)
+            synth = clavier.pop(self.group_id)
+            synth.set(**{"gate": 0, **self.kwargs})
+            fabric.keep_released(self.group_id, synth)
+        elif self.release and self.kwargs.get("gate", 0) < -1:
+            # A voice stolen while it was releasing is cut short.
+            if (synth := fabric.released.pop(self.group_id, None)) is not None:
+                synth.set(**self.kwargs)
         elif self.release:
-            fabric.synth(self.tag, gate=0, **self.kwargs)
+            fabric.synth(self.tag, **{"gate": 0, **self.kwargs})
         elif self.group_id in clavier:
             clavier[self.group_id].set(**self.kwargs)
         else:
@@ -212,27 +472,414 @@ class Gate:
                 kwargs = self.kwargs
             clavier[self.group_id] = Gate(self.time, self.tag, self.group_id, kwargs, False)
 
+QUADRATIC, CONTROL, ONCE, GATE = range(4)
+
+def intern_into(base, items):
+    # base extended with the items it lacks, and the index of each item.
+    index = {item: i for i, item in enumerate(base)}
+    out = list(base)
+    ids = []
+    for item in items:
+        if item not in index:
+            index[item] = len(out)
+            out.append(item)
+        ids.append(index[item])
+    return out, np.array(ids, dtype=np.int32)
+
+class EventTable:
+    """Time-sorted events stored column by column.
+
+    Keyword arguments are packed into one flat value list, described
+    by an interned tuple of keys per event. Events are materialised
+    only when indexed."""
+    def __init__(self, events=()):
+        layouts, tags, origins = {}, {}, {}
+        self.values = []
+        columns = []
+        for e in events:
+            if isinstance(e, Quadratic):
+                kind, keys, values = QUADRATIC, ("a", "b", "c", "t"), (e.a, e.b, e.c, e.t)
+            else:
+                kind = CONTROL if isinstance(e, Control) else ONCE if isinstance(e, Once) else GATE
+                keys, values = tuple(e.kwargs), tuple(e.kwargs.values())
+            columns.append((e.time, kind,
+                tags.setdefault(e.tag, len(tags)),
+                getattr(e, "group_id", -1),
+                getattr(e, "release", False),
+                layouts.setdefault(keys, len(layouts)),
+                len(self.values),
+                -1 if e.origin is None else origins.setdefault(e.origin, len(origins))))
+            self.values.extend(values)
+        self.layouts = list(layouts)
+        self.tags = list(tags)
+        self.origins = list(origins)
+        n = len(columns)
+        rows = list(zip(*columns)) if n else [()] * 8
+        self.times   = np.array(rows[0], dtype=np.float64).reshape(n)
+        self.kinds   = np.array(rows[1], dtype=np.int8).reshape(n)
+        self.tag_ids = np.array(rows[2], dtype=np.int32).reshape(n)
+        self.groups  = np.array(rows[3], dtype=np.int32).reshape(n)
+        self.release = np.array(rows[4], dtype=np.bool_).reshape(n)
+        self.layout  = np.array(rows[5], dtype=np.int32).reshape(n)
+        self.offsets = np.array(rows[6], dtype=np.int64).reshape(n)
+        self.origin  = np.array(rows[7], dtype=np.int32).reshape(n)
+
+    COLUMNS = ("times", "kinds", "tag_ids", "groups", "release", "layout", "offsets", "origin")
+
+    @classmethod
+    def from_columns(cls, columns, values, layouts, tags, origins=()):
+        # Columns may be read-only views, such as arrays mapped from a file.
+        table = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            setattr(table, name, columns[name])
+        table.values = values
+        table.layouts = [tuple(keys) for keys in layouts]
+        table.tags = list(tags)
+        table.origins = list(origins)
+        return table
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        keys = self.layouts[self.layout[i]]
+        offset = self.offsets[i]
+        values = self.values[offset:offset+len(keys)]
+        time = float(self.times[i])
+        tag = self.tags[self.tag_ids[i]]
+        origin = self.origins[self.origin[i]] if self.origin[i] >= 0 else None
+        kind = self.kinds[i]
+        if kind == QUADRATIC:
+            return Quadratic(time, tag, *values, origin)
+        kwargs = dict(zip(keys, values))
+        if kind == CONTROL:
+            return Control(time, tag, kwargs, origin)
+        if kind == ONCE:
+            return Once(time, tag, kwargs, origin)
+        return Gate(time, tag, int(self.groups[i]), kwargs, bool(self.release[i]), origin)
+
+    def splice(self, keep, other):
+        # The rows where keep is set, merged by time with the rows of
+        # other, without materialising events. Rows of self go first on
+        # ties. Values of dropped rows are not carried over.
+        rows = np.flatnonzero(keep)
+        tags, tag_map = intern_into(self.tags, other.tags)
+        layouts, layout_map = intern_into(self.layouts, other.layouts)
+        origins, origin_map = intern_into(self.origins, other.origins)
+        origin_map = np.append(origin_map, -1).astype(np.int32)
+        times = np.concatenate([self.times[rows], other.times])
+        order = np.argsort(times, kind="stable")
+        columns = {
+            "times": times,
+            "kinds": np.concatenate([self.kinds[rows], other.kinds]),
+            "tag_ids": np.concatenate([self.tag_ids[rows], tag_map[other.tag_ids]]),
+            "groups": np.concatenate([self.groups[rows], other.groups]),
+            "release": np.concatenate([self.release[rows], other.release]),
+            "layout": np.concatenate([self.layout[rows], layout_map[other.layout]]),
+            "offsets": np.concatenate([self.offsets[rows], other.offsets + len(self.values)]),
+            "origin": np.concatenate([self.origin[rows], origin_map[other.origin]]),
+        }
+        columns = {name: column[order] for name, column in columns.items()}
+        lengths = np.array([len(keys) for keys in layouts], dtype=np.int64)[columns["layout"]]
+        offsets = np.cumsum(lengths) - lengths
+        gather = np.repeat(columns["offsets"] - offsets, lengths) + np.arange(lengths.sum(), dtype=np.int64)
+        values = np.empty(len(self.values) + len(other.values), dtype=object)
+        values[:len(self.values)] = self.values
+        values[len(self.values):] = other.values
+        columns["offsets"] = offsets
+        return EventTable.from_columns(columns, values[gather].tolist(), layouts, tags, origins)
+
+    def time_at(self, index):
+        if index < len(self.times):
+            return float(self.times[index])
+
+    def search(self, point, side="left"):
+        return int(np.searchsorted(self.times, point, side=side))
+
+    def retain(self, start, stop):
+        pass
+
+    def origin_mask(self, origins):
+        ids = [i for i, origin in enumerate(self.origins) if origin in origins]
+        return np.isin(self.origin, ids)
+
+    def tag_mask(self, tags):
+        ids = [i for i, tag in enumerate(self.tags) if tag in tags]
+        return np.isin(self.tag_ids, ids)
+
+    @property
+    def nbytes(self):
+        return (self.times.nbytes + self.kinds.nbytes + self.tag_ids.nbytes
+              + self.groups.nbytes + self.release.nbytes + self.layout.nbytes
+              + self.offsets.nbytes + self.origin.nbytes)
+
+class EventStream:
+    """Time-sorted events pulled from a generator as playback needs them.
+
+    Only a window of events is kept, the ones behind it are folded into
+    the simulated state. Going back before the window restarts the
+    generator, except into the retained range, which is kept whole
+    so that looping over it does not."""
+    def __init__(self, source):
+        self.source = source
+        self.retained = None
+        self.rewind()
+
+    def rewind(self):
+        self.iterator = iter(self.source())
+        self.base = 0
+        self.window = deque()
+        self.state = {}, {}, {}
+        self.folded = -math.inf
+        self.done = False
+
+    def __iter__(self):
+        return iter(self.source())
+
+    def retain(self, start, stop):
+        self.retained = (start, stop) if 0 <= start < stop else None
+
+    def _pull(self, index):
+        if index < self.base:
+            self.rewind()
+        while self.base + len(self.window) <= index and not self.done:
+            if (e := next(self.iterator, None)) is None:
+                self.done = True
+            else:
+                self.window.append(e)
+        return index < self.base + len(self.window)
+
+    def _fold(self, index):
+        # Events before index are simulated and dropped, unless they are
+        # retained and the index has not left the retained range yet.
+        start = math.inf
+        if self.retained is not None and self.window:
+            last = self.window[min(index - self.base, len(self.window) - 1)]
+            if last.time < self.retained[1]:
+                start = self.retained[0]
+        while self.base < index and self.window and self.window[0].time < start:
+            e = self.window.popleft()
+            e.sim(*self.state)
+            self.folded = e.time
+            self.base += 1
+
+    def time_at(self, index):
+        if not self._pull(index):
+            return None
+        self._fold(index - 1)
+        return self.window[index - self.base].time
+
+    def __getitem__(self, index):
+        if not self._pull(index):
+            raise IndexError(index)
+        return self.window[index - self.base]
+
+    def search(self, point, side="left"):
+        before = (lambda t: t < point) if side == "left" else (lambda t: t <= point)
+        if not before(self.folded):
+            self.rewind()
+        index = self.base
+        while self._pull(index) and before(self.window[index - self.base].time):
+            index += 1
+            self._fold(index - 1)
+        return index
+
+    def state_at(self, index):
+        self._pull(index)
+        state = Checkpoint.snapshot(self.base, *self.state).restore()
+        for i in range(index - self.base):
+            self.window[i].sim(*state)
+        return state
+
+@dataclass(eq=False)
+class Brush:
+    entity : Any
+    config : Dict[str, Any]
+    shift : float
+    duration : float = 0.0
+    calls : List[Tuple[str, tuple]] = field(default_factory=list)
+
+@dataclass
+class VoicePolicy:
+    max_voices : int = 32
+    steal : str = "oldest" # oldest / quietest / same-pitch
+    limits : Dict[str, int] = field(default_factory=dict)
+    # Seconds a synth keeps sounding after its gate closes. The voice
+    # is not handed to another note before then.
+    release : float = 1.0
+    releases : Dict[str, float] = field(default_factory=dict)
+    # A stolen voice is released with a forced release this short.
+    fade : float = 0.02
+
+    def limit(self, tag):
+        return self.limits.get(tag, self.max_voices)
+
+    def release_time(self, tag):
+        return self.releases.get(tag, self.release)
+
+@dataclass(eq=False)
+class Voice:
+    id : int
+    start : float
+    kwargs : Dict[str, Any]
+
+    @property
+    def level(self):
+        for name in ("volume", "velocity", "amplitude"):
+            if name in self.kwargs:
+                return self.kwargs[name]
+        return 0.0
+
+def steal_voice(pool, gate, steal):
+    if steal == "same-pitch" and "note" in gate.kwargs:
+        for gid, voice in pool.items():
+            if voice.kwargs.get("note") == gate.kwargs["note"]:
+                return gid
+    if steal == "quietest":
+        return min(pool, key=lambda gid: (pool[gid].level, pool[gid].start))
+    return min(pool, key=lambda gid: pool[gid].start)
+
+def allocate_voices(events, policy, ids=None):
+    """Maps the group ids of gates to voices from a pool per tag.
+
+    A released voice keeps counting against its tag's limit until its
+    release time has passed, then its id goes back to the pool and is
+    handed to the next note. When a tag has as many voices sounding or
+    releasing as its limit allows, the new note takes the voice of the
+    oldest release, or else steals a held one, and the voice is cut with
+    a forced release of policy.fade seconds. The rest of a stolen note is
+    dropped. No tag uses more voice ids than its limit. Every tag numbers
+    its voices apart, through ids, so the voices of one tag don't depend
+    on the others. Returns the events, the number of notes stolen and the
+    peak number of voices per tag."""
+    stats = {"stolen": {}, "peak": {}}
+    output = list(allocate_stream(events, policy, stats, ids))
+    return output, sum(stats["stolen"].values()), stats["peak"]
+
+def allocate_stream(events, policy, stats, ids=None):
+    ids = {} if ids is None else ids
+    free = defaultdict(list)
+    tails = defaultdict(list)
+    count = defaultdict(int)
+    active = defaultdict(dict)
+    silenced = set()
+    stolen = stats["stolen"]
+    peak = stats["peak"]
+    def voice_id(tag, local):
+        key = tag, local
+        if key not in ids:
+            ids[key] = len(ids)
+        return ids[key]
+    for e in events:
+        if not isinstance(e, Gate):
+            yield e
+            continue
+        if e.group_id in silenced:
+            if e.release:
+                silenced.discard(e.group_id)
+            continue
+        pool = active[e.tag]
+        tail = tails[e.tag]
+        while tail and tail[0][0] <= e.time:
+            heapq.heappush(free[e.tag], heapq.heappop(tail)[1])
+        if (voice := pool.get(e.group_id)) is None:
+            if not e.release and len(pool) + len(tail) >= policy.limit(e.tag):
+                # EnvGen releases in -1 - gate seconds when gate is below -1.
+                kwargs = {"gate": -1.0 - policy.fade}
+                if tail:
+                    _, vid = heapq.heappop(tail)
+                else:
+                    gid = steal_voice(pool, e, policy.steal)
+                    vid = pool.pop(gid).id
+                    silenced.add(gid)
+                    stolen[e.tag] = stolen.get(e.tag, 0) + 1
+                yield Gate(e.time, e.tag, voice_id(e.tag, vid), kwargs, True, e.origin)
+            elif free[e.tag]:
+                vid = heapq.heappop(free[e.tag])
+            else:
+                vid = count[e.tag]
+                count[e.tag] += 1
+            voice = pool[e.group_id] = Voice(vid, e.time, dict(e.kwargs))
+            peak[e.tag] = max(peak.get(e.tag, 0), len(pool) + len(tail))
+        else:
+            voice.kwargs.update(e.kwargs)
+        yield Gate(e.time, e.tag, voice_id(e.tag, voice.id), e.kwargs, e.release, e.origin)
+        if e.release:
+            del pool[e.group_id]
+            heapq.heappush(tail, (e.time + policy.release_time(e.tag), voice.id))
+
 class SequenceBuilder:
-    def __init__(self, group_ids):
+    def __init__(self, group_ids, previous=None, voices=None, envelope_rate=None, voice_ids=None):
         self.quadratics = defaultdict(list)
         self.controls = []
         self.onces = []
         self.gates = []
         self.group_ids = group_ids
+        self.voices = voices
+        # When set, automation lanes are sampled into curves
+        # at this rate instead of becoming Quadratic events.
+        self.envelope_rate = envelope_rate
+        # Brushes recorded on the previous build. If a brush is unchanged,
+        # its calls are replayed and its events are kept from the old sequence.
+        self.previous = previous
+        self.brushes = {}
+        self.dirty = set()
+        self.origin = None
+        self.recording = None
+        self.sequence = None
+        # Per tag, as a splice only rebuilds the tags it touches.
+        if voice_ids is None:
+            voice_ids = {} if previous is None else previous.voice_ids
+        self.voice_ids = voice_ids
+        self.removed = {}
+        self.stolen = {}
+        self.peak = {}
+
+    def begin_brush(self, key, entity, config, shift):
+        if self.previous is not None:
+            brush = self.previous.brushes.get(key)
+            if (brush is not None and brush.entity is entity
+                and brush.shift == shift and brush.config == config):
+                self.brushes[key] = brush
+                self.origin = key
+                for name, args in brush.calls:
+                    getattr(self, name)(*args)
+                self.origin = None
+                return brush.duration
+        self.brushes[key] = self.recording = Brush(entity, config, shift)
+        self.dirty.add(key)
+        self.origin = key
+
+    def end_brush(self, duration):
+        self.recording.duration = duration
+        self.recording = None
+        self.origin = None
+
+    def record(self, name, *args):
+        if self.recording is not None:
+            self.recording.calls.append((name, args))
 
     def quadratic(self, bar, tag, transition, value):
+        self.record("quadratic", bar, tag, transition, value)
         self.quadratics[tag].append((bar, transition, value))
 
     def control(self, bar, tag, args):
-        self.controls.append((bar, tag, args))
+        self.record("control", bar, tag, args)
+        self.controls.append((bar, tag, args, self.origin))
  
     def once(self, bar, tag, args):
-        self.onces.append((bar, tag, args))
+        self.record("once", bar, tag, args)
+        self.onces.append((bar, tag, args, self.origin))
 
     def gate(self, bar, tag, group_key, args):
+        self.record("gate", bar, tag, group_key, args)
         if group_key not in self.group_ids:
             self.group_ids[group_key] = len(self.group_ids)
-        self.gates.append((bar, tag, self.group_ids[group_key], args))
+        self.gates.append((bar, tag, self.group_ids[group_key], args, self.origin))
 
     def prepare(self):
         for tag, events in self.quadratics.items():
@@ -240,53 +887,205 @@ class SequenceBuilder:
         self.gates.sort(key=lambda x: x[0])
  
     def build(self, end):
+        previous = self.previous
+        if previous is None or (sequence := self.splice(end)) is None:
+            sequence = self.build_all(end)
+        if self.envelope_rate is not None:
+            sequence.automation = self.sample_automation(sequence.tempo, sequence.end)
+            sequence.automation_rate = self.envelope_rate
+        self.previous = None
+        self.sequence = sequence
+        return sequence
+
+    def build_all(self, end):
+        tempo, output = self.timeline()
+        com = EventTable(self.finish(output))
+        sequence = Sequence(tempo, com, tempo.bar_to_time(end))
+        sequence.take_checkpoints()
+        return self.count(sequence)
+
+    def timeline(self):
         self.prepare()
-        releases = {}
-        for i, (time, tag, group_id, args) in enumerate(self.gates):
-            releases[group_id] = i
- 
-        def conv(events):
-            return [(bar, transition, float(value)) for bar, transition, value in events]
- 
         tempo = music.tempo_envelope(
             conv(self.quadratics.get("tempo", [(0.0, False, 15.0)])))
-        quadratics = {
-            tag: music.envelope(conv(events))
-            for tag, events in self.quadratics.items()}
- 
         output = []
         output.extend(tempo_events(tempo))
-        for name, env in quadratics.items():
-            if name != "tempo":
-                output.extend(quadratic_events(tempo, env, name))
+        for name, events in self.quadratics.items():
+            if name != "tempo" and self.envelope_rate is None:
+                output.extend(quadratic_events(tempo, music.envelope(conv(events)), name))
+        output.extend(self.timed_events(tempo, None))
+        output.sort(key=lambda x: x.time)
+        return tempo, output
+
+    def finish(self, events):
+        # Compaction and voice allocation only look at the events of one
+        # tag at a time, so they give the same messages for a tag whether
+        # they run over the whole song or over that tag alone.
+        com, self.removed = compact(events, self.removed)
+        if self.voices is not None:
+            stats = {"stolen": self.stolen, "peak": self.peak}
+            com = list(allocate_stream(com, self.voices, stats, self.voice_ids))
+        return com
+
+    def count(self, sequence):
+        sequence.removed = sum(self.removed.values())
+        sequence.stolen = sum(self.stolen.values())
+        sequence.peak_voices = dict(self.peak)
+        return sequence
+
+    def splice(self, end):
+        # Only the tags touched by changed brushes are built again,
+        # every other row is kept from the previous sequence.
+        previous = self.previous
+        dirty = self.dirty | (previous.brushes.keys() - self.brushes.keys())
+        tags = set()
+        for key in dirty:
+            for brush in (previous.brushes.get(key), self.brushes.get(key)):
+                if brush is not None:
+                    tags.update(args[1] for name, args in brush.calls)
+        if "tempo" in tags or previous.sequence is None:
+            return None
+        tempo = previous.sequence.tempo
+        if not dirty:
+            self.removed, self.stolen, self.peak = previous.removed, previous.stolen, previous.peak
+            return replace(previous.sequence, end=tempo.bar_to_time(end))
+
+        self.removed, self.stolen, self.peak = (
+            {tag: n for tag, n in stats.items() if tag not in tags}
+            for stats in (previous.removed, previous.stolen, previous.peak))
+        fresh = []
+        for name in tags:
+            if self.quadratics.get(name) and self.envelope_rate is None:
+                events = sorted(self.quadratics[name], key=lambda x: x[0])
+                fresh.extend(quadratic_events(tempo, music.envelope(conv(events)), name))
+        fresh.extend(self.timed_events(tempo, tags))
+        fresh.sort(key=lambda x: x.time)
+        old = previous.sequence.com
+        dropped = old.tag_mask(tags)
+        table = EventTable(self.finish(fresh))
+        com = old.splice(~dropped, table)
+        # Rows before the first dropped or inserted one are unchanged.
+        unchanged = min(np.flatnonzero(dropped)[:1].tolist() + [len(old)])
+        if len(table.times):
+            unchanged = min(unchanged, int(np.searchsorted(com.times, table.times[0])))
+        sequence = Sequence(tempo, com, tempo.bar_to_time(end))
+        sequence.take_checkpoints(previous=previous.sequence.checkpoints, unchanged=unchanged)
+        return self.count(sequence)
+
+    def sample_automation(self, tempo, end):
+        rate = self.envelope_rate
+        ts = np.arange(int(math.ceil(end * rate)) + 2) / rate
+        bars = tempo.times_to_bars(ts)
+        curves = {}
+        for name, events in self.quadratics.items():
+            if name != "tempo" and events:
+                events = sorted(events, key=lambda x: x[0])
+                env = music.envelope(conv(events))
+                curves[name] = env.evaluate_many(bars).astype(np.float32)
+        return curves
+
+    def timed_events(self, tempo, tags):
+        def select(events):
+            if tags is None:
+                return events
+            return [e for e in events if e[1] in tags]
+        gates = select(self.gates)
+        gates.sort(key=lambda x: x[0])
+        releases = {}
+        for i, (bar, tag, group_id, args, origin) in enumerate(gates):
+            releases[group_id] = i
 
-        for bar, tag, args in self.controls:
-            time = tempo.bar_to_time(bar)
-            output.append(Control(time, tag, args))
+        controls = select(self.controls)
+        onces = select(self.onces)
+        times = tempo.bars_to_times(
+            [e[0] for e in controls] + [e[0] for e in onces] + [e[0] for e in gates]).tolist()
+        control_times = times[:len(controls)]
+        once_times = times[len(controls):len(controls)+len(onces)]
+        gate_times = times[len(controls)+len(onces):]
+
+        for time, (bar, tag, args, origin) in zip(control_times, controls):
+            yield Control(time, tag, args, origin)
  
-        for bar, tag, args in self.onces:
-            time = tempo.bar_to_time(bar)
-            output.append(Once(time, tag, args))
+        for time, (bar, tag, args, origin) in zip(once_times, onces):
+            yield Once(time, tag, args, origin)
  
-        for i, (bar, tag, group_id, args) in enumerate(self.gates):
-            time = tempo.bar_to_time(bar)
-            output.append(Gate(time, tag, group_id, args, (i == releases[group_id])))
+        for i, (time, (bar, tag, group_id, args, origin)) in enumerate(zip(gate_times, gates)):
+            yield Gate(time, tag, group_id, args, (i == releases[group_id]), origin)
 
-        output.sort(key=lambda x: x.time)
+def compact(events, removed=None):
+    """Removes redundant control messages from time-sorted events.
+
+    Controls to the same tag at the same instant are merged into one set,
+    and parameters that already hold the simulated value are dropped.
+    Tags that also play notes are not deduplicated, because a set on
+    their group does not reach notes started later. Returns the events
+    and the number of messages removed, or the numbers per tag counted
+    into removed when it is given."""
+    voiced = {e.tag for e in events if not isinstance(e, (Control, Quadratic))}
+    stats = {} if removed is None else removed
+    output = list(compact_stream(events, voiced, stats))
+    if removed is None:
+        return output, sum(stats.values())
+    return output, stats
 
-        return Sequence(tempo, output, tempo.bar_to_time(end))
+def compact_stream(events, voiced, removed):
+    # An instant is held back until it is complete, as later controls
+    # merge into earlier ones. A tag joins voiced at its first note.
+    controls = {}
+    pending = {}
+    instant = []
+    for e in events:
+        if instant and instant[0].time != e.time:
+            yield from instant
+            instant = []
+        if not isinstance(e, Control):
+            if not isinstance(e, Quadratic):
+                voiced.add(e.tag)
+            pending.pop(e.tag, None)
+            instant.append(e)
+            continue
+        state = controls.setdefault(e.tag, {})
+        if e.tag in voiced:
+            kwargs = dict(e.kwargs)
+        else:
+            kwargs = {n: v for n, v in e.kwargs.items() if n not in state or state[n] != v}
+        state.update(e.kwargs)
+        head = pending.get(e.tag)
+        if head is not None and head.time == e.time:
+            head.kwargs.update(kwargs)
+            removed[e.tag] = removed.get(e.tag, 0) + 1
+        elif kwargs:
+            pending[e.tag] = head = Control(e.time, e.tag, kwargs, e.origin)
+            instant.append(head)
+        else:
+            removed[e.tag] = removed.get(e.tag, 0) + 1
+    yield from instant
+
+def conv(events):
+    return [(bar, transition, float(value)) for bar, transition, value in events]
 
 class SequenceBuilder2(SequenceBuilder):
-    def __init__(self, group_ids, descriptors):
-        super().__init__(group_ids)
+    def __init__(self, group_ids, descriptors, previous=None, voices=None, envelope_rate=None, voice_ids=None):
+        super().__init__(group_ids, previous, voices, envelope_rate, voice_ids)
         self.descriptors = descriptors
 
+    def premap(self, tag, args):
+        # Pitches are resolved to note numbers, but not to the values the
+        # server gets: the fabric keeps a trail of the values as written.
+        if tag not in self.descriptors:
+            return args
+        return {n: to_plain(v) for n, v in args.items()}
+
+    def control(self, bar, tag, args):
+        super().control(bar, tag, self.premap(tag, args))
+
     def has_gate(self, tag):
         if tag in self.descriptors:
             return self.descriptors[tag].synthdef.has_gate
         return False
 
     def note(self, tag, start, duration, group_key, args):
+        args = self.premap(tag, args)
         if self.has_gate(tag):
             self.gate(start, tag, group_key, args)
             if duration > 0:
@@ -294,6 +1093,169 @@ class SequenceBuilder2(SequenceBuilder):
         else:
             self.once(start, tag, args)
 
+class StreamingSequenceBuilder(SequenceBuilder2):
+    """Builds a sequence whose brushes are expanded while it plays.
+
+    Construction only plans the brushes. Each one is expanded ahead of
+    the events reaching its start, and the brushes sounding at a time are
+    merged into one stream, so memory follows what plays next instead of
+    the length of the song. Automation lanes are still built whole, as
+    the tempo map needs them before any time is known. When a condition
+    is given, expansion is left to the thread that owns it, see
+    Expansions."""
+    def __init__(self, proc, descriptors, voices=None, envelope_rate=None, condition=None):
+        super().__init__({}, descriptors, None, voices, envelope_rate)
+        self.proc = proc
+        self.plan = []
+        self.patterns = {}
+        self.condition = condition
+        self.expansions = None
+
+    def begin_brush(self, key, entity, config, shift):
+        cons = self.proc.constructor(config)
+        pattern, duration = self.pattern(key, entity, config)
+        if cons == self.proc.construct_quadratic:
+            cons(self, config, pattern, shift, key)
+        elif cons is not None:
+            self.plan.append((shift, len(self.plan), key, config, cons, pattern))
+        return duration
+
+    def pattern(self, key, entity, config):
+        # Patterns laid out by get_dimensions are used as they are, others
+        # are evaluated once for every brush and config they appear with.
+        dimensions = self.proc.dimensions.get(key)
+        if dimensions is not None and dimensions[4] is not None and dimensions[2] == config:
+            return dimensions[4], dimensions[0]
+        for other, pattern, duration in self.patterns.get(id(entity), ()):
+            if other == config:
+                return pattern, duration
+        _, pattern, duration = self.proc.evaluate(entity, config)
+        self.patterns.setdefault(id(entity), []).append((config, pattern, duration))
+        return pattern, duration
+
+    def build(self, end):
+        tempo, fixed = self.timeline()
+        end = tempo.bar_to_time(end)
+        self.plan.sort(key=lambda x: x[:2])
+        starts = tempo.bars_to_times([shift for shift, *_ in self.plan]).tolist()
+        plan = [(start,) + brush for start, brush in zip(starts, self.plan)]
+        expansions = Expansions(lambda index, group_id: self.expand(tempo, plan[index], group_id),
+                                len(plan), self.condition)
+        stream = EventStream(lambda: self.stream(fixed, plan, expansions))
+        sequence = Sequence(tempo, stream, end)
+        if self.envelope_rate is not None:
+            sequence.automation = self.sample_automation(tempo, end)
+            sequence.automation_rate = self.envelope_rate
+        self.expansions = expansions
+        self.sequence = sequence
+        return sequence
+
+    def stream(self, fixed, plan, expansions):
+        events = heapq.merge(fixed, self.brush_events(plan, expansions), key=lambda x: x.time)
+        events = compact_stream(events, set(), {})
+        if self.voices is not None:
+            events = allocate_stream(events, self.voices, {"stolen": {}, "peak": {}}, self.voice_ids)
+        return events
+
+    def brush_events(self, plan, expansions):
+        # Ties are broken by kind and then by document order,
+        # which puts events in the order a whole build has them.
+        rank = {Control: 0, Once: 1, Gate: 2}
+        heap = []
+        plan = iter(enumerate(plan))
+        pending = next(plan, None)
+        while heap or pending is not None:
+            while pending is not None and (not heap or pending[1][0] <= heap[0][0]):
+                index, (start, shift, order, *_) = pending
+                events = expansions.get(index)
+                if events:
+                    heapq.heappush(heap, (events[0].time, rank[type(events[0])], order, 0, events))
+                pending = next(plan, None)
+            if heap:
+                _, _, order, i, events = heap[0]
+                if i + 1 < len(events):
+                    e = events[i + 1]
+                    heapq.heapreplace(heap, (e.time, rank[type(e)], order, i + 1, events))
+                else:
+                    heapq.heappop(heap)
+                yield events[i]
+
+    def expand(self, tempo, brush, group_id):
+        # Group ids are numbered per stream, so that expanding the same
+        # brush again after a rewind gives the same ids.
+        start, shift, order, key, config, cons, pattern = brush
+        sb = SequenceBuilder2({}, self.descriptors, envelope_rate=self.envelope_rate)
+        sb.origin = key
+        cons(sb, config, pattern, shift, key)
+        sb.gates = [(bar, tag, g + group_id, args, origin) for bar, tag, g, args, origin in sb.gates]
+        events = list(sb.timed_events(tempo, None))
+        events.sort(key=lambda x: x.time)
+        return events, len(sb.group_ids)
+
+class Expansions:
+    """Brushes of a streamed sequence, expanded ahead of playback.
+
+    The player takes brushes in plan order, while the thread owning the
+    condition calls work() to expand the next few. A brush that isn't
+    ready in time, or any brush once the expansions are detached, is
+    expanded where it is asked for. Group ids carry over from one brush
+    to the next, so brushes are first expanded in order, after which each
+    can be expanded again by itself."""
+    def __init__(self, expand, count, condition=None, ahead=8, keep=32, patience=0.02):
+        self.expand = expand
+        self.count = count
+        self.attached = condition is not None
+        self.condition = threading.Condition() if condition is None else condition
+        self.ahead = ahead
+        self.keep = keep
+        self.patience = patience
+        self.ready = OrderedDict()
+        self.offsets = [0]
+        self.wanted = 0
+
+    def pending(self):
+        # The brush work() expands next, to be called with the condition held.
+        if not self.attached:
+            return None
+        for index in range(self.wanted, min(self.wanted + self.ahead, self.count, len(self.offsets))):
+            if index not in self.ready:
+                return index
+        return None
+
+    def work(self):
+        with self.condition:
+            index = self.pending()
+        if index is not None:
+            self._expand(index)
+
+    def detach(self):
+        with self.condition:
+            self.attached = False
+            self.condition.notify_all()
+
+    def get(self, index):
+        with self.condition:
+            self.wanted = index
+            self.condition.notify_all()
+            if self.attached:
+                self.condition.wait_for(lambda: index in self.ready, self.patience)
+            if (events := self.ready.get(index)) is not None:
+                self.ready.move_to_end(index)
+                return events
+        return self._expand(index)
+
+    def _expand(self, index):
+        events, count = self.expand(index, self.offsets[index])
+        with self.condition:
+            if index + 1 == len(self.offsets):
+                self.offsets.append(self.offsets[index] + count)
+            self.ready[index] = events
+            self.ready.move_to_end(index)
+            while len(self.ready) > self.keep:
+                self.ready.popitem(last=False)
+            self.condition.notify_all()
+        return events
+
 def tempo_events(tempo):
     for i, t in enumerate(tempo.xs):
         dt = tempo.xs[i+1] - t if i+1 < len(tempo.xs) else 0
@@ -304,9 +1266,10 @@ def tempo_events(tempo):
 def quadratic_events(tempo, env, tag):
     bs = list(set(tempo.bs + env.xs))
     bs.sort()
+    ts = tempo.bars_to_times(bs).tolist()
     for i, b in enumerate(bs):
-        t = tempo.bar_to_time(b)
-        dt = tempo.bar_to_time(bs[i+1]) - t if i+1 < len(bs) else 0
+        t = ts[i]
+        dt = ts[i+1] - t if i+1 < len(bs) else 0
         m, c = tempo.equation(t)
         k, y = env.equation(b)
         #b(t) = c/60*t + m/120*t*t
@@ -0,0 +1,134 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+from fabric2 import DefinitionCache, source_hash
+from model2 import synthlang
+import hashlib
+import json
+import os
+import time
+
+# Builds the synthdef library incrementally.
+#
+# Synthdefs written in Python are already built by the time they are
+# registered, so they are compiled in-process and only written when their
+# compiled bytes or descriptor changed. The .synth sources are parsed in a
+# process pool and stored in the Definitions cache, so the editor starts
+# without parsing them. A manifest keeps the source hash of every output.
+
+MANIFEST = ".build.json"
+
+@dataclass
+class BuildJob:
+    name : str
+    kind : str # "python" / "synth"
+    digest : str
+    payload : Any
+
+@dataclass
+class BuildResult:
+    name : str
+    kind : str
+    status : str # "built" / "skipped" / "failed"
+    seconds : float
+    error : Optional[str] = None
+
+def desc_text(params):
+    return "\n".join(f"{n}: {v}" for n, v in params.items())
+
+def python_job(synthdef, params):
+    compiled = synthdef.compile()
+    desc = desc_text(params).encode("utf-8")
+    digest = hashlib.sha1(compiled + b"\0" + desc).hexdigest()
+    return BuildJob(synthdef.effective_name, "python", digest, (compiled, desc))
+
+def synth_jobs(directory):
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".synth"):
+            name = os.path.splitext(filename)[0]
+            with open(os.path.join(directory, filename), "rb") as fd:
+                data = fd.read()
+            yield BuildJob(name, "synth", source_hash(name, data), data)
+
+def write_atomic(filename, data):
+    partial = filename + f".{os.getpid()}.partial"
+    with open(partial, "wb") as fd:
+        fd.write(data)
+    os.replace(partial, filename)
+
+def run_job(directory, job):
+    now = time.perf_counter()
+    try:
+        if job.kind == "python":
+            compiled, desc = job.payload
+            write_atomic(os.path.join(directory, job.name + ".scsynthdef"), compiled)
+            write_atomic(os.path.join(directory, job.name + ".desc"), desc)
+        else:
+            dfn = synthlang.from_string(job.payload.decode("utf-8"), job.name)
+            DefinitionCache(os.path.join(directory, ".cache")).put(job.name, job.digest, dfn)
+    except Exception as e:
+        return BuildResult(job.name, job.kind, "failed", time.perf_counter() - now, repr(e))
+    return BuildResult(job.name, job.kind, "built", time.perf_counter() - now)
+
+def outputs_exist(directory, job):
+    if job.kind == "python":
+        names = [job.name + ".scsynthdef", job.name + ".desc"]
+    else:
+        names = [os.path.join(".cache", job.name + ".pickle")]
+    return all(os.path.exists(os.path.join(directory, n)) for n in names)
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+def build(directory, registered=(), max_workers=None, force=False, parallel_threshold=8):
+    if not os.path.exists(directory):
+        os.mkdir(directory)
+    jobs = [python_job(synthdef, params) for synthdef, params in registered]
+    jobs.extend(synth_jobs(directory))
+    manifest = read_manifest(directory)
+    results = []
+    stale = []
+    for job in jobs:
+        if not force and manifest.get(job.name) == job.digest and outputs_exist(directory, job):
+            results.append(BuildResult(job.name, job.kind, "skipped", 0.0))
+        else:
+            stale.append(job)
+    # Parsing is the slow part, python jobs only write two files.
+    parsed = [job for job in stale if job.kind == "synth"]
+    written = [job for job in stale if job.kind != "synth"]
+    if len(parsed) >= parallel_threshold and max_workers != 1:
+        with ProcessPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(run_job, directory, job) for job in parsed]
+            results.extend(run_job(directory, job) for job in written)
+            results.extend(future.result() for future in futures)
+    else:
+        results.extend(run_job(directory, job) for job in stale)
+    digests = {job.name: job.digest for job in jobs}
+    for result in results:
+        if result.status != "failed":
+            manifest[result.name] = digests[result.name]
+        else:
+            manifest.pop(result.name, None)
+    for name in set(manifest) - set(digests):
+        manifest.pop(name)
+    write_atomic(os.path.join(directory, MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return results
+
+def report(results, total=None):
+    for r in sorted(results, key=lambda r: (r.status, r.name)):
+        line = f"{r.status:8} {r.kind:6} {r.name:32} {r.seconds*1000:8.2f}ms"
+        if r.error:
+            line += "  " + r.error
+        print(line)
+    counts = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    summary = ", ".join(f"{n} {s}" for s, n in sorted(counts.items()))
+    if total is not None:
+        summary += f" in {total*1000:.1f}ms"
+    print(summary)
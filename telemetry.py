@@ -0,0 +1,108 @@
+from collections import defaultdict
+import json
+import numpy as np
+import os
+import time
+
+# Playback measurements, recorded by the player thread when enabled.
+#
+# Lateness is the time an instant was sent minus the time it is due.
+# With lookahead it is negative, as bundles leave ahead of their
+# timestamp, and any positive value is a bundle the server got too late.
+# Overshoot is how far past its timeout the player woke up.
+
+class Histogram:
+    """Counts of values in fixed-width bins from low to high.
+
+    Values outside the range are counted in the first and last bins."""
+    def __init__(self, low, high, bins):
+        self.low = low
+        self.high = high
+        self.width = (high - low) / bins
+        self.counts = [0] * (bins + 2)
+        self.total = 0
+        self.max = None
+
+    def add(self, value, count=1):
+        i = int((value - self.low) // self.width) + 1
+        self.counts[min(max(i, 0), len(self.counts) - 1)] += count
+        self.total += count
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Upper edge of the bin holding the q-th value.
+        if self.total == 0:
+            return None
+        k = int(np.searchsorted(np.cumsum(self.counts), q * self.total, side="left"))
+        return min(max(self.low + k * self.width, self.low), self.high)
+
+    def above(self, value):
+        # Count of values in the bins starting at or after value.
+        i = int(np.ceil((value - self.low) / self.width)) + 1
+        return sum(self.counts[min(max(i, 0), len(self.counts) - 1):])
+
+    def to_dict(self):
+        return {"low": self.low, "high": self.high, "width": self.width,
+                "counts": list(self.counts), "total": self.total, "max": self.max}
+
+def pad(n):
+    return (n + 4) & ~3
+
+def osc_size(address, args):
+    # Length of the encoded OSC message, strings are padded to 4 bytes
+    # with at least one null, numbers take 4 bytes.
+    size = pad(len(address)) + pad(len(args) + 1)
+    for arg in args:
+        size += pad(len(arg.encode("utf-8"))) if isinstance(arg, str) else 4
+    return size
+
+class Telemetry:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lateness = Histogram(-250.0, 250.0, 1000)
+        self.overshoot = Histogram(0.0, 50.0, 500)
+        self.messages = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+    def late(self, seconds, count=1):
+        self.lateness.add(seconds * 1000, count)
+
+    def woke(self, seconds):
+        self.overshoot.add(seconds * 1000)
+
+    def message(self, tag, address, params, *args):
+        # Parameter names are padded strings and values are numbers.
+        size = osc_size(address, args) - pad(len(args) + 1) + pad(len(args) + 2 * len(params) + 1)
+        for name in params:
+            size += pad(len(name)) + 4
+        self.messages[tag] += 1
+        self.bytes[tag] += size
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        text = f"{sum(self.messages.values()) / elapsed:.0f} msg/s"
+        if (p50 := self.lateness.quantile(0.5)) is not None:
+            text += (f" late p50={p50:.1f}ms p99={self.lateness.quantile(0.99):.1f}ms"
+                     f" ({self.lateness.above(0.0)} late)")
+        if (p99 := self.overshoot.quantile(0.99)) is not None:
+            text += f" wake p99={p99:.1f}ms"
+        return text
+
+    def to_dict(self):
+        elapsed = time.monotonic() - self.started
+        messages, sizes = dict(self.messages), dict(self.bytes)
+        return {
+            "elapsed": elapsed,
+            "lateness_ms": self.lateness.to_dict(),
+            "overshoot_ms": self.overshoot.to_dict(),
+            "tags": {tag: {"messages": n, "bytes": sizes.get(tag, 0),
+                           "messages_per_second": n / elapsed if elapsed > 0 else 0.0}
+                     for tag, n in sorted(messages.items())},
+        }
+
+    def dump(self, filename):
+        partial = filename + f".{os.getpid()}.partial"
+        with open(partial, "w", encoding="utf-8") as fd:
+            json.dump(self.to_dict(), fd, indent=2)
+        os.replace(partial, filename)